@@ -24,7 +24,10 @@
 __author__ = 'Ross Light'
 __date__ = 'March 30, 2008'
 __docformat__ = 'reStructuredText'
-__all__ = ['charts',
+__all__ = ['benchmarks',
+           'cache',
+           'charts',
+           'clock',
            'commands',
            'controllers',
            'email',
@@ -32,18 +35,23 @@ __all__ = ['charts',
            'json',
            'markup',
            'model',
+           'projector',
            'release',
            'tests',
            'util',
            'widgets',]
 
-from hvz import (charts,
+from hvz import (benchmarks,
+                 cache,
+                 charts,
+                 clock,
                  commands,
                  controllers,
                  email,
                  forms,
                  json,
                  markup,
+                 projector,
                  release,
                  tests,
                  util,
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+#
+#   benchmarks/__init__.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Performance benchmarks for the model"""
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['generate',
+           'suite',]
+
+from hvz.benchmarks import (generate,
+                            suite,)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+#   benchmarks/generate.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Synthetic games for benchmarking
+
+`generate_game` plays out a game through the normal model methods, so the
+entries, event log, and summaries look like those of a real game: zombies
+kill during waking hours, some of them starve, and the game is stopped while
+there are still humans left (and infected waiting to turn).
+"""
+
+from datetime import date, datetime, timedelta
+import random
+
+from turbogears.database import session
+
+from hvz.model.dates import as_local
+from hvz.model.errors import InvalidTimeError
+from hvz.model.game import Game, PlayerEntry
+from hvz.model.identity import User
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['START_TIME',
+           'IGNORE_DATES',
+           'IGNORE_WEEKDAYS',
+           'KILL_PROBABILITY',
+           'SURVIVORS',
+           'GeneratedGame',
+           'generate_game',]
+
+START_TIME = datetime(2008, 4, 21, 9, 0)
+IGNORE_DATES = [date(2008, 4, 30), date(2008, 5, 14)]
+IGNORE_WEEKDAYS = [6, 7]
+KILL_PROBABILITY = 0.1
+SURVIVORS = 0.1
+
+_WAKING_HOURS = xrange(8, 22)
+_FLUSH_INTERVAL = 500
+
+class GeneratedGame(object):
+    """
+    A game made by `generate_game`.
+    
+    :IVariables:
+        game_id : int
+            The game's database identifier
+        user_ids : list of int
+            The players' user IDs
+        time : datetime.datetime
+            When the simulation stopped.  Nothing in the game happens after
+            this.
+        kills : int
+            How many kills were reported
+    """
+    def __init__(self, game_id, user_ids, time, kills):
+        self.game_id = game_id
+        self.user_ids = user_ids
+        self.time = time
+        self.kills = kills
+    
+    def __repr__(self):
+        return "<GeneratedGame %i, %i players>" % (self.game_id,
+                                                   len(self.user_ids))
+    
+    @property
+    def game(self):
+        return Game.query.get(self.game_id)
+
+def _create_players(game, players):
+    entries = []
+    for i in xrange(players):
+        name = u"player%i" % (i + 1)
+        user = User(name, u"Player %i" % (i + 1), u"%s@example.com" % (name))
+        entries.append(PlayerEntry(game, user))
+        if (i + 1) % _FLUSH_INTERVAL == 0:
+            session.flush()
+    session.flush()
+    return entries
+
+def _hours(start):
+    """Yields the waking hours on non-ignored days, starting at *start*."""
+    time = start
+    while True:
+        time += timedelta(hours=1)
+        if time.hour not in _WAKING_HOURS:
+            continue
+        if time.date() in IGNORE_DATES or \
+           time.isoweekday() in IGNORE_WEEKDAYS:
+            continue
+        yield as_local(time)
+
+def generate_game(players, seed=0, kill_probability=KILL_PROBABILITY,
+                  survivors=SURVIVORS):
+    """
+    Creates users and plays out a game with them.
+    
+    One player is made the original zombie, who makes the first kill in the
+    first hour so that the outbreak gets going.  Then, for each waking hour on
+    days that aren't ignored, the game is updated and every zombie kills a
+    random human with probability *kill_probability*.  Zombies that go
+    without feeding for too long starve as usual.  The game stops (but
+    doesn't end) when only a *survivors* fraction of the humans are left or
+    the zombies have all starved.
+    
+    :Parameters:
+        players : int
+            The number of players
+        seed
+            The random seed, so the same game can be generated again
+        kill_probability : float
+            The chance that a zombie kills in any given hour
+        survivors : float
+            The fraction of players to leave human
+    :ReturnType: `GeneratedGame`
+    """
+    rng = random.Random(seed)
+    game = Game(u"Benchmark (%i players)" % (players))
+    game.ignore_dates = IGNORE_DATES
+    game.ignore_weekdays = IGNORE_WEEKDAYS
+    entries = _create_players(game, players)
+    # Start game
+    while game.state < Game.STATE_CHOOSE_ZOMBIE:
+        game.next_state()
+    oz = rng.choice(entries)
+    oz.make_original_zombie()
+    start_time = as_local(START_TIME)
+    while game.state < Game.STATE_STARTED:
+        game.next_state(start_time)
+    # Play
+    humans = [entry for entry in entries if entry is not oz]
+    rng.shuffle(humans)
+    remaining = int(players * survivors)
+    kills = 0
+    time = start_time
+    for time in _hours(START_TIME):
+        game.update(time)
+        if not game.in_progress:
+            break
+        zombies = [entry for entry in entries if entry.is_undead]
+        if not zombies:
+            break
+        for zombie in zombies:
+            if len(humans) <= remaining:
+                break
+            if rng.random() < kill_probability or \
+               (zombie is oz and zombie.kills == 0):
+                kill_time = time + timedelta(minutes=rng.randint(0, 59))
+                try:
+                    zombie.kill(humans[-1], kill_time, kill_time)
+                except InvalidTimeError:
+                    # Starved before the kill
+                    continue
+                humans.pop()
+                kills += 1
+        if len(humans) <= remaining:
+            break
+    session.flush()
+    return GeneratedGame(game.game_id, [e.player.user_id for e in entries],
+                         time, kills)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+#
+#   benchmarks/suite.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks for the model's hot paths
+
+Each benchmark is timed against a game from
+`hvz.benchmarks.generate.generate_game`, in a fresh in-memory SQLite database
+for each game size.  The session is cleared before every repetition, so the
+numbers include loading the objects, just like a new request would.
+
+`run` returns the timings as plain data; `write_results` saves them as JSON,
+so runs from different commits can be compared.
+
+:Variables:
+    SIZES : list of int
+        The default game sizes (in players)
+    DEFAULT_REPEAT : int
+        The default number of times to run each benchmark
+    BENCHMARKS : list of `Benchmark` subclasses
+        Every benchmark, in the order they're run
+"""
+
+from datetime import timedelta
+import platform
+from timeit import default_timer
+
+from turbogears import database
+from turbogears.database import metadata, session
+
+from hvz import release
+from hvz.benchmarks.generate import generate_game
+from hvz.model.dates import now, numpy_available
+from hvz.model.transactions import enable_savepoints
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['SIZES',
+           'DEFAULT_REPEAT',
+           'BENCHMARKS',
+           'Benchmark',
+           'UpdateBenchmark',
+           'TimedeltaBenchmark',
+           'FeedBenchmark',
+           'GameViewBenchmark',
+           'UserViewBenchmark',
+           'LinkBenchmark',
+           'ColdLinkBenchmark',
+           'WarmLinkBenchmark',
+           'setup_database',
+           'run',
+           'write_results',]
+
+SIZES = [100, 1000, 10000]
+DEFAULT_REPEAT = 5
+
+class Benchmark(object):
+    """
+    A timed operation.
+    
+    Only `run` is timed; `setup` and `teardown` are called around every
+    repetition.
+    
+    :CVariables:
+        name : str
+            The name used in the results
+        repeat : int
+            How many times to run the benchmark, if it can't be run the usual
+            number of times
+    """
+    name = None
+    repeat = None
+    
+    def setup(self, generated):
+        """
+        Prepares for a repetition.
+        
+        :Parameters:
+            generated : `hvz.benchmarks.generate.GeneratedGame`
+                The game to use
+        """
+        session.clear()
+    
+    def run(self, generated):
+        """
+        Does the timed work.
+        
+        :Parameters:
+            generated : `hvz.benchmarks.generate.GeneratedGame`
+                The game to use
+        """
+        raise NotImplementedError("%s does not implement run" %
+                                  (type(self).__name__))
+    
+    def teardown(self, generated):
+        """
+        Cleans up after a repetition.
+        
+        :Parameters:
+            generated : `hvz.benchmarks.generate.GeneratedGame`
+                The game to use
+        """
+        pass
+
+class UpdateBenchmark(Benchmark):
+    """
+    ``Game.update``, two days after the game stopped.
+    
+    This changes the game for good, so it's only run once, after the others.
+    """
+    name = 'game_update'
+    repeat = 1
+    
+    def setup(self, generated):
+        super(UpdateBenchmark, self).setup(generated)
+        self.game = generated.game
+    
+    def run(self, generated):
+        self.game.update(generated.time + timedelta(days=2))
+        session.flush()
+
+class TimedeltaBenchmark(Benchmark):
+    """The game calendar's ``calc_timedelta``, once for every zombie."""
+    name = 'calc_timedelta'
+    
+    def setup(self, generated):
+        super(TimedeltaBenchmark, self).setup(generated)
+        game = generated.game
+        self.calendar = game.calendar
+        self.spans = []
+        for entry in game.entries:
+            start = entry.feed_date or entry.death_date
+            # The infected die after the game stops
+            if start is not None and start <= generated.time:
+                self.spans.append((start, generated.time))
+    
+    def run(self, generated):
+        calc_timedelta = self.calendar.calc_timedelta
+        for start, end in self.spans:
+            calc_timedelta(start, end)
+
+class FeedBenchmark(Benchmark):
+    """``build_feed`` for the game's news feed."""
+    name = 'build_feed'
+    
+    def setup(self, generated):
+        import cherrypy
+        super(FeedBenchmark, self).setup(generated)
+        # Absolute links need a base URL, even outside of a request
+        cherrypy.request.base = 'http://localhost:8080'
+    
+    def run(self, generated):
+        from hvz.controllers.game import build_feed
+        build_feed(generated.game)
+
+class GameViewBenchmark(Benchmark):
+    """
+    The data that ``GameController.view`` gathers for the game page: the
+    summary, the first page of the roster, and the email lists.
+    """
+    name = 'game_view'
+    
+    def run(self, generated):
+        from hvz.controllers.game import build_emails, ENTRIES_PER_PAGE
+        from hvz.model.game import PlayerEntry
+        game = generated.game
+        game.summary
+        list(PlayerEntry.roster_query(game)[:ENTRIES_PER_PAGE])
+        build_emails(game)
+
+class UserViewBenchmark(Benchmark):
+    """``UserController.view`` statistics for a hundred players."""
+    name = 'user_view'
+    sample_size = 100
+    
+    def setup(self, generated):
+        super(UserViewBenchmark, self).setup(generated)
+        step = max(len(generated.user_ids) // self.sample_size, 1)
+        self.user_ids = generated.user_ids[::step][:self.sample_size]
+    
+    def run(self, generated):
+        from hvz.controllers.user import calculate_stats
+        from hvz.model.identity import User
+        for user_id in self.user_ids:
+            calculate_stats(User.query.get(user_id))
+
+class LinkBenchmark(Benchmark):
+    """
+    ``user_link`` and ``game_link`` for a thousand players, as a roster
+    would build them.
+    """
+    sample_size = 1000
+    
+    def setup(self, generated):
+        super(LinkBenchmark, self).setup(generated)
+        self.user_ids = generated.user_ids[:self.sample_size]
+    
+    def run(self, generated):
+        from hvz.util import game_link, user_link
+        game_id = generated.game_id
+        for user_id in self.user_ids:
+            user_link(user_id)
+            game_link(game_id)
+
+class ColdLinkBenchmark(LinkBenchmark):
+    """`LinkBenchmark`, starting with an empty link cache."""
+    name = 'links_cold'
+    
+    def setup(self, generated):
+        from hvz import cache
+        super(ColdLinkBenchmark, self).setup(generated)
+        cache.links.clear()
+
+class WarmLinkBenchmark(LinkBenchmark):
+    """`LinkBenchmark`, with every link already cached."""
+    name = 'links_warm'
+    
+    def setup(self, generated):
+        super(WarmLinkBenchmark, self).setup(generated)
+        self.run(generated)
+
+BENCHMARKS = [TimedeltaBenchmark,
+              FeedBenchmark,
+              GameViewBenchmark,
+              UserViewBenchmark,
+              ColdLinkBenchmark,
+              WarmLinkBenchmark,
+              UpdateBenchmark,]
+
+def setup_database():
+    """Points the model at a new, empty, in-memory SQLite database."""
+    session.clear()
+    database.set_db_uri("sqlite:///:memory:")
+    database.bind_meta_data()
+    enable_savepoints(metadata.bind)
+    metadata.drop_all(checkfirst=True)
+    metadata.create_all()
+
+def _time(benchmark, generated, repeat):
+    times = []
+    for i in xrange(repeat):
+        benchmark.setup(generated)
+        try:
+            start = default_timer()
+            benchmark.run(generated)
+            times.append(default_timer() - start)
+        finally:
+            benchmark.teardown(generated)
+    return times
+
+def run(sizes=None, repeat=DEFAULT_REPEAT, seed=0, benchmarks=None,
+        log=None):
+    """
+    Runs the benchmarks.
+    
+    :Parameters:
+        sizes : list of int
+            The game sizes to try.  Defaults to `SIZES`.
+        repeat : int
+            How many times to run each benchmark
+        seed
+            The random seed for the generated games
+        benchmarks : list of `Benchmark` subclasses
+            The benchmarks to run.  Defaults to `BENCHMARKS`.
+        log : callable
+            Called with a progress message before each step
+    :Returns: The environment (``version``, ``python``, ``numpy``, and
+              ``date``) and a list of ``results``, each with a ``benchmark``,
+              ``players``, the ``times`` in seconds, and the ``best`` and
+              ``mean`` of those
+    :ReturnType: dict
+    """
+    if sizes is None:
+        sizes = SIZES
+    if benchmarks is None:
+        benchmarks = BENCHMARKS
+    if log is None:
+        log = (lambda message: None)
+    results = []
+    for players in sizes:
+        log("Generating a game with %i players" % (players))
+        setup_database()
+        generated = generate_game(players, seed)
+        for benchmark_class in benchmarks:
+            benchmark = benchmark_class()
+            log("Running %s (%i players)" % (benchmark.name, players))
+            times = _time(benchmark, generated, benchmark.repeat or repeat)
+            results.append(dict(benchmark=benchmark.name,
+                                players=players,
+                                times=times,
+                                best=min(times),
+                                mean=sum(times) / len(times),))
+    return dict(version=release.version,
+                python=platform.python_version(),
+                numpy=numpy_available,
+                date=now().isoformat(),
+                seed=seed,
+                results=results,)
+
+def write_results(results, f):
+    """
+    Writes the results of `run` as JSON.
+    
+    :Parameters:
+        results : dict
+            The results from `run`
+        f : file
+            The file to write to
+    """
+    import simplejson
+    simplejson.dump(results, f, indent=2, sort_keys=True)
+    f.write('\n')
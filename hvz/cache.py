@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#
+#   cache.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+In-process caches
+
+`fragments` holds rendered pieces of pages.  Keys should include whatever the
+fragment depends on (usually a game's summary version), so that entries never
+have to be invalidated; old ones just fall out of the cache.  Its size is set
+by ``hvz.fragment_cache_size``.
+
+`links` holds the paths built by `hvz.util`'s link functions.  Its size is set
+by ``hvz.link_cache_size``.
+
+`compressed` holds gzipped response bodies, keyed by ETag and checksum.  Its
+size is set by ``hvz.compressed_cache_size``.
+"""
+
+import threading
+
+import turbogears
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['DEFAULT_FRAGMENT_CACHE_SIZE',
+           'DEFAULT_LINK_CACHE_SIZE',
+           'DEFAULT_COMPRESSED_CACHE_SIZE',
+           'LRUCache',
+           'fragments',
+           'links',
+           'compressed',]
+
+DEFAULT_FRAGMENT_CACHE_SIZE = 64
+DEFAULT_LINK_CACHE_SIZE = 4096
+DEFAULT_COMPRESSED_CACHE_SIZE = 64
+
+# Link indices
+_PREV, _NEXT, _KEY, _VALUE = range(4)
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that holds a limited number of items.
+    
+    When the cache is full, adding an item evicts the least recently used one.
+    
+    :IVariables:
+        max_size : int
+            The most items to hold.  If this is zero, nothing is cached.
+    """
+    def __init__(self, max_size):
+        if max_size < 0:
+            raise ValueError("max_size must be non-negative")
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._links = {}
+        # Circular list, most recently used first
+        self._root = root = [None, None, None, None]
+        root[_PREV] = root[_NEXT] = root
+    
+    def __repr__(self):
+        return "<LRUCache %i/%i>" % (len(self), self.max_size)
+    
+    def __len__(self):
+        return len(self._links)
+    
+    def __contains__(self, key):
+        return key in self._links
+    
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+    
+    def _push_front(self, link):
+        root = self._root
+        link[_PREV] = root
+        link[_NEXT] = root[_NEXT]
+        root[_NEXT][_PREV] = link
+        root[_NEXT] = link
+    
+    def get(self, key, default=None):
+        """
+        Retrieves an item, marking it as recently used.
+        
+        :Parameters:
+            key
+                The item's key
+            default
+                The value to return if the item isn't cached
+        :Returns: The cached value, or *default*
+        """
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._push_front(link)
+            return link[_VALUE]
+        finally:
+            self._lock.release()
+    
+    def put(self, key, value):
+        """
+        Adds an item, evicting the least recently used item if necessary.
+        
+        :Parameters:
+            key
+                The item's key
+            value
+                The value to cache
+        """
+        if self.max_size == 0:
+            return
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[_VALUE] = value
+            else:
+                if len(self._links) >= self.max_size:
+                    oldest = self._root[_PREV]
+                    self._unlink(oldest)
+                    del self._links[oldest[_KEY]]
+                link = self._links[key] = [None, None, key, value]
+            self._push_front(link)
+        finally:
+            self._lock.release()
+    
+    def clear(self):
+        """Removes every item."""
+        self._lock.acquire()
+        try:
+            self._links.clear()
+            root = self._root
+            root[_PREV] = root[_NEXT] = root
+        finally:
+            self._lock.release()
+
+class _ConfiguredCache(object):
+    """Creates a cache from the configuration on first use."""
+    def __init__(self, setting, default_size):
+        self.setting = setting
+        self.default_size = default_size
+        self._lock = threading.Lock()
+        self._cache = None
+    
+    def _get_cache(self):
+        if self._cache is None:
+            self._lock.acquire()
+            try:
+                if self._cache is None:
+                    size = turbogears.config.get(self.setting,
+                                                 self.default_size)
+                    self._cache = LRUCache(int(size))
+            finally:
+                self._lock.release()
+        return self._cache
+    
+    def __len__(self):
+        return len(self._get_cache())
+    
+    def get(self, key, default=None):
+        return self._get_cache().get(key, default)
+    
+    def put(self, key, value):
+        self._get_cache().put(key, value)
+    
+    def clear(self):
+        self._get_cache().clear()
+    
+    def reset(self):
+        """Drops the cache, so the next use reads the configuration again."""
+        self._lock.acquire()
+        try:
+            self._cache = None
+        finally:
+            self._lock.release()
+
+fragments = _ConfiguredCache('hvz.fragment_cache_size',
+                             DEFAULT_FRAGMENT_CACHE_SIZE)
+links = _ConfiguredCache('hvz.link_cache_size', DEFAULT_LINK_CACHE_SIZE)
+compressed = _ConfiguredCache('hvz.compressed_cache_size',
+                              DEFAULT_COMPRESSED_CACHE_SIZE)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+#   clock.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Background game clock
+
+Without the clock, a game only moves forward when somebody looks at it.  With
+the clock enabled (``hvz.game_clock = True``), a background thread advances
+every in-progress game each ``hvz.game_clock_interval`` seconds, so page views
+don't have to.
+
+:Variables:
+    log : logging.Logger
+        The clock's log
+"""
+
+import logging
+import threading
+
+import turbogears
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['log',
+           'GameClock',
+           'install',
+           'is_running',]
+
+log = logging.getLogger("hvz.clock")
+
+_clock = None
+
+class GameClock(object):
+    """
+    A background thread that periodically advances in-progress games.
+    
+    :IVariables:
+        interval : float
+            Number of seconds between ticks
+        running : bool
+            Whether the clock's thread is alive
+    """
+    def __init__(self, interval=60):
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Starts the clock's thread, if it isn't already running."""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="hvz-game-clock")
+        self._thread.setDaemon(True)
+        self._thread.start()
+        log.info("Game clock started (every %s seconds)", self.interval)
+    
+    def stop(self, timeout=None):
+        """
+        Stops the clock and waits for any in-flight tick to finish.
+        
+        :Parameters:
+            timeout : float
+                Maximum number of seconds to wait for the thread
+        """
+        thread = self._thread
+        self._stop_event.set()
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+        log.info("Game clock stopped")
+    
+    def tick(self, update_time=None):
+        """
+        Advances every in-progress game once.
+        
+        :Parameters:
+            update_time : datetime.datetime
+                The time to advance the games to.  Defaults to now.
+        :Returns: The number of games advanced
+        :ReturnType: int
+        """
+        from sqlalchemy import and_
+        from turbogears.database import session
+        from hvz.model import transactions
+        from hvz.model.game import Game, games_table
+        count = 0
+        transactions.begin_request()
+        try:
+            try:
+                games = Game.query.filter(
+                    and_(games_table.c.state >= Game.STATE_STARTED,
+                         games_table.c.state < Game.STATE_ENDED))
+                for game in games.all():
+                    game.update(update_time)
+                    count += 1
+                session.flush()
+            except Exception:
+                log.exception("Game clock tick failed")
+        finally:
+            session.close()
+            transactions.end_request()
+        return count
+    
+    def _run(self):
+        while not self._stop_event.isSet():
+            self.tick()
+            self._stop_event.wait(self.interval)
+    
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.isAlive()
+
+def install():
+    """
+    Hooks the game clock into the server's startup and shutdown, if the
+    ``hvz.game_clock`` configuration value is set.
+    
+    Call this after the configuration has been loaded.
+    
+    :Returns: The installed clock, or ``None`` if the clock is disabled
+    :ReturnType: `GameClock`
+    """
+    global _clock
+    if not turbogears.config.get('hvz.game_clock', False):
+        return None
+    if _clock is None:
+        interval = turbogears.config.get('hvz.game_clock_interval', 60)
+        _clock = GameClock(interval)
+        turbogears.startup.call_on_startup.append(_clock.start)
+        turbogears.startup.call_on_shutdown.append(_clock.stop)
+    return _clock
+
+def is_running():
+    """
+    Checks whether this process has a running game clock.
+    
+    :Returns: Whether games are being advanced in the background
+    :ReturnType: bool
+    """
+    return _clock is not None and _clock.running
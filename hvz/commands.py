@@ -38,7 +38,11 @@ __all__ = ['ConfigurationError',
            'start',
            'start_wsgi',
            'create_permissions',
-           'create_admin',]
+           'create_admin',
+           'backfill_deadlines',
+           'rebuild_entries',
+           'project_game',
+           'benchmark',]
 
 cherrypy.lowercase_api = True
 
@@ -79,6 +83,10 @@ def _load_config(configfile=None):
         except pkg_resources.DistributionNotFound:
             raise ConfigurationError("Could not find default configuration.")
     turbogears.update_config(configfile=configfile, modulename="hvz.config")
+    # The model retries parts of its transactions in savepoints
+    from turbogears import database
+    from hvz.model.transactions import enable_savepoints
+    enable_savepoints(database.get_engine())
 
 def start(args=None):
     """
@@ -100,7 +108,9 @@ def start(args=None):
     else:
         _load_config()
     # Start the server
+    from hvz import clock
     from hvz.controllers.base import Root
+    clock.install()
     turbogears.start_server(Root())
 
 def start_wsgi(args=None):
@@ -125,7 +135,9 @@ def start_wsgi(args=None):
     else:
         _load_config()
     # Start the server
+    from hvz import clock
     from hvz.controllers.base import Root
+    clock.install()
     cherrypy.root = Root()
     # These two parameters ensure that this does not block, so WSGI hooks can
     # work properly and not hang.
@@ -233,3 +245,158 @@ def create_admin(args=None):
     # Flush to database
     session.flush()
     print "Administrator '%s' created" % new_admin.user_name.encode('utf-8')
+
+def backfill_deadlines(args=None):
+    """
+    Fills in the projected starve and turn times for every player entry.
+    
+    Run this once after upgrading the database to 0.5.
+    
+    :Parameters:
+        args : list of str (or str)
+            Command-line arguments.  If a string is given, it is used as the
+            sole parameter.  If no arguments are specified, the command line is
+            used.
+    """
+    # Read arguments
+    if args is None:
+        args = sys.argv[1:]
+    elif isinstance(args, basestring):
+        args = [args]
+    if len(args) > 0:
+        _load_config(args[0])
+    else:
+        _load_config()
+    # Import necessary modules
+    from turbogears.database import session
+    from hvz.model.game import Game
+    # Refresh each game
+    total = 0
+    for game in Game.query.all():
+        total += game.refresh_deadlines()
+    session.flush()
+    print "Refreshed %i entries" % (total)
+
+def rebuild_entries(args=None):
+    """
+    Regenerates player entries from the game event log.
+    
+    The optional second argument is the ID of a single game to rebuild.
+    
+    :Parameters:
+        args : list of str (or str)
+            Command-line arguments.  If a string is given, it is used as the
+            sole parameter.  If no arguments are specified, the command line is
+            used.
+    """
+    # Read arguments
+    if args is None:
+        args = sys.argv[1:]
+    elif isinstance(args, basestring):
+        args = [args]
+    if len(args) > 0:
+        _load_config(args[0])
+    else:
+        _load_config()
+    # Import necessary modules
+    from turbogears.database import session
+    from hvz.model import events
+    from hvz.model.game import Game
+    # Replay the log
+    if len(args) > 1:
+        game_ids = events.rebuild_entries(int(args[1]))
+    else:
+        game_ids = events.rebuild_entries()
+    # Derived columns follow the entries
+    for game_id in game_ids:
+        Game.query.get(game_id).refresh_deadlines()
+    session.flush()
+    print "Rebuilt %i game(s)" % (len(game_ids))
+
+def project_game(args=None):
+    """
+    Projects how a game in progress will end.
+    
+    The second argument is the ID of the game, and the optional third argument
+    is the number of runs.
+    
+    :Parameters:
+        args : list of str (or str)
+            Command-line arguments.  If a string is given, it is used as the
+            sole parameter.  If no arguments are specified, the command line is
+            used.
+    """
+    # Read arguments
+    if args is None:
+        args = sys.argv[1:]
+    elif isinstance(args, basestring):
+        args = [args]
+    if len(args) > 0:
+        _load_config(args[0])
+    else:
+        _load_config()
+    if len(args) < 2:
+        print >> sys.stderr, "Error: No game given"
+        sys.exit(1)
+    # Import necessary modules
+    from hvz import projector
+    from hvz.model.game import Game
+    from hvz.util import display_date
+    # Project
+    game = Game.query.get(int(args[1]))
+    if game is None:
+        print >> sys.stderr, "Error: No such game"
+        sys.exit(1)
+    if len(args) > 2:
+        runs = int(args[2])
+    else:
+        runs = None
+    game.update()
+    result = projector.project(game, runs=runs)
+    print "%i runs at %.2f kills per zombie per day" % \
+        (result.runs, result.model.rate)
+    for winner, name in [('human', "Humans"), ('zombie', "Zombies")]:
+        probability = result.probability(winner)
+        if probability:
+            print "%s win: %.1f%%, most likely by %s" % \
+                (name, probability * 100,
+                 display_date(result.percentile(0.5, winner)))
+        else:
+            print "%s win: %.1f%%" % (name, probability * 100)
+    print "Undecided: %.1f%%" % (result.probability(None) * 100)
+
+def benchmark(args=None):
+    """
+    Times the model's hot paths on generated games and prints the results as
+    JSON.
+    
+    Any arguments after the configuration file are the game sizes (in
+    players) to try.  The benchmarks use their own in-memory database, so the
+    configured database is never touched.
+    
+    :Parameters:
+        args : list of str (or str)
+            Command-line arguments.  If a string is given, it is used as the
+            sole parameter.  If no arguments are specified, the command line is
+            used.
+    """
+    # Read arguments
+    if args is None:
+        args = sys.argv[1:]
+    elif isinstance(args, basestring):
+        args = [args]
+    if len(args) > 0:
+        _load_config(args[0])
+    else:
+        _load_config()
+    if len(args) > 1:
+        sizes = [int(arg) for arg in args[1:]]
+    else:
+        sizes = None
+    # Import necessary modules
+    from hvz.benchmarks import suite
+    # Run benchmarks
+    def log(message):
+        print >> sys.stderr, message
+    results = suite.run(sizes, log=log)
+    suite.write_results(results, sys.stdout)
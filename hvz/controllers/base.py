@@ -27,16 +27,21 @@ Controller support and root controller
         The controller base log
 """
 
+from cStringIO import StringIO
 import datetime
+import gzip
+import hashlib
 import logging
 import sys
+import zlib
 
 import cherrypy
+from cherrypy.filters.basefilter import BaseFilter
 import turbogears
 from turbogears import error_handler, expose, url, identity, validate
 from turbogears.database import session
 
-from hvz import email, forms, model, util, widgets #, json
+from hvz import cache, email, forms, model, util, widgets #, json
 
 __author__ = 'Ross Light'
 __date__ = 'April 18, 2008'
@@ -44,7 +49,11 @@ __docformat__ = 'reStructuredText'
 __all__ = ['log',
            'manual_login',
            'build_form_values',
+           'check_modified',
            'NotFound',
+           'DateFilter',
+           'TransactionFilter',
+           'GzipFilter',
            'BaseController',
            'Root',]
 
@@ -118,9 +127,206 @@ def build_form_values(form, obj, include=None, exclude=None):
                 values[name] = new_value
     return values
 
+def check_modified(version, modified=None, personal=True):
+    """
+    Answers a conditional GET if the client's copy of a page is current.
+    
+    The page's ``ETag`` (and ``Last-Modified``, if given) headers are set from
+    the arguments.  If the request's ``If-None-Match`` (or, failing that,
+    ``If-Modified-Since``) header matches, a 304 Not Modified response is
+    raised, so call this before doing any of the work of rendering the page.
+    
+    Requests with a flash message waiting are always answered in full.
+    
+    :Parameters:
+        version
+            Anything that changes whenever the page does.  Its ``repr`` must
+            be stable between requests.
+        modified : datetime.datetime
+            When the page last changed
+        personal : bool
+            Whether the page depends on who is viewing it.  If so, the
+            viewer and his/her permissions go into the ETag.
+    :Raises cherrypy.HTTPRedirect: If the client's copy is current
+    """
+    from cherrypy.lib.httptools import HTTPDate
+    from turbogears.i18n import get_locale
+    request, response = cherrypy.request, cherrypy.response
+    key = [request.path, request.query_string, version, get_locale()]
+    if personal:
+        user = identity.current.user
+        if user is None:
+            key.append(None)
+        else:
+            key.append((user.user_id, user.version))
+        key.append(sorted(identity.current.permissions))
+        response.headers['Vary'] = 'Cookie'
+        response.headers['Cache-Control'] = 'private'
+    etag = '"%s"' % (hashlib.sha1(repr(key)).hexdigest())
+    response.headers['ETag'] = etag
+    if modified is not None:
+        last_modified = HTTPDate(modified.utctimetuple())
+        response.headers['Last-Modified'] = last_modified
+    else:
+        last_modified = None
+    # Check request
+    if request.method not in ('GET', 'HEAD') or \
+       'tg_flash' in request.simple_cookie:
+        return
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = []
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            # Compressed responses get weak tags (see `GzipFilter`)
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            tags.append(tag)
+        if etag in tags or '*' in tags:
+            raise cherrypy.HTTPRedirect([], 304)
+    elif last_modified is not None and \
+         request.headers.get('If-Modified-Since') == last_modified:
+        raise cherrypy.HTTPRedirect([], 304)
+
 class NotFound(Exception):
     """Exception raised when a controller can't find a resource."""
 
+class DateFilter(BaseFilter):
+    """
+    Gives each request its own clock and local date cache.
+    
+    See `model.dates.begin_request`.
+    """
+    def on_start_resource(self):
+        model.dates.begin_request()
+    
+    def on_end_resource(self):
+        model.dates.end_request()
+
+class TransactionFilter(BaseFilter):
+    """
+    Holds work that has to wait for the request's transaction to be over.
+    
+    The filter ends the request after TurboGears has committed or rolled back
+    the transaction.  See `model.transactions.after_commit`.
+    """
+    def on_start_resource(self):
+        model.transactions.begin_request()
+    
+    def on_end_resource(self):
+        model.transactions.end_request()
+
+def _accepts_gzip(accept_encoding):
+    """
+    Checks whether an ``Accept-Encoding`` header allows gzip.
+    
+    :Parameters:
+        accept_encoding : str
+            The header's value
+    :ReturnType: bool
+    """
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        if params[0].strip().lower() not in ('gzip', 'x-gzip', '*'):
+            continue
+        for param in params[1:]:
+            name, sep, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+def _gzip(data, level):
+    """Returns *data* as a gzip file."""
+    buf = StringIO()
+    f = gzip.GzipFile(mode='wb', compresslevel=level, fileobj=buf)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return buf.getvalue()
+
+class GzipFilter(BaseFilter):
+    """
+    Compresses text responses for clients that accept gzip.
+    
+    Only successful responses of at least ``hvz.compress_min_size`` bytes are
+    compressed, at ``hvz.compress_level``.  If the response has an ETag (see
+    `check_modified`), the compressed body is cached, so repeat requests for
+    the same version of a page aren't compressed again.  The ETag is made
+    weak, since the compressed body isn't byte-for-byte the page.
+    
+    Set ``hvz.compress`` to ``False`` to turn compression off (e.g. if a
+    front-end server already does it).
+    
+    :CVariables:
+        content_types : list of str
+            The content types to compress
+    """
+    content_types = ['text/html',
+                     'text/plain',
+                     'text/xml',
+                     'text/css',
+                     'text/javascript',
+                     'application/xml',
+                     'application/xhtml+xml',
+                     'application/atom+xml',
+                     'application/rss+xml',
+                     'application/json',]
+    
+    def before_finalize(self):
+        config = turbogears.config
+        if not config.get('hvz.compress', True):
+            return
+        request, response = cherrypy.request, cherrypy.response
+        headers = response.headers
+        status = str(response.status or 200)
+        if not status.startswith('200') or 'Content-Encoding' in headers:
+            return
+        content_type = headers.get('Content-Type', '').split(';')[0]
+        if content_type.strip().lower() not in self.content_types:
+            return
+        # Get body
+        if isinstance(response.body, basestring):
+            chunks = [response.body]
+        else:
+            # Generators can only be read once
+            chunks = response.body = list(response.body)
+        if [chunk for chunk in chunks if not isinstance(chunk, str)]:
+            return
+        body = ''.join(chunks)
+        if len(body) < int(config.get('hvz.compress_min_size', 1024)):
+            return
+        # Negotiate
+        vary = headers.get('Vary')
+        if vary:
+            headers['Vary'] = vary + ', Accept-Encoding'
+        else:
+            headers['Vary'] = 'Accept-Encoding'
+        if not _accepts_gzip(request.headers.get('Accept-Encoding', '')):
+            return
+        # Compress
+        level = int(config.get('hvz.compress_level', 6))
+        etag = headers.get('ETag')
+        if etag is not None:
+            # The checksum guards against pages that change without their
+            # ETag changing (e.g. ones showing a flash message)
+            key = (etag, len(body), zlib.adler32(body))
+            data = cache.compressed.get(key)
+            if data is None:
+                data = _gzip(body, level)
+                cache.compressed.put(key, data)
+            if not etag.startswith('W/'):
+                headers['ETag'] = 'W/' + etag
+        else:
+            data = _gzip(body, level)
+        headers['Content-Encoding'] = 'gzip'
+        headers.pop('Content-Length', None)
+        response.body = [data]
+
 class BaseController(turbogears.controllers.Controller):
     """Abstract base class for all controllers"""
     @turbogears.errorhandling.dispatch_error.when(
@@ -154,6 +360,8 @@ class BaseController(turbogears.controllers.Controller):
 
 class Root(turbogears.controllers.RootController, BaseController):
     """Top-level controller for application"""
+    _cp_filters = [DateFilter(), TransactionFilter(), GzipFilter()]
+    
     def __init__(self):
         import random
         from hvz.controllers.game import GameController
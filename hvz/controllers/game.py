@@ -30,7 +30,8 @@ from turbogears import error_handler, expose, url, identity, validate
 from turbogears.database import session
 from turbogears.paginate import paginate
 
-from hvz import charts, email, forms, model, util, widgets #, json
+from hvz import (cache, charts, clock, email, forms, model, projector,
+                 util, widgets) #, json
 from hvz.controllers import base
 from hvz.model.errors import PlayerNotFoundError
 from hvz.model.game import PlayerEntry, Game
@@ -40,9 +41,31 @@ __date__ = 'March 30, 2008'
 __docformat__ = 'reStructuredText'
 __all__ = ['GameController']
 
+# The most statements that one request for the game page may send to the
+# database, however many players there are
+VIEW_QUERY_BUDGET = 10
+# The number of players on each page of the game page's roster
+ENTRIES_PER_PAGE = 50
+
+ROSTER_FACTIONS = [('human', _("Humans")),
+                   ('zombie', _("Zombies")),
+                   ('infected', _("Infected")),
+                   ('starved', _("Starved")),]
+ROSTER_ORDERS = [('name', _("Player Name")),
+                 ('affiliation', _("Affiliation")),
+                 ('death_date', _("Death Date")),
+                 ('feed_date', _("Feed Date")),
+                 ('kills', _("Kills")),
+                 ('player_gid', _("Game ID")),]
+
 def _get_seconds(delta):
     return delta.days * 24 * 60 * 60 + delta.seconds
 
+def _advance_game(game):
+    """Brings a game up to date, unless the game clock is doing it for us."""
+    if not clock.is_running():
+        game.update()
+
 def build_feed(game):
     from hvz.controllers.feeds import Feed
     from hvz.util import absurl, game_link, display_date
@@ -119,6 +142,69 @@ def build_feed(game):
     # Return resulting feed
     return feed
 
+def build_emails(game):
+    """
+    Collects the email addresses of a game's players for the game page.
+    
+    Only the addresses and states are fetched, in a single query, so this
+    doesn't load the entries.
+    
+    :Parameters:
+        game : `Game`
+            The game to list
+    :Returns: The players' email addresses, sorted by player name and keyed
+              by ``'all'``, ``'human'``, ``'zombie'``, and ``'starved'``
+    :ReturnType: dict
+    """
+    from sqlalchemy import and_, select
+    users = model.identity.users_table
+    entries = model.game.entries_table
+    query = select([users.c.email_address, entries.c.state],
+                   and_(entries.c.game_id == game.game_id,
+                        entries.c.player_id == users.c.user_id),
+                   order_by=[users.c.display_name, users.c.user_id])
+    factions = PlayerEntry.FACTION_STATES
+    emails = dict(all=[], human=[], zombie=[], starved=[])
+    for email_address, state in session.execute(query):
+        emails['all'].append(email_address)
+        for faction in ('human', 'zombie', 'starved'):
+            if state in factions[faction]:
+                emails[faction].append(email_address)
+    return emails
+
+def render_entry_list(grid, game, version, entries):
+    """
+    Renders a page of a game's player list, or fetches it from the fragment
+    cache.
+    
+    The list only changes when the game does, so it is cached by the game's
+    summary version and the entries on the page, along with the grid's
+    columns and whether it shows the original zombie (which is all that
+    differs between viewers).
+    
+    :Parameters:
+        grid : `widgets.EntryList`
+            The grid to render
+        game : `Game`
+            The game being listed
+        version : int
+            The game's summary version
+        entries : list of `PlayerEntry`
+            The entries on the page
+    :Returns: The rendered list
+    :ReturnType: ``genshi.core.Markup``
+    """
+    from genshi.core import Markup
+    from turbogears.i18n import get_locale
+    key = ('entry_list', game.game_id, version,
+           tuple([e.entry_id for e in entries]), tuple(grid.columns),
+           bool(grid.show_oz), get_locale())
+    html = cache.fragments.get(key)
+    if html is None:
+        html = turbogears.util.to_unicode(grid.render(entries, format='html'))
+        cache.fragments.put(key, html)
+    return Markup(html)
+
 class GameController(base.BaseController):
     @staticmethod
     def _get_current_entry(game):
@@ -139,14 +225,23 @@ class GameController(base.BaseController):
                     pager=pager,)
     
     @expose("hvz.templates.game.view")
-    def view(self, game_id):
+    @paginate('entries', limit=ENTRIES_PER_PAGE)
+    def view(self, game_id, faction=None, order='name', reverse=False):
         game_id = int(game_id)
         requested_game = Game.query.get(game_id)
         perms = identity.current.permissions
         if requested_game is None:
             raise base.NotFound()
         # Update game
-        requested_game.update()
+        _advance_game(requested_game)
+        # Find factions.  The summary's version is read before the players
+        # are listed, so a cached player list is never newer than its key.
+        summary = requested_game.summary
+        # The page shows the server time, so it changes every minute
+        minute = model.dates.now().replace(second=0, microsecond=0)
+        modified = max([d for d in (summary.modified, minute)
+                        if d is not None])
+        base.check_modified((summary.version, minute), modified)
         # Find user's entry, if he/she has one
         entry = self._get_current_entry(requested_game)
         # Determine which columns to show
@@ -154,6 +249,7 @@ class GameController(base.BaseController):
         if 'view-player-gid' in perms:
             columns.insert(0, 'player_gid')
         if 'edit-entry' in perms:
+            columns.insert(0, 'select')
             columns.append('edit')
         # Determine whether to show original zombie
         oz = requested_game.revealed_original_zombie
@@ -162,28 +258,42 @@ class GameController(base.BaseController):
         else:
             is_oz = False
         can_view_oz = bool('view-oz' in perms)
-        # Find factions
-        humans = [e.player for e in requested_game.entries if e.is_human]
-        zombies = [e.player for e in requested_game.entries if e.is_undead]
-        infected = [e.player for e in requested_game.entries if e.is_infected]
-        starved = [e.player for e in requested_game.entries if e.is_dead]
+        show_oz = bool(oz or is_oz or can_view_oz)
+        # List players.  The database sorts and filters them, and paginate
+        # only fetches the requested page.
+        order_options = ROSTER_ORDERS
+        if 'view-player-gid' not in perms:
+            order_options = [(value, label) for value, label in order_options
+                             if value != 'player_gid']
+        if order not in [value for value, label in order_options]:
+            order = 'name'
+        if faction not in PlayerEntry.FACTION_STATES:
+            faction = None
+        reverse = bool(reverse)
+        entries = PlayerEntry.roster_query(requested_game, order, reverse,
+                                           faction, show_oz)
+        if 'send-mail' in perms:
+            emails = build_emails(requested_game)
+        else:
+            emails = dict(all=[], human=[], zombie=[], starved=[])
         # Create widgets
-        grid = widgets.EntryList(columns=columns,
-                                 show_oz=(oz or is_oz or can_view_oz),)
-        entries = sorted(requested_game.entries,
-                         key=(lambda e: e.player.display_name))
+        grid = widgets.EntryList(columns=columns, show_oz=show_oz)
+        pager = widgets.Pager()
+        def render_grid(page):
+            return render_entry_list(grid, requested_game, summary.version,
+                                     page)
         # Create charts
         if (turbogears.config.get('hvz.show_charts', True) and
             requested_game.in_progress):
             # Create data
-            chart_data = [len(humans),
-                          len(zombies),
-                          len(infected),
-                          len(starved)]
-            chart_labels = [_("Humans (%i)") % len(humans),
-                            _("Zombies (%i)") % len(zombies),
-                            _("Infected (%i)") % len(infected),
-                            _("Starved (%i)") % len(starved),]
+            chart_data = [summary.human_count,
+                          summary.zombie_count,
+                          summary.infected_count,
+                          summary.dead_count]
+            chart_labels = [_("Humans (%i)") % summary.human_count,
+                            _("Zombies (%i)") % summary.zombie_count,
+                            _("Infected (%i)") % summary.infected_count,
+                            _("Starved (%i)") % summary.dead_count,]
             chart_colors = ['ff0000',
                             'cccccc',
                             '00CC00',
@@ -227,25 +337,25 @@ class GameController(base.BaseController):
         total_offset = abs(days * (60 * 60 * 24) + seconds)
         tz_hours, extra_offset = divmod(total_offset, 60 * 60)
         tz_minutes = extra_offset // 60
-        # Find email addresses
-        all_emails = [e.player.email_address
-                      for e in requested_game.entries]
-        human_emails = [player.email_address for player in humans]
-        zombie_emails = [player.email_address for player in zombies]
-        starved_emails = [player.email_address for player in starved]
         # Return template variables
         return dict(game=requested_game,
-                    grid=grid,
+                    render_grid=render_grid,
+                    pager=pager,
                     current_entry=entry,
                     entries=entries,
+                    faction=faction,
+                    faction_options=ROSTER_FACTIONS,
+                    order=order,
+                    order_options=order_options,
+                    reverse=reverse,
                     current_time=current_time,
                     tz_sign=tz_sign,
                     tz_hours=tz_hours,
                     tz_minutes=tz_minutes,
-                    all_emails=all_emails,
-                    human_emails=human_emails,
-                    zombie_emails=zombie_emails,
-                    starved_emails=starved_emails,
+                    all_emails=emails['all'],
+                    human_emails=emails['human'],
+                    zombie_emails=emails['zombie'],
+                    starved_emails=emails['starved'],
                     player_chart=player_chart,
                     starve_meter=starve_meter,)
     
@@ -281,13 +391,14 @@ class GameController(base.BaseController):
         requested_game = Game.query.get(game_id)
         if requested_game is None:
             raise base.NotFound()
-        requested_game.update()
+        _advance_game(requested_game)
         entry = self._get_current_entry(requested_game)
         default_time = model.dates.to_local(model.dates.now())
         return dict(game=requested_game,
                     form=forms.kill_form,
                     current_entry=entry,
-                    default_time=default_time,)
+                    default_time=default_time,
+                    kill_token=model.tokens.new_token(),)
     
     @expose("hvz.templates.game.join")
     @identity.require(identity.has_permission('join-game'))
@@ -310,6 +421,9 @@ class GameController(base.BaseController):
         requested_game = Game.query.get(game_id)
         if requested_game is None:
             raise base.NotFound()
+        summary = requested_game.summary
+        base.check_modified(summary.version, summary.modified,
+                            personal=False)
         feed = build_feed(requested_game)
         return feed.render('atom')
     
@@ -319,6 +433,9 @@ class GameController(base.BaseController):
         requested_game = Game.query.get(game_id)
         if requested_game is None:
             raise base.NotFound()
+        summary = requested_game.summary
+        base.check_modified(summary.version, summary.modified,
+                            personal=False)
         feed = build_feed(requested_game)
         return feed.render('rss')
     
@@ -344,31 +461,87 @@ class GameController(base.BaseController):
         requested_game = Game.query.get(game_id)
         if requested_game is None:
             raise base.NotFound()
+        summary = requested_game.summary
+        base.check_modified(summary.version, summary.modified)
         return dict(game=requested_game)
     
+    @expose("hvz.templates.game.projection")
+    @identity.require(identity.has_permission('edit-game'))
+    def projection(self, game_id, rate_model=None, rate=None, runs=None):
+        game_id = int(game_id)
+        requested_game = Game.query.get(game_id)
+        if requested_game is None:
+            raise base.NotFound()
+        _advance_game(requested_game)
+        # Read settings
+        model_class = projector.MODELS.get(rate_model, projector.PerZombieRate)
+        config = turbogears.config
+        max_runs = config.get('hvz.projector.max_page_runs',
+                              projector.DEFAULT_MAX_PAGE_RUNS)
+        default_runs = min(config.get('hvz.projector.page_runs',
+                                      projector.DEFAULT_PAGE_RUNS), max_runs)
+        try:
+            if rate:
+                kill_model = model_class(float(rate))
+            else:
+                kill_model = model_class
+            if runs:
+                runs = min(max(int(runs), 1), max_runs)
+            else:
+                runs = default_runs
+        except ValueError:
+            turbogears.flash(_("Invalid projection settings"))
+            kill_model, runs = model_class, default_runs
+        # Project.  Forking a pool from a server thread isn't safe, so the
+        # runs stay in this process, and there are few enough of them to
+        # finish in a few seconds.
+        if requested_game.in_progress:
+            result = projector.project(requested_game, kill_model, runs,
+                                       processes=0)
+        else:
+            result = None
+        return dict(game=requested_game,
+                    projection=result,
+                    rate_model=model_class.name,
+                    max_runs=max_runs,
+                    model_names=sorted(projector.MODELS),)
+    
     @expose()
     @identity.require(identity.not_anonymous())
     @error_handler(reportkill)
     @validate(forms.kill_form)
-    def action_kill(self, game_id, victim_id, kill_date):
+    def action_kill(self, game_id, victim_id, kill_date, kill_token=None):
         user = identity.current.user
         kill_date = model.dates.as_local(kill_date)
         game_id = int(game_id)
-        requested_game = Game.query.get(game_id)
-        if requested_game is None:
-            raise base.NotFound()
-        # Update the game state
-        requested_game.update()
-        # Retrieve killer and victim
-        killer = PlayerEntry.by_player(requested_game, user)
-        if killer is None:
-            msg = _("You are not a part of this game")
-            raise PlayerNotFoundError(requested_game, msg)
-        victim = PlayerEntry.by_player_gid(requested_game, victim_id)
-        if victim is None:
-            raise PlayerNotFoundError(requested_game, _("Invalid victim"))
-        # Kill user in question
-        killer.kill(victim, kill_date)
+        link = util.game_link(game_id, redirect=True) + '#sect_entry_list'
+        # Don't process the same form twice
+        if kill_token is not None and not model.tokens.claim(kill_token):
+            replay_link = model.tokens.get_result(kill_token) or link
+            raise turbogears.redirect(replay_link)
+        try:
+            requested_game = Game.query.get(game_id)
+            if requested_game is None:
+                raise base.NotFound()
+            # Update the game state
+            requested_game.update()
+            # Retrieve killer and victim
+            killer = PlayerEntry.by_player(requested_game, user)
+            if killer is None:
+                msg = _("You are not a part of this game")
+                raise PlayerNotFoundError(requested_game, msg)
+            victim = PlayerEntry.by_player_gid(requested_game, victim_id)
+            if victim is None:
+                raise PlayerNotFoundError(requested_game, _("Invalid victim"))
+            # Kill user in question
+            killer.report_kill(victim, kill_date)
+        except:
+            # Let the player fix the problem and try again
+            if kill_token is not None:
+                model.tokens.release(kill_token)
+            raise
+        if kill_token is not None:
+            model.tokens.record(kill_token, link)
         # Log it
         base.log.info("<Game %i> %r killed %r!",
                       game_id, killer, victim)
@@ -393,7 +566,6 @@ class GameController(base.BaseController):
                        "hvz.templates.mail.zombienotif",
                        notif_vars)
         # Return to game
-        link = util.game_link(game_id, redirect=True) + '#sect_entry_list'
         raise turbogears.redirect(link)
     
     @expose()
@@ -526,6 +698,7 @@ class GameController(base.BaseController):
         requested_game.ignore_dates = ignore_dates
         requested_game.safe_zones = safe_zones
         requested_game.rules_notes = rules_notes
+        requested_game.refresh_deadlines()
         session.flush()
         base.log.info("<Game %i> Updated", game_id)
         turbogears.flash(_("Game updated"))
@@ -552,6 +725,7 @@ class GameController(base.BaseController):
         if starve_date:
             starve_date = model.dates.as_local(starve_date)
         # Update entry
+        requested_entry.game.invalidate_next_transition()
         requested_entry.state = state
         requested_entry.kills = kills
         requested_entry.death_date = death_date
@@ -559,6 +733,8 @@ class GameController(base.BaseController):
         requested_entry.starve_date = starve_date
         requested_entry.original_pool = original_pool
         requested_entry.notify_sms = notify_sms
+        requested_entry.refresh_deadlines()
+        model.events.record(model.events.KIND_EDIT, requested_entry)
         session.flush()
         # Go back to game page
         base.log.info("<Entry %i;%i:%s> Updated",
@@ -593,6 +769,29 @@ class GameController(base.BaseController):
         raise turbogears.redirect(util.game_link(requested_entry.game,
                                                  redirect=True))
     
+    @expose()
+    @identity.require(identity.has_permission('edit-entry'))
+    def action_entrybulk(self, game_id, action, entry_ids=None):
+        game_id = int(game_id)
+        requested_game = Game.query.get(game_id)
+        if requested_game is None:
+            raise base.NotFound()
+        if action not in Game.FORCE_ACTIONS:
+            raise ValueError("Invalid action given")
+        # Checkboxes come in as a string if only one was checked
+        if entry_ids is None:
+            entry_ids = []
+        elif isinstance(entry_ids, basestring):
+            entry_ids = [entry_ids]
+        entry_ids = [int(entry_id) for entry_id in entry_ids]
+        # Perform requested action
+        count = requested_game.force_entries(action, entry_ids)
+        base.log.info("<Game %i> Changed %i entries to: %s",
+                      game_id, count, action)
+        turbogears.flash(_("%i players updated") % count)
+        raise turbogears.redirect(util.game_link(requested_game,
+                                                 redirect=True))
+    
     @expose()
     @identity.require(identity.has_permission('delete-game'))
     def action_delete(self, game_id):
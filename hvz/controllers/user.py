@@ -31,6 +31,7 @@ from turbogears.paginate import paginate
 
 from hvz import email, forms, util, widgets
 from hvz.controllers import base
+from hvz.model.game import PlayerEntry
 from hvz.model.identity import User, Group
 from hvz.model.images import Image
 from hvz.model.social import Alliance
@@ -52,6 +53,43 @@ def _calc_avg(raw_data):
         else:
             return sum(data) / len(data)
 
+def calculate_stats(user):
+    """
+    Sums up a user's games for the profile page.
+    
+    Original zombies that haven't been revealed are left out of the kill and
+    undead statistics.
+    
+    :Parameters:
+        user : `User`
+            The user to calculate statistics for
+    :Returns: The statistics, keyed by ``'total_games'``, ``'total_kills'``,
+              ``'total_killed'``, ``'avg_survival'``, ``'avg_undead'``, and
+              ``'kill_ratio'``
+    :ReturnType: dict
+    """
+    entries = user.entries
+    show_oz = (lambda e: not e.is_original_zombie or
+                         e.game.revealed_original_zombie)
+    total_kills = sum(entry.kills for entry in entries
+                      if show_oz(entry))
+    total_killed = len([entry for entry in entries
+                        if not entry.is_human and show_oz(entry)])
+    if total_killed == 0:
+        kill_ratio = 0.0
+    else:
+        kill_ratio = float(total_kills / total_killed)
+    avg_survival = _calc_avg(
+        PlayerEntry.calculate_survival_times(entries))
+    avg_undead = _calc_avg(PlayerEntry.calculate_undead_times(
+        [entry for entry in entries if show_oz(entry)]))
+    return dict(total_games=len(entries),
+                total_kills=total_kills,
+                total_killed=total_killed,
+                avg_survival=avg_survival,
+                avg_undead=avg_undead,
+                kill_ratio=kill_ratio,)
+
 class UserController(base.BaseController):
     def __init__(self):
         self.alliance = AllianceController()
@@ -77,33 +115,24 @@ class UserController(base.BaseController):
             requested_user = User.by_user_name(user_id)
         if requested_user is None:
             raise base.NotFound()
+        # Check whether the client's copy is current.  The page changes with
+        # the user, his/her alliances, and the games he/she has played.
+        games = [entry.game for entry in requested_user.entries]
+        games.sort(key=(lambda g: g.created), reverse=True)
+        version = [requested_user.version,
+                   [a.alliance_id for a in requested_user.alliances]]
+        dates = [requested_user.modified or requested_user.created]
+        for game in games:
+            summary = game.summary
+            version.append((game.game_id, summary.version))
+            dates.append(summary.modified)
+        dates = [d for d in dates if d is not None]
+        base.check_modified(version, max(dates) if dates else None)
         # Generate statistics
-        entries = requested_user.entries
-        show_oz = (lambda e: not e.is_original_zombie or
-                             e.game.revealed_original_zombie)
-        total_kills = sum(entry.kills for entry in entries
-                          if show_oz(entry))
-        total_killed = len([entry for entry in entries
-                            if not entry.is_human and show_oz(entry)])
-        if total_killed == 0:
-            kill_ratio = 0.0
-        else:
-            kill_ratio = float(total_kills / total_killed)
-        avg_survival = _calc_avg(entry.survival_time for entry in entries)
-        avg_undead = _calc_avg(entry.undead_time for entry in entries
-                               if show_oz(entry))
-        stats = dict(
-            total_games=len(entries),
-            total_kills=total_kills,
-            total_killed=total_killed,
-            avg_survival=avg_survival,
-            avg_undead=avg_undead,
-            kill_ratio=kill_ratio,)
+        stats = calculate_stats(requested_user)
         # Get template variables
         grid = widgets.GameList()
         alliance_grid = widgets.AllianceList()
-        games = [entry.game for entry in entries]
-        games.sort(key=(lambda g: g.created), reverse=True)
         return dict(user=requested_user,
                     games=games,
                     game_grid=grid,
@@ -196,6 +196,7 @@ class PlayerStateValidator(validators.Int):
 
 class KillSchema(validators.Schema):
     game_id = validators.Int()
+    kill_token = validators.String(max=32, if_empty=None, if_missing=None)
     victim_id = validators.String(min=1, max=128)
     kill_date = validators.DateTimeConverter()
 
@@ -282,6 +283,7 @@ class EditEntrySchema(validators.Schema):
 
 class KillFields(WidgetsList):
     game_id = widgets.HiddenField()
+    kill_token = widgets.HiddenField()
     victim_id = widgets.TextField(
         label=_("Victim"),
         help_text=_("The Game ID of your victim (located on his or her 3x5 "
@@ -25,15 +25,27 @@ __author__ = 'Ross Light'
 __date__ = 'April 18, 2008'
 __docformat__ = 'reStructuredText'
 __all__ = ['dates',
+           'engine',
            'errors',
+           'events',
            'game',
            'identity',
            'images',
-           'social',]
+           'locking',
+           'social',
+           'summary',
+           'tokens',
+           'transactions',]
 
 from hvz.model import (dates,
                        errors,
+                       events,
                        game,
                        identity,
                        images,
-                       social,)
+                       locking,
+                       social,
+                       summary,
+                       tokens,
+                       transactions,)
+from hvz.model import engine
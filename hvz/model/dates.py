@@ -19,40 +19,106 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-"""Date manipulation functions"""
+"""
+Date manipulation functions
 
-from datetime import datetime, timedelta
+While a request is being handled (see `begin_request`), `now` always gives the
+time that the request started, so the model and the templates agree on what
+"now" is, and `to_local` remembers the dates that it has converted.
+"""
+
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+import threading
 
 import pkg_resources
 pkg_resources.require("pytz")
+pkg_resources.require("SQLAlchemy>=0.4.2")
 
+from sqlalchemy import types
 from turbogears import config
 import pytz
 
+numpy_available = True
+try:
+    import numpy
+except ImportError:
+    # Make NumPy optional; only the batch calculations need it
+    numpy_available = False
+
 __author__ = 'Ross Light'
 __date__ = 'April 18, 2008'
 __docformat__ = 'reStructuredText'
-__all__ = ['now',
+__all__ = ['begin_request',
+           'end_request',
+           'now',
            'as_local',
            'as_utc',
            'to_local',
            'to_utc',
+           'to_naive_utc',
            'make_aware',
+           'UTCDateTime',
+           'date_param',
            'date_prop',
+           'IgnoredDays',
+           'GameCalendar',
            'calc_timedelta',
            'calc_addtimedelta',]
 
+_EPOCH = date(1970, 1, 1)
+_DAY = 24 * 60 * 60 * 1000000
+
+_timezones = {}
+_context = threading.local()
+
 def _get_local_timezone():
-    return pytz.timezone(config.get('hvz.timezone', 'UTC'))
+    # pytz lookups aren't free, so keep the zones we've seen.  The name is the
+    # key, so a config reload with a new zone picks it up.
+    name = config.get('hvz.timezone', 'UTC')
+    try:
+        return _timezones[name]
+    except KeyError:
+        tz = _timezones[name] = pytz.timezone(name)
+        return tz
+
+def begin_request(time=None):
+    """
+    Starts a request-scoped clock and date cache for the current thread.
+    
+    Until `end_request` is called, `now` returns the same time and `to_local`
+    memoizes its conversions.
+    
+    :Parameters:
+        time : datetime.datetime
+            The request's time.  Defaults to the actual time.
+    """
+    if time is None:
+        time = as_utc(datetime.utcnow())
+    else:
+        time = make_aware(time)
+    _context.now = time
+    _context.local_dates = {}
+
+def end_request():
+    """Stops the current thread's request-scoped clock and date cache."""
+    _context.now = None
+    _context.local_dates = None
 
 def now():
     """
     Creates a timezone-aware representation of now.
     
+    If a request is being handled, this is the time the request started.
+    
     :Returns: The UTC now
     :ReturnType: datetime.datetime
     """
-    return as_utc(datetime.utcnow())
+    current_time = getattr(_context, 'now', None)
+    if current_time is None:
+        return as_utc(datetime.utcnow())
+    else:
+        return current_time
 
 def as_local(date, tz=None):
     """
@@ -100,7 +166,15 @@ def to_local(date, tz=None):
     if tz is None:
         tz = _get_local_timezone()
     date = make_aware(date)
-    return date.astimezone(tz)
+    cache = getattr(_context, 'local_dates', None)
+    if cache is None:
+        return date.astimezone(tz)
+    key = (date, tz)
+    try:
+        return cache[key]
+    except KeyError:
+        result = cache[key] = date.astimezone(tz)
+        return result
 
 def to_utc(date):
     """
@@ -116,6 +190,21 @@ def to_utc(date):
     date = make_aware(date)
     return date.astimezone(pytz.utc)
 
+def to_naive_utc(date):
+    """
+    Converts the date to a naive UTC date, suitable for binding to SQL.
+    
+    :Parameters:
+        date : datetime.datetime
+            The date to convert.  If this date is naive, then it will be
+            interpreted as UTC.
+    :Returns: The naive UTC date, or ``None`` if ``date`` is ``None``
+    :ReturnType: datetime.datetime
+    """
+    if date is None:
+        return None
+    return to_utc(date).replace(tzinfo=None)
+
 def make_aware(date, local=False):
     """
     Ensures that a date is timezone-aware.
@@ -136,6 +225,37 @@ def make_aware(date, local=False):
             date = as_utc(date)
     return date
 
+class UTCDateTime(types.TypeDecorator):
+    """
+    A date column that's stored as naive UTC and loaded as aware UTC.
+    
+    Naive dates given to the database are taken to be UTC already.
+    """
+    impl = types.DateTime
+    
+    def process_bind_param(self, value, dialect):
+        return to_naive_utc(value)
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        else:
+            return to_utc(value)
+
+def date_param(key):
+    """
+    Makes a bind parameter for a `UTCDateTime` column.
+    
+    The parameter accepts both naive (UTC) and aware dates.
+    
+    :Parameters:
+        key : str
+            The parameter's name
+    :ReturnType: ``sqlalchemy.sql.expression._BindParamClause``
+    """
+    from sqlalchemy import bindparam
+    return bindparam(key, type_=UTCDateTime)
+
 def _get_date_prop(name):
     """
     Retrieves a date from the database, interpreting it as UTC.
@@ -151,7 +271,7 @@ def _get_date_prop(name):
         if value is None:
             return None
         else:
-            return as_utc(value)
+            return to_utc(value)
     return get_prop
 
 def _set_date_prop(name, default_tz=pytz.utc):
@@ -167,20 +287,13 @@ def _set_date_prop(name, default_tz=pytz.utc):
     :Returns: A function that can be used as a property setter
     :ReturnType: function
     """
-    from turbogears.database import session
     def set_prop(self, value):
         if value is not None:
             if value.tzinfo is None:
                 value = as_local(value, default_tz)
             value = to_utc(value)
-            # WEIRD BUG: SQLAlchemy gets cranky because it tries to compare the
-            #            accessor value to the non-accessor value in an attempt
-            #            to preserve history (thus comparing naive to aware).
-            #            In order to get around this, we set the dates to None,
-            #            flush it, then set it correctly.  Don't ask me why I
-            #            need this.
-            setattr(self, name, None)
-            session.flush()
+        # The column is a `UTCDateTime`, so the loaded value is aware too and
+        # SQLAlchemy can compare the two when it works out the history.
         setattr(self, name, value)
     return set_prop
 
@@ -188,6 +301,8 @@ def date_prop(name, default_tz=pytz.utc):
     """
     Makes a timezone-aware property for a date.
     
+    The column should be a `UTCDateTime`.
+    
     :Parameters:
         name : str
             The internal attribute name
@@ -198,13 +313,478 @@ def date_prop(name, default_tz=pytz.utc):
     return property(_get_date_prop(name),
                     _set_date_prop(name, default_tz=default_tz))
 
+class IgnoredDays(object):
+    """
+    An index of ignored days, for fast calendar arithmetic.
+    
+    Ignored weekdays are counted in closed form and the remaining ignored
+    dates are kept sorted, so counting or skipping ignored days takes
+    logarithmic time no matter how far apart the days are.
+    
+    :IVariables:
+        dates : list of datetime.date
+            The sorted ignored dates that don't fall on an ignored weekday
+        weekdays : frozenset of int
+            The ignored ISO weekday numbers
+    """
+    def __init__(self, ignore_dates=None, ignore_weekdays=None):
+        if ignore_weekdays is None:
+            ignore_weekdays = []
+        if ignore_dates is None:
+            ignore_dates = []
+        self.weekdays = frozenset(ignore_weekdays)
+        self.dates = sorted(d for d in frozenset(ignore_dates)
+                            if d.isoweekday() not in self.weekdays)
+        self._ordinals = [d.toordinal() for d in self.dates]
+        self._date_set = frozenset(self.dates)
+        # _prefix[i] is the number of counted weekdays in the i days starting
+        # on a Monday; it spans two weeks so any 7-day window can be read off.
+        self._prefix = [0]
+        for i in xrange(14):
+            counted = (i % 7 + 1) not in self.weekdays
+            self._prefix.append(self._prefix[-1] + int(counted))
+        self._week_count = self._prefix[7]
+    
+    def __repr__(self):
+        return "IgnoredDays(%r, %r)" % (self.dates, sorted(self.weekdays))
+    
+    def is_ignored(self, d):
+        """
+        Checks whether a day is ignored.
+        
+        :Parameters:
+            d : datetime.date
+                The day to check
+        :ReturnType: bool
+        """
+        return d.isoweekday() in self.weekdays or d in self._date_set
+    
+    def _count_weekdays(self, start, end):
+        # Non-ignored weekdays in the ordinals [start, end)
+        weeks, extra = divmod(end - start, 7)
+        offset = (start - 1) % 7
+        return (weeks * self._week_count +
+                self._prefix[offset + extra] - self._prefix[offset])
+    
+    def _nth_weekday(self, start, n):
+        # The ordinal of the nth (counting from 1) non-ignored weekday on or
+        # after start
+        if self._week_count == 0:
+            raise ValueError("Every weekday is ignored")
+        weeks, n = divmod(n - 1, self._week_count)
+        offset = (start - 1) % 7
+        base = self._prefix[offset]
+        for day in xrange(7):
+            if self._prefix[offset + day + 1] - base > n:
+                return start + weeks * 7 + day
+        raise AssertionError("Weekday table is inconsistent")
+    
+    def count(self, start, end):
+        """
+        Counts the ignored days in a range.
+        
+        :Parameters:
+            start : datetime.date
+                The first day of the range
+            end : datetime.date
+                The day after the last day of the range
+        :Returns: The number of ignored days in ``[start, end)``
+        :ReturnType: int
+        """
+        start, end = start.toordinal(), end.toordinal()
+        if end <= start:
+            return 0
+        dates_in_range = (bisect_left(self._ordinals, end) -
+                          bisect_left(self._ordinals, start))
+        return (end - start) - self._count_weekdays(start, end) + \
+               dates_in_range
+    
+    def nth_counted(self, start, n):
+        """
+        Finds the nth day that isn't ignored.
+        
+        :Parameters:
+            start : datetime.date
+                The first day to consider
+            n : int
+                Which day to find, counting from 1
+        :Returns: The nth non-ignored day on or after ``start``
+        :ReturnType: datetime.date
+        :Raises ValueError: If every day is ignored
+        """
+        start = start.toordinal()
+        # Each ignored date before the answer pushes it back by a day.  The
+        # number of non-ignored days before the ith ignored date never
+        # decreases with i, so we can binary search for how many come first.
+        first = bisect_left(self._ordinals, start)
+        low, high = first, len(self._ordinals)
+        while low < high:
+            mid = (low + high) // 2
+            counted = (self._count_weekdays(start, self._ordinals[mid]) -
+                       (mid - first))
+            if counted < n:
+                low = mid + 1
+            else:
+                high = mid
+        return date.fromordinal(self._nth_weekday(start, n + (low - first)))
+    
+    ## BATCH ##
+    
+    # The batch methods work on NumPy arrays of day numbers, counted from
+    # 1970-01-01 (a Thursday).
+    
+    def _get_tables(self):
+        tables = getattr(self, '_tables', None)
+        if tables is None:
+            if not numpy_available:
+                raise RuntimeError("NumPy is required for batch calculations")
+            epoch = _EPOCH.toordinal()
+            prefix = numpy.array(self._prefix, dtype=numpy.int64)
+            weekday_ignored = numpy.array([(i + 1) in self.weekdays
+                                           for i in xrange(7)])
+            dates = numpy.array([o - epoch for o in self._ordinals],
+                                dtype=numpy.int64)
+            # nth_table[offset, n] is how many days after a day with the given
+            # weekday offset the (n+1)th counted weekday is
+            nth_table = numpy.zeros((7, max(self._week_count, 1)),
+                                    dtype=numpy.int64)
+            for offset in xrange(7):
+                for day in xrange(7):
+                    n = self._prefix[offset + day] - self._prefix[offset]
+                    if self._prefix[offset + day + 1] - self._prefix[offset] \
+                       > n:
+                        nth_table[offset, n] = day
+            tables = self._tables = (prefix, weekday_ignored, dates,
+                                     nth_table)
+        return tables
+    
+    def _count_weekdays_many(self, start, end):
+        prefix = self._get_tables()[0]
+        weeks, extra = numpy.divmod(numpy.maximum(end - start, 0), 7)
+        offset = (start + 3) % 7
+        return (weeks * self._week_count +
+                prefix[offset + extra] - prefix[offset])
+    
+    def is_ignored_many(self, days):
+        """
+        Checks whether each of several days is ignored.
+        
+        :Parameters:
+            days : numpy.ndarray
+                Day numbers
+        :ReturnType: numpy.ndarray of bool
+        """
+        prefix, weekday_ignored, dates = self._get_tables()[:3]
+        result = weekday_ignored[(days + 3) % 7]
+        if len(dates):
+            index = numpy.minimum(numpy.searchsorted(dates, days),
+                                  len(dates) - 1)
+            result = result | (dates[index] == days)
+        return result
+    
+    def count_many(self, start, end):
+        """
+        Counts the ignored days in several ranges.
+        
+        :Parameters:
+            start : numpy.ndarray
+                Day numbers of the first day of each range
+            end : numpy.ndarray
+                Day numbers of the day after the last day of each range
+        :Returns: The number of ignored days in each ``[start, end)``
+        :ReturnType: numpy.ndarray of int
+        """
+        dates = self._get_tables()[2]
+        end = numpy.maximum(start, end)
+        dates_in_range = (numpy.searchsorted(dates, end) -
+                          numpy.searchsorted(dates, start))
+        return (end - start) - self._count_weekdays_many(start, end) + \
+               dates_in_range
+    
+    def nth_counted_many(self, start, n):
+        """
+        Finds the nth day that isn't ignored for several starting days.
+        
+        This is the same search as `nth_counted`, done for every element at
+        once.
+        
+        :Parameters:
+            start : numpy.ndarray
+                Day numbers of the first days to consider
+            n : numpy.ndarray
+                Which day to find, counting from 1
+        :Returns: Day numbers of the nth non-ignored days
+        :ReturnType: numpy.ndarray of int
+        :Raises ValueError: If every day is ignored
+        """
+        dates, nth_table = self._get_tables()[2:]
+        if self._week_count == 0 and len(start):
+            raise ValueError("Every weekday is ignored")
+        first = numpy.searchsorted(dates, start)
+        low, high = first.copy(), numpy.zeros_like(first) + len(dates)
+        while True:
+            active = low < high
+            if not active.any():
+                break
+            mid = (low + high) // 2
+            mid_date = dates[numpy.minimum(mid, len(dates) - 1)]
+            counted = self._count_weekdays_many(start, mid_date) - \
+                      (mid - first)
+            low = numpy.where(active & (counted < n), mid + 1, low)
+            high = numpy.where(active & (counted >= n), mid, high)
+        weeks, rest = numpy.divmod(n + (low - first) - 1,
+                                   max(self._week_count, 1))
+        return start + weeks * 7 + nth_table[(start + 3) % 7, rest]
+
+class GameCalendar(object):
+    """
+    The rules for counting game time.
+    
+    A calendar is immutable, so it can be built once and shared; see
+    `hvz.model.game.Game.calendar`.
+    
+    :IVariables:
+        tz : datetime.tzinfo
+            The timezone that dates are calculated in
+        ignore_dates : frozenset of datetime.date
+            Days that don't count
+        ignore_weekdays : frozenset of int
+            Weekdays that don't count (given as ISO weekday numbers)
+        ignored : `IgnoredDays`
+            The index of ignored days
+    """
+    def __init__(self, tz=None, ignore_dates=None, ignore_weekdays=None):
+        if tz is None:
+            tz = _get_local_timezone()
+        if ignore_dates is None:
+            ignore_dates = []
+        if ignore_weekdays is None:
+            ignore_weekdays = []
+        self.tz = tz
+        self.ignore_dates = frozenset(ignore_dates)
+        self.ignore_weekdays = frozenset(ignore_weekdays)
+        self.ignored = IgnoredDays(self.ignore_dates, self.ignore_weekdays)
+    
+    def __repr__(self):
+        return "GameCalendar(%r, %r, %r)" % (self.tz,
+                                             sorted(self.ignore_dates),
+                                             sorted(self.ignore_weekdays))
+    
+    def calc_timedelta(self, datetime1, datetime2):
+        """
+        Calculates the delta between two datetimes.
+        
+        Along with subtracting the two dates, this removes time on ignored
+        dates and weekdays.
+        
+        :Parameters:
+            datetime1
+                The first date and time
+            datetime2
+                The second date and time
+        :Returns: The difference between the two dates
+        :ReturnType: datetime.timedelta
+        """
+        assert datetime1 <= datetime2
+        ignored = self.ignored
+        datetime1 = to_local(datetime1, self.tz)
+        datetime2 = to_local(datetime2, self.tz)
+        # Calculate basic difference
+        difference = datetime2 - datetime1
+        # Find date range
+        date1, date2 = (datetime1.date(), datetime2.date())
+        if ignored.is_ignored(date1):
+            # This is the first date, so get the amount of time remaining in
+            # the day on datetime1 and subtract it from the difference
+            this_day = datetime1.replace(hour=0, minute=0, second=0,
+                                         microsecond=0)
+            next_day = this_day + timedelta(1)
+            difference -= next_day - datetime1
+        if date2 > date1 and ignored.is_ignored(date2):
+            # This is the last date, so get the amount of time elapsed in the
+            # day on datetime2 and subtract it from the difference
+            this_day = datetime2.replace(hour=0, minute=0, second=0,
+                                         microsecond=0)
+            difference -= datetime2 - this_day
+        # Every ignore day in-between is a full day
+        difference -= timedelta(ignored.count(date1 + timedelta(1), date2))
+        # Ensure that difference >= 0
+        # This prevents the weird case where the dates are on the same ignore
+        # day
+        difference = max(timedelta(), difference)
+        # Return result
+        return difference
+    
+    def calc_addtimedelta(self, dt, delta):
+        """
+        Calculates the date after adding a time delta.
+        
+        Along with adding the two dates, this adds time on ignored dates and
+        weekdays.
+        
+        :Parameters:
+            dt
+                The date and time
+            delta
+                The difference to add
+        :Returns: The date with the delta added
+        :ReturnType: datetime.datetime
+        """
+        ignored = self.ignored
+        datetime1 = to_local(dt, self.tz)
+        datetime2 = datetime1 + delta
+        # Find date range
+        date1 = datetime1.date()
+        if datetime2.date() < date1:
+            return datetime2
+        if ignored.is_ignored(date1):
+            # This is the first date, so get the amount of time remaining in
+            # the day on datetime1 and add it to the sum
+            this_day = datetime1.replace(hour=0, minute=0, second=0,
+                                         microsecond=0)
+            next_day = this_day + timedelta(1)
+            datetime2 += next_day - datetime1
+        # Every full ignore day in-between pushes the end back a day.  The end
+        # lands just after the day that leaves as many counted days in-between
+        # as there were before anything was pushed back.
+        counted = (datetime2.date() - date1).days - 1
+        if counted < 0:
+            return datetime2
+        elif counted == 0:
+            last_date = date1 + timedelta(1)
+        else:
+            last_date = ignored.nth_counted(date1 + timedelta(1), counted) + \
+                        timedelta(1)
+        datetime2 += last_date - datetime2.date()
+        # If the last date is an ignore day, get the amount of time elapsed in
+        # the day on datetime2 and add it to the sum.  That can spill over
+        # into another ignore day, but the spill shrinks each time.
+        while ignored.is_ignored(last_date):
+            this_day = datetime2.replace(hour=0, minute=0, second=0,
+                                         microsecond=0)
+            datetime2 += datetime2 - this_day
+            if datetime2.date() == last_date:
+                break
+            last_date = datetime2.date()
+        # Return result
+        return datetime2
+    
+    ## BATCH ##
+    
+    def _to_arrays(self, datetimes):
+        """
+        Converts datetimes to microseconds since the epoch, in UTC and in
+        local time.
+        
+        :Parameters:
+            datetimes
+                A sequence of datetimes, or a NumPy ``datetime64`` array.
+                Naive datetimes are interpreted as UTC.
+        :Returns: The UTC times and the local times
+        :ReturnType: tuple of numpy.ndarray
+        """
+        if not numpy_available:
+            raise RuntimeError("NumPy is required for batch calculations")
+        if isinstance(datetimes, numpy.ndarray) and \
+           datetimes.dtype.kind == 'M':
+            datetimes = datetimes.astype('datetime64[us]').tolist()
+        utc = [to_naive_utc(dt) for dt in datetimes]
+        offsets = [to_local(dt, self.tz).utcoffset() for dt in utc]
+        utc = numpy.array(utc, dtype='datetime64[us]').astype(numpy.int64)
+        offsets = numpy.array(offsets,
+                              dtype='timedelta64[us]').astype(numpy.int64)
+        return utc, utc + offsets
+    
+    def batch_timedelta(self, starts, ends):
+        """
+        Calculates the deltas between several pairs of datetimes.
+        
+        This gives the same results as `calc_timedelta`, except that pairs
+        that end before they start give zero instead of failing.
+        
+        :Parameters:
+            starts
+                The first dates and times
+            ends
+                The second dates and times
+        :Returns: The differences between the dates
+        :ReturnType: numpy.ndarray of ``timedelta64``
+        :Raises RuntimeError: If NumPy isn't installed
+        """
+        ignored = self.ignored
+        utc1, local1 = self._to_arrays(starts)
+        utc2, local2 = self._to_arrays(ends)
+        backward = utc2 < utc1
+        utc2 = numpy.where(backward, utc1, utc2)
+        local2 = numpy.where(backward, local1, local2)
+        date1, time1 = numpy.divmod(local1, _DAY)
+        date2, time2 = numpy.divmod(local2, _DAY)
+        difference = utc2 - utc1
+        # Time left in an ignored first day
+        difference -= numpy.where(ignored.is_ignored_many(date1),
+                                  _DAY - time1, 0)
+        # Time elapsed in an ignored last day
+        difference -= numpy.where((date2 > date1) &
+                                  ignored.is_ignored_many(date2), time2, 0)
+        # Full ignored days in-between
+        difference -= _DAY * ignored.count_many(date1 + 1, date2)
+        difference = numpy.maximum(difference, 0)
+        return difference.astype('timedelta64[us]')
+    
+    def batch_addtimedelta(self, datetimes, delta):
+        """
+        Calculates the dates after adding a time delta to several datetimes.
+        
+        This gives the same results as `calc_addtimedelta`.
+        
+        :Parameters:
+            datetimes
+                The dates and times
+            delta : datetime.timedelta
+                The difference to add
+        :Returns: The dates with the delta added, in UTC
+        :ReturnType: numpy.ndarray of ``datetime64``
+        :Raises RuntimeError: If NumPy isn't installed
+        """
+        ignored = self.ignored
+        utc1, local1 = self._to_arrays(datetimes)
+        delta = (delta.days * _DAY + delta.seconds * 1000000 +
+                 delta.microseconds)
+        date1, time1 = numpy.divmod(local1, _DAY)
+        local2 = local1 + delta
+        # Deltas that go backward don't look at the calendar at all
+        forward = (local2 // _DAY) >= date1
+        # Time left in an ignored first day
+        local2 += numpy.where(forward & ignored.is_ignored_many(date1),
+                              _DAY - time1, 0)
+        # Full ignored days in-between
+        counted = local2 // _DAY - date1 - 1
+        pushed = counted > 0
+        last_date = date1 + 1
+        if pushed.any():
+            last_date[pushed] = ignored.nth_counted_many(
+                date1[pushed] + 1, counted[pushed]) + 1
+        active = counted >= 0
+        local2 += numpy.where(active, (last_date - local2 // _DAY) * _DAY, 0)
+        # Time elapsed in an ignored last day, spilling over as needed
+        active &= ignored.is_ignored_many(last_date)
+        while active.any():
+            spill = numpy.where(active, local2 - last_date * _DAY, 0)
+            local2 += spill
+            new_date = local2 // _DAY
+            active &= (new_date != last_date)
+            last_date = new_date
+            active &= ignored.is_ignored_many(last_date)
+        return (local2 - (local1 - utc1)).astype('datetime64[us]')
+
 def calc_timedelta(datetime1, datetime2, tz=None,
                     ignore_dates=None, ignore_weekdays=None):
     """
     Calculates the delta between two datetimes.
     
     Along with subtracting the two dates, this removes time on specific dates
-    and weekdays.
+    and weekdays.  If you're doing this more than once with the same rules,
+    make a `GameCalendar` and use its `GameCalendar.calc_timedelta` instead.
     
     :Parameters:
         datetime1
@@ -226,48 +806,8 @@ def calc_timedelta(datetime1, datetime2, tz=None,
     :Returns: The difference between the two dates
     :ReturnType: datetime.timedelta
     """
-    assert datetime1 <= datetime2
-    # Get arguments
-    if tz is None:
-        tz = _get_local_timezone()
-    if ignore_dates is None:
-        ignore_dates = []
-    if ignore_weekdays is None:
-        ignore_weekdays = []
-    datetime1, datetime2 = to_local(datetime1, tz), to_local(datetime2, tz)
-    # Calculate basic difference
-    difference = datetime2 - datetime1
-    # Find date range
-    date1, date2 = (datetime1.date(), datetime2.date())
-    # Loop through all dates in-between date1 and date2
-    accum_date = date1
-    while accum_date <= date2:
-        if accum_date in ignore_dates or \
-           accum_date.isoweekday() in ignore_weekdays:
-            # This date is an ignore day, so let's decide what to do:
-            if accum_date == date1:
-                # This is the first date, so get the amount of time remaining
-                # in the day on datetime1 and subtract it from the difference
-                this_day = datetime1.replace(hour=0, minute=0, second=0,
-                                             microsecond=0)
-                next_day = this_day + timedelta(1)
-                difference -= next_day - datetime1
-            elif accum_date == date2:
-                # This is the last date, so get the amount of time elapsed
-                # in the day on datetime2 and subtract it from the difference
-                this_day = datetime2.replace(hour=0, minute=0, second=0,
-                                             microsecond=0)
-                difference -= datetime2 - this_day
-            else:
-                # Woo-hoo!  This is a full ignore day, so let's do simple math.
-                difference -= timedelta(1)
-        # Okay, let's take up the next day
-        accum_date += timedelta(1)
-    # Ensure that difference >= 0
-    # This prevents the weird case where the dates are on the same ignore day
-    difference = max(timedelta(), difference)
-    # Return result
-    return difference
+    calendar = GameCalendar(tz, ignore_dates, ignore_weekdays)
+    return calendar.calc_timedelta(datetime1, datetime2)
 
 def calc_addtimedelta(dt, delta, tz=None,
                       ignore_dates=None, ignore_weekdays=None):
@@ -275,7 +815,8 @@ def calc_addtimedelta(dt, delta, tz=None,
     Calculates the date after adding a time delta.
     
     Along with adding the two dates, this adds time on specific dates and
-    weekdays.
+    weekdays.  If you're doing this more than once with the same rules, make a
+    `GameCalendar` and use its `GameCalendar.calc_addtimedelta` instead.
     
     :Parameters:
         dt
@@ -296,41 +837,5 @@ def calc_addtimedelta(dt, delta, tz=None,
     :Returns: The date with the delta added
     :ReturnType: datetime.datetime
     """
-    # Get arguments
-    if tz is None:
-        tz = _get_local_timezone()
-    if ignore_dates is None:
-        ignore_dates = []
-    if ignore_weekdays is None:
-        ignore_weekdays = []
-    datetime1 = to_local(dt, tz)
-    datetime2 = datetime1 + delta
-    # Find date range
-    date1, date2 = (datetime1.date(), datetime2.date())
-    # Loop through all dates in-between date1 and date2
-    accum_date = date1
-    while accum_date <= date2:
-        if accum_date in ignore_dates or \
-           accum_date.isoweekday() in ignore_weekdays:
-            # This date is an ignore day, so let's decide what to do:
-            if accum_date == date1:
-                # This is the first date, so get the amount of time remaining
-                # in the day on datetime1 and add it to the sum
-                this_day = datetime1.replace(hour=0, minute=0, second=0,
-                                             microsecond=0)
-                next_day = this_day + timedelta(1)
-                datetime2 += next_day - datetime1
-            elif accum_date == date2:
-                # This is the last date, so get the amount of time elapsed
-                # in the day on datetime2 and add it to the sum
-                this_day = datetime2.replace(hour=0, minute=0, second=0,
-                                             microsecond=0)
-                datetime2 += datetime2 - this_day
-            else:
-                # Woo-hoo!  This is a full ignore day, so let's do simple math.
-                datetime2 += timedelta(1)
-            date2 = datetime2.date()
-        # Okay, let's take up the next day
-        accum_date += timedelta(1)
-    # Return result
-    return datetime2
+    calendar = GameCalendar(tz, ignore_dates, ignore_weekdays)
+    return calendar.calc_addtimedelta(dt, delta)
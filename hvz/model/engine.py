@@ -0,0 +1,660 @@
+#!/usr/bin/env python
+#
+#   model/engine.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Array-backed game engine
+
+`GameState` holds a whole game in a handful of arrays (one per column) and
+plays by the same rules as `hvz.model.game`, without going through the
+mapper.  It's meant for bulk analysis: replaying a game's event log, or
+trying out what would happen if things went differently.  Nothing it does is
+written back to the database.
+
+Dates are stored as microseconds since the epoch (UTC), with NaN for ``NULL``.
+Batch calculations use NumPy if it's installed.
+"""
+
+from array import array
+from datetime import datetime, timedelta
+
+import pytz
+
+from hvz.model import events
+from hvz.model.dates import now, make_aware, numpy_available
+from hvz.model.errors import WrongStateError, InvalidTimeError
+from hvz.model.game import PlayerEntry, Game
+
+if numpy_available:
+    import numpy
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['EntryState',
+           'GameState',]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+_NULL = float('nan')
+_NO_ID = -1
+
+_UNDEAD = (PlayerEntry.STATE_ZOMBIE, PlayerEntry.STATE_ORIGINAL_ZOMBIE)
+_DEAD = (PlayerEntry.STATE_DEAD, PlayerEntry.STATE_DEAD_OZ)
+
+def _to_micro(date):
+    if date is None:
+        return _NULL
+    delta = make_aware(date) - _EPOCH
+    return float((delta.days * 24 * 60 * 60 + delta.seconds) * 1000000 +
+                 delta.microseconds)
+
+def _from_micro(micro):
+    if micro != micro:
+        return None
+    return _EPOCH + timedelta(microseconds=int(micro))
+
+def _delta_micro(delta):
+    return float((delta.days * 24 * 60 * 60 + delta.seconds) * 1000000 +
+                 delta.microseconds)
+
+class EntryState(object):
+    """
+    A read-only copy of one entry in a `GameState`.
+    
+    The attributes are the same as those of `PlayerEntry`, except that users
+    are given by ID.
+    
+    :IVariables:
+        entry_id : int
+            The entry's database identifier
+        player_id : int
+            The player's user ID
+        state : int
+            The player's state (see the ``PlayerEntry.STATE_*`` constants)
+        death_date : datetime.datetime
+            When the player died
+        feed_date : datetime.datetime
+            Last time fed
+        starve_date : datetime.datetime
+            When the player starved
+        kills : int
+            How many humans tagged
+        killer_id : int
+            The user ID of the player's killer
+    """
+    __slots__ = ['entry_id', 'player_id', 'state', 'death_date', 'feed_date',
+                 'starve_date', 'kills', 'killer_id']
+    STATE_NAMES = PlayerEntry.STATE_NAMES
+    
+    def __init__(self, entry_id, player_id, state, death_date, feed_date,
+                 starve_date, kills, killer_id):
+        self.entry_id = entry_id
+        self.player_id = player_id
+        self.state = state
+        self.death_date = death_date
+        self.feed_date = feed_date
+        self.starve_date = starve_date
+        self.kills = kills
+        self.killer_id = killer_id
+    
+    def __repr__(self):
+        return "<EntryState %i>" % (self.entry_id)
+    
+    def __eq__(self, other):
+        if not isinstance(other, EntryState):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__)
+    
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+    
+    @classmethod
+    def from_entry(cls, entry):
+        """
+        Copies a mapped entry.
+        
+        :Parameters:
+            entry : `PlayerEntry`
+                The entry to copy
+        :ReturnType: `EntryState`
+        """
+        if entry.killed_by is None:
+            killer_id = None
+        else:
+            killer_id = entry.killed_by.user_id
+        return cls(entry.entry_id, entry.player.user_id, entry.state,
+                   entry.death_date, entry.feed_date, entry.starve_date,
+                   entry.kills, killer_id)
+
+class GameState(object):
+    """
+    A game's state, held in arrays.
+    
+    Entries are addressed by their entry ID.  The methods mirror those of
+    `Game` and `PlayerEntry`, and raise the same errors.
+    
+    :IVariables:
+        game_id : int
+            The game's database identifier
+        state : int
+            The game's state (see the ``Game.STATE_*`` constants)
+        started : datetime.datetime
+            When the game started
+        ended : datetime.datetime
+            When the game ended
+        calendar : `hvz.model.dates.GameCalendar`
+            The game's calendar
+        zombie_starve_timedelta : datetime.timedelta
+            How long a zombie can go without feeding
+        zombie_report_timedelta : datetime.timedelta
+            How long a zombie has to report a kill
+        human_undead_timedelta : datetime.timedelta
+            How long the infected take to turn
+    """
+    STATE_NAMES = Game.STATE_NAMES
+    
+    def __init__(self, game_id, state, calendar, zombie_starve_timedelta,
+                 zombie_report_timedelta, human_undead_timedelta,
+                 started=None, ended=None):
+        self.game_id = game_id
+        self.state = state
+        self.calendar = calendar
+        self.zombie_starve_timedelta = zombie_starve_timedelta
+        self.zombie_report_timedelta = zombie_report_timedelta
+        self.human_undead_timedelta = human_undead_timedelta
+        self.started = started
+        self.ended = ended
+        self._index = {}
+        self.entry_ids = array('l')
+        self.player_ids = array('l')
+        self.states = array('b')
+        self.death_dates = array('d')
+        self.feed_dates = array('d')
+        self.starve_dates = array('d')
+        self.kills = array('l')
+        self.killer_ids = array('l')
+    
+    def __repr__(self):
+        return "<GameState %r, %i entries>" % (self.game_id, len(self))
+    
+    def __len__(self):
+        return len(self.entry_ids)
+    
+    ## LOADING ##
+    
+    @classmethod
+    def _from_game(cls, game):
+        return cls(game.game_id, game.state, game.calendar,
+                   game.zombie_starve_timedelta,
+                   game.zombie_report_timedelta,
+                   game.human_undead_timedelta,
+                   started=game.started, ended=game.ended)
+    
+    @classmethod
+    def load(cls, game):
+        """
+        Loads a game's current state with a single query.
+        
+        :Parameters:
+            game : `Game`
+                The game to load
+        :ReturnType: `GameState`
+        """
+        from sqlalchemy import select
+        from turbogears.database import session
+        from hvz.model.game import entries_table
+        session.flush()
+        columns = entries_table.c
+        query = select([columns.entry_id, columns.player_id, columns.state,
+                        columns.death_date, columns.feed_date,
+                        columns.starve_date, columns.kills,
+                        columns.killer_id],
+                       columns.game_id == game.game_id,
+                       order_by=[columns.entry_id])
+        result = cls._from_game(game)
+        for row in session.execute(query):
+            result.add_entry(*row)
+        return result
+    
+    @classmethod
+    def replay(cls, game, until=None):
+        """
+        Rebuilds a game's state from its event log.
+        
+        Every entry starts out human, and the logged states are applied in
+        order.
+        
+        :Parameters:
+            game : `Game`
+                The game to replay
+            until : datetime.datetime
+                Only replay events that occurred up to this time.  Defaults to
+                replaying everything.
+        :ReturnType: `GameState`
+        """
+        from sqlalchemy import select
+        from turbogears.database import session
+        from hvz.model.game import entries_table
+        session.flush()
+        columns = entries_table.c
+        query = select([columns.entry_id, columns.player_id],
+                       columns.game_id == game.game_id,
+                       order_by=[columns.entry_id])
+        result = cls._from_game(game)
+        result.state = Game.STATE_CREATED
+        result.started = result.ended = None
+        for entry_id, player_id in session.execute(query):
+            result.add_entry(entry_id, player_id)
+        if until is not None:
+            until = make_aware(until)
+        for row in events.history(game.game_id):
+            if until is not None and make_aware(row['occurred']) > until:
+                continue
+            result.apply_event(row)
+        return result
+    
+    def add_entry(self, entry_id, player_id, state=PlayerEntry.STATE_HUMAN,
+                  death_date=None, feed_date=None, starve_date=None,
+                  kills=0, killer_id=None):
+        """
+        Adds an entry to the game.
+        
+        :Parameters:
+            entry_id : int
+                The entry's database identifier
+            player_id : int
+                The player's user ID
+        """
+        if entry_id in self._index:
+            raise ValueError("Entry %i is already in the game" % (entry_id))
+        self._index[entry_id] = len(self.entry_ids)
+        self.entry_ids.append(entry_id)
+        self.player_ids.append(player_id)
+        self.states.append(state)
+        self.death_dates.append(_to_micro(death_date))
+        self.feed_dates.append(_to_micro(feed_date))
+        self.starve_dates.append(_to_micro(starve_date))
+        self.kills.append(kills or 0)
+        if killer_id is None:
+            self.killer_ids.append(_NO_ID)
+        else:
+            self.killer_ids.append(killer_id)
+    
+    def apply_event(self, row):
+        """
+        Applies a row from the event log.
+        
+        :Parameters:
+            row
+                A ``game_events`` row (or a dict with the same keys)
+        """
+        if row['kind'] == events.KIND_STAGE:
+            self.state = row['state']
+            if self.state == Game.STATE_STARTED:
+                self.started = make_aware(row['occurred'])
+            elif self.state == Game.STATE_ENDED:
+                self.ended = make_aware(row['occurred'])
+            return
+        i = self._index.get(row['entry_id'])
+        if i is None:
+            # The entry has since been deleted
+            return
+        self.states[i] = row['state']
+        self.death_dates[i] = _to_micro(row['death_date'])
+        self.feed_dates[i] = _to_micro(row['feed_date'])
+        self.starve_dates[i] = _to_micro(row['starve_date'])
+        self.kills[i] = row['kills'] or 0
+        if row['killer_id'] is None:
+            self.killer_ids[i] = _NO_ID
+        else:
+            self.killer_ids[i] = row['killer_id']
+    
+    def copy(self):
+        """
+        Copies the state, for trying out what-ifs.
+        
+        :ReturnType: `GameState`
+        """
+        result = type(self)(self.game_id, self.state, self.calendar,
+                            self.zombie_starve_timedelta,
+                            self.zombie_report_timedelta,
+                            self.human_undead_timedelta,
+                            started=self.started, ended=self.ended)
+        result._index = dict(self._index)
+        for name in ('entry_ids', 'player_ids', 'states', 'death_dates',
+                     'feed_dates', 'starve_dates', 'kills', 'killer_ids'):
+            setattr(result, name, array(getattr(self, name).typecode,
+                                        getattr(self, name)))
+        return result
+    
+    ## READING ##
+    
+    def _get_index(self, entry_id):
+        try:
+            return self._index[entry_id]
+        except KeyError:
+            raise KeyError("No entry %r in game %r" % (entry_id, self.game_id))
+    
+    def _record(self, i):
+        killer_id = self.killer_ids[i]
+        if killer_id == _NO_ID:
+            killer_id = None
+        return EntryState(self.entry_ids[i], self.player_ids[i],
+                          self.states[i], _from_micro(self.death_dates[i]),
+                          _from_micro(self.feed_dates[i]),
+                          _from_micro(self.starve_dates[i]), self.kills[i],
+                          killer_id)
+    
+    def entry(self, entry_id):
+        """
+        Reads an entry.
+        
+        :Parameters:
+            entry_id : int
+                The entry's database identifier
+        :ReturnType: `EntryState`
+        """
+        return self._record(self._get_index(entry_id))
+    
+    def entries(self):
+        """
+        Reads every entry, in the order they were added.
+        
+        :ReturnType: list of `EntryState`
+        """
+        return [self._record(i) for i in xrange(len(self))]
+    
+    def count_states(self):
+        """
+        Counts the entries in each state.
+        
+        :ReturnType: dict of {int: int}
+        """
+        counts = dict.fromkeys(PlayerEntry.STATE_NAMES, 0)
+        for state in self.states:
+            counts[state] += 1
+        return counts
+    
+    @property
+    def in_progress(self):
+        return Game.STATE_STARTED <= self.state < Game.STATE_ENDED
+    
+    @property
+    def winner(self):
+        if self.state != Game.STATE_ENDED:
+            return None
+        counts = self.count_states()
+        if counts[PlayerEntry.STATE_HUMAN] == 0:
+            return 'zombie'
+        elif (counts[PlayerEntry.STATE_ZOMBIE] +
+              counts[PlayerEntry.STATE_ORIGINAL_ZOMBIE]) == 0:
+            return 'human'
+        else:
+            return None
+    
+    ## CALCULATIONS ##
+    
+    def _last_fed(self, i):
+        feed_date = self.feed_dates[i]
+        if feed_date != feed_date:
+            return self.death_dates[i]
+        return feed_date
+    
+    def _time_since_feeding(self, i, time):
+        feed_date = _from_micro(self._last_fed(i))
+        if time <= feed_date:
+            return timedelta()
+        return self.calendar.calc_timedelta(feed_date, time)
+    
+    def _elapsed_many(self, starts, time):
+        """Game time in microseconds from each start to a single time."""
+        if not starts:
+            return []
+        if numpy_available:
+            starts = numpy.array(starts, dtype=numpy.int64)
+            ends = numpy.empty_like(starts)
+            ends.fill(int(_to_micro(time)))
+            result = self.calendar.batch_timedelta(
+                starts.astype('datetime64[us]'), ends.astype('datetime64[us]'))
+            return result.astype(numpy.int64).tolist()
+        result = []
+        for start in starts:
+            start = _from_micro(start)
+            if time <= start:
+                result.append(0.0)
+            else:
+                delta = self.calendar.calc_timedelta(start, time)
+                result.append(_delta_micro(delta))
+        return result
+    
+    def _add_many(self, starts, delta):
+        """Each start plus a delta of game time, in microseconds."""
+        if not starts:
+            return []
+        if numpy_available:
+            starts = numpy.array(starts, dtype=numpy.int64)
+            result = self.calendar.batch_addtimedelta(
+                starts.astype('datetime64[us]'), delta)
+            return result.astype('datetime64[us]').astype(numpy.int64).tolist()
+        return [_to_micro(self.calendar.calc_addtimedelta(_from_micro(start),
+                                                          delta))
+                for start in starts]
+    
+    ## ACTIONS ##
+    
+    def kill(self, killer_id, victim_id, date=None, report_time=None):
+        """
+        Makes one player zombify another.
+        
+        This follows `PlayerEntry.kill`.
+        
+        :Parameters:
+            killer_id : int
+                The killer's entry ID
+            victim_id : int
+                The victim's entry ID
+            date : datetime.datetime
+                The date and time of the demise
+            report_time : datetime.datetime
+                The date and time that the kill was reported
+        """
+        killer, victim = self._get_index(killer_id), self._get_index(victim_id)
+        if date is None:
+            date = now()
+        else:
+            date = make_aware(date)
+        if report_time is None:
+            report_time = now()
+        else:
+            report_time = make_aware(report_time)
+        killer_state = self.states[killer]
+        if killer_state not in _UNDEAD and killer_state not in _DEAD:
+            raise WrongStateError(self._record(killer), killer_state,
+                                  PlayerEntry.STATE_ZOMBIE,
+                                  _("Killer must be zombie"))
+        if date > report_time:
+            raise InvalidTimeError(self._record(killer),
+                                   _("You cannot kill someone in the future"))
+        if not self.in_progress:
+            raise WrongStateError(self, self.state, Game.STATE_STARTED,
+                                  _("Game is not in progress"))
+        micro = _to_micro(date)
+        if micro <= self.death_dates[killer] or \
+           micro <= self.feed_dates[killer]:
+            raise InvalidTimeError(self._record(killer),
+                                   _("You must report kills chronologically"))
+        if report_time - date > self.zombie_report_timedelta:
+            raise InvalidTimeError(self._record(killer),
+                                   _("Kill not within report window"))
+        if self._time_since_feeding(killer, date) > \
+           self.zombie_starve_timedelta:
+            raise InvalidTimeError(self._record(killer),
+                                   _("Killer has already starved"))
+        if self.states[victim] != PlayerEntry.STATE_HUMAN:
+            raise WrongStateError(self._record(victim), self.states[victim],
+                                  PlayerEntry.STATE_HUMAN,
+                                  _("Victim must be human"))
+        self.kills[killer] += 1
+        self.feed_dates[killer] = micro
+        self.death_dates[victim] = _to_micro(date +
+                                             self.human_undead_timedelta)
+        self.states[victim] = PlayerEntry.STATE_INFECTED
+        self.killer_ids[victim] = self.player_ids[killer]
+        if killer_state == PlayerEntry.STATE_DEAD_OZ:
+            self.starve_dates[killer] = _NULL
+            self.states[killer] = PlayerEntry.STATE_ORIGINAL_ZOMBIE
+        elif killer_state == PlayerEntry.STATE_DEAD:
+            self.starve_dates[killer] = _NULL
+            self.states[killer] = PlayerEntry.STATE_ZOMBIE
+    
+    def starve(self, entry_id, date=None):
+        """
+        Makes a zombie die from starvation.
+        
+        This follows `PlayerEntry.starve`.
+        
+        :Parameters:
+            entry_id : int
+                The zombie's entry ID
+            date : datetime.datetime
+                The date and time of the starvation
+        """
+        i = self._get_index(entry_id)
+        if date is None:
+            date = now()
+        else:
+            date = make_aware(date)
+        if not self.in_progress:
+            raise WrongStateError(self, self.state, Game.STATE_STARTED,
+                                  _("Game is not in progress"))
+        if self.states[i] not in _UNDEAD:
+            raise WrongStateError(self._record(i), self.states[i],
+                                  PlayerEntry.STATE_ZOMBIE,
+                                  _("Non-zombies can't starve"))
+        self.starve_dates[i] = _to_micro(date)
+        if self.states[i] == PlayerEntry.STATE_ORIGINAL_ZOMBIE:
+            self.states[i] = PlayerEntry.STATE_DEAD_OZ
+        else:
+            self.states[i] = PlayerEntry.STATE_DEAD
+    
+    def update(self, update_time=None):
+        """
+        Turns the infected, starves the hungry, and ends the game if one side
+        has won.
+        
+        This follows `Game.update`.
+        
+        :Parameters:
+            update_time : datetime.datetime
+                The time of the update.  Defaults to now.
+        """
+        if update_time is None:
+            update_time = now()
+        else:
+            update_time = make_aware(update_time)
+        if not self.in_progress:
+            return
+        states = self.states
+        # Zombie win
+        if PlayerEntry.STATE_HUMAN not in states:
+            deaths = [self.death_dates[i] for i in xrange(len(self))
+                      if states[i] in _UNDEAD or
+                         states[i] == PlayerEntry.STATE_INFECTED]
+            if deaths:
+                self.end(_from_micro(max(deaths)))
+        if not self.in_progress:
+            return
+        # Infected turning
+        micro = _to_micro(update_time)
+        for i in xrange(len(self)):
+            if states[i] == PlayerEntry.STATE_INFECTED and \
+               self.death_dates[i] <= micro:
+                states[i] = PlayerEntry.STATE_ZOMBIE
+        # Starving
+        undead = [i for i in xrange(len(self)) if states[i] in _UNDEAD]
+        last_feds = [self._last_fed(i) for i in undead]
+        starve_micro = _delta_micro(self.zombie_starve_timedelta)
+        elapsed = self._elapsed_many(last_feds, update_time)
+        starved = [(i, last_fed) for i, last_fed, delta in
+                   zip(undead, last_feds, elapsed) if delta >= starve_micro]
+        starve_dates = self._add_many([last_fed for i, last_fed in starved],
+                                      self.zombie_starve_timedelta)
+        for (i, last_fed), starve_date in zip(starved, starve_dates):
+            self.starve_dates[i] = starve_date
+            if states[i] == PlayerEntry.STATE_ORIGINAL_ZOMBIE:
+                states[i] = PlayerEntry.STATE_DEAD_OZ
+            else:
+                states[i] = PlayerEntry.STATE_DEAD
+        # Human win
+        for state in states:
+            if state in _UNDEAD or state == PlayerEntry.STATE_INFECTED:
+                return
+        corpses = [i for i in xrange(len(self)) if states[i] in _DEAD]
+        if not corpses:
+            return
+        max_duration = (self.zombie_starve_timedelta +
+                        self.zombie_report_timedelta)
+        for i in corpses:
+            last_fed = _from_micro(self._last_fed(i))
+            if update_time <= last_fed or \
+               self.calendar.calc_timedelta(last_fed,
+                                            update_time) <= max_duration:
+                # Someone could still report a kill!
+                return
+        self.end(_from_micro(max(self.starve_dates[i] for i in corpses)))
+    
+    def end(self, end_time=None):
+        """
+        Ends the game.
+        
+        This follows `Game.end`: zombies that starved after the end are
+        brought back.
+        
+        :Parameters:
+            end_time : datetime.datetime
+                When the game ended.  Defaults to now.
+        """
+        if end_time is None:
+            end_time = now()
+        else:
+            end_time = make_aware(end_time)
+        if not self.in_progress:
+            raise WrongStateError(self, self.state, Game.STATE_STARTED,
+                                  _("The game cannot be ended right now %i"))
+        self.state = Game.STATE_ENDED
+        self.ended = end_time
+        micro = _to_micro(end_time)
+        for i in xrange(len(self)):
+            state = self.states[i]
+            if state in _DEAD and self.starve_dates[i] > micro:
+                starve_at = self.calendar.calc_addtimedelta(
+                    _from_micro(self._last_fed(i)),
+                    self.zombie_starve_timedelta)
+                if starve_at <= end_time:
+                    self.feed_dates[i] = micro
+                self.starve_dates[i] = _NULL
+                if state == PlayerEntry.STATE_DEAD_OZ:
+                    self.states[i] = PlayerEntry.STATE_ORIGINAL_ZOMBIE
+                else:
+                    self.states[i] = PlayerEntry.STATE_ZOMBIE
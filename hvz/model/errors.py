@@ -28,6 +28,7 @@ __all__ = ['ModelError',
            'WrongStateError',
            'InvalidTimeError',
            'PlayerNotFoundError',
+           'ConcurrentUpdateError',
            'ImageError',
            'ImageTooLargeError',
            'InvalidImageTypeError',
@@ -117,6 +118,12 @@ class InvalidTimeError(ModelError):
 class PlayerNotFoundError(ModelError):
     """Raised when a player can't be found (i.e. an invalid GID is given)."""
 
+class ConcurrentUpdateError(ModelError):
+    """
+    Raised when an action keeps losing races with other updates to the same
+    object and gives up.
+    """
+
 class ImageError(Exception):
     """Base exception for all image-related errors."""
 
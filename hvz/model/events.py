@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+#
+#   model/events.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Game event log
+
+Every change to an entry's state is appended to the ``game_events`` table,
+along with the entry's resulting state, so the log doubles as an audit trail
+and as a backup: `rebuild_entries` replays it to regenerate the entries.
+Stage changes are logged too, with the game's new state.
+
+:Variables:
+    KIND_NAMES : dict of {int: unicode}
+        Kind-to-human-readable-name lookup table
+"""
+
+from sqlalchemy import Table, Column, ForeignKey, Integer
+from turbogears.database import metadata, session
+
+from hvz.model.dates import now, to_naive_utc, date_param, UTCDateTime
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['KIND_KILL',
+           'KIND_INFECT',
+           'KIND_TURN',
+           'KIND_STARVE',
+           'KIND_ORIGINAL_ZOMBIE',
+           'KIND_FORCE',
+           'KIND_RESET',
+           'KIND_EDIT',
+           'KIND_STAGE',
+           'KIND_NAMES',
+           'record',
+           'record_many',
+           'record_stage',
+           'history',
+           'rebuild_entries',]
+
+KIND_KILL = 1
+KIND_INFECT = 2
+KIND_TURN = 3
+KIND_STARVE = 4
+KIND_ORIGINAL_ZOMBIE = 5
+KIND_FORCE = 6
+KIND_RESET = 7
+KIND_EDIT = 8
+KIND_STAGE = 9
+KIND_NAMES = {KIND_KILL: _("Kill"),
+              KIND_INFECT: _("Infection"),
+              KIND_TURN: _("Turned"),
+              KIND_STARVE: _("Starvation"),
+              KIND_ORIGINAL_ZOMBIE: _("Original zombie"),
+              KIND_FORCE: _("Forced"),
+              KIND_RESET: _("Reset"),
+              KIND_EDIT: _("Edited"),
+              KIND_STAGE: _("Stage change"),}
+
+## TABLES ##
+events_table = Table('game_events', metadata,
+    Column('event_id', Integer, primary_key=True),
+    Column('game_id', Integer, ForeignKey('game.game_id',
+           ondelete='CASCADE', onupdate='CASCADE'), index=True),
+    Column('entry_id', Integer),
+    Column('kind', Integer),
+    Column('occurred', UTCDateTime),
+    Column('recorded', UTCDateTime),
+    # The entry's (or for stage changes, the game's) resulting state
+    Column('state', Integer),
+    Column('death_date', UTCDateTime),
+    Column('feed_date', UTCDateTime),
+    Column('starve_date', UTCDateTime),
+    Column('kills', Integer),
+    Column('killer_id', Integer),
+)
+
+## RECORDING ##
+
+def _snapshot(kind, entry, occurred):
+    if entry.entry_id is None:
+        session.flush()
+    if entry.killed_by is None:
+        killer_id = None
+    else:
+        killer_id = entry.killed_by.user_id
+    return dict(game_id=entry.game.game_id,
+                entry_id=entry.entry_id,
+                kind=kind,
+                occurred=to_naive_utc(occurred),
+                recorded=to_naive_utc(now()),
+                state=entry.state,
+                death_date=to_naive_utc(entry.death_date),
+                feed_date=to_naive_utc(entry.feed_date),
+                starve_date=to_naive_utc(entry.starve_date),
+                kills=entry.kills,
+                killer_id=killer_id,)
+
+def record(kind, entry, occurred=None):
+    """
+    Logs an event for an entry, along with the entry's current state.
+    
+    :Parameters:
+        kind : int
+            The kind of event (one of the ``KIND_*`` constants)
+        entry : `hvz.model.game.PlayerEntry`
+            The entry that changed
+        occurred : datetime.datetime
+            When the event happened in the game.  Defaults to now.
+    """
+    if occurred is None:
+        occurred = now()
+    session.execute(events_table.insert(), _snapshot(kind, entry, occurred))
+
+def record_many(rows):
+    """
+    Logs several events at once.
+    
+    This is for the set-based statements in `hvz.model.game.Game.update`,
+    which never load the entries.
+    
+    :Parameters:
+        rows : list of dict
+            Rows for the ``game_events`` table.  ``recorded`` is filled in.
+    """
+    if rows:
+        recorded = to_naive_utc(now())
+        for row in rows:
+            row['recorded'] = recorded
+        session.execute(events_table.insert(), rows)
+
+def record_stage(game, occurred=None):
+    """
+    Logs a game's stage change.
+    
+    :Parameters:
+        game : `hvz.model.game.Game`
+            The game that changed
+        occurred : datetime.datetime
+            When the stage changed.  Defaults to now.
+    """
+    if occurred is None:
+        occurred = now()
+    if game.game_id is None:
+        session.flush()
+    session.execute(events_table.insert(),
+                    dict(game_id=game.game_id,
+                         entry_id=None,
+                         kind=KIND_STAGE,
+                         occurred=to_naive_utc(occurred),
+                         recorded=to_naive_utc(now()),
+                         state=game.state,))
+
+## READING ##
+
+def history(game_id):
+    """
+    Fetches a game's events, oldest first.
+    
+    :Parameters:
+        game_id : int
+            The game's ID
+    :Returns: The ``game_events`` rows
+    :ReturnType: list
+    """
+    from sqlalchemy import select
+    query = select([events_table], events_table.c.game_id == game_id,
+                   order_by=[events_table.c.event_id])
+    return session.execute(query).fetchall()
+
+def rebuild_entries(game_id=None):
+    """
+    Regenerates entries from the event log.
+    
+    The log is read in one pass, keeping only the latest state of each entry,
+    and the entries are then written back in a single batch.  Entries with no
+    events (i.e. from before the log existed) are left alone.  Loaded entries
+    aren't refreshed, so run this from a fresh session.
+    
+    :Parameters:
+        game_id : int
+            The game to rebuild.  Defaults to every game.
+    :Returns: The IDs of the games that were rebuilt
+    :ReturnType: set of int
+    """
+    from sqlalchemy import and_, bindparam, select
+    from hvz.model.game import entries_table
+    from hvz.model.summary import mark_stale
+    columns = events_table.c
+    criterion = (columns.entry_id != None)
+    if game_id is not None:
+        criterion = and_(criterion, columns.game_id == game_id)
+    query = select([columns.game_id, columns.entry_id, columns.state,
+                    columns.death_date, columns.feed_date,
+                    columns.starve_date, columns.kills, columns.killer_id],
+                   criterion, order_by=[columns.event_id])
+    latest = {}
+    for row in session.execute(query):
+        latest[row['entry_id']] = row
+    changes = [dict(target_id=entry_id,
+                    new_state=row['state'],
+                    new_death_date=row['death_date'],
+                    new_feed_date=row['feed_date'],
+                    new_starve_date=row['starve_date'],
+                    new_kills=row['kills'],
+                    new_killer_id=row['killer_id'],)
+               for entry_id, row in latest.iteritems()]
+    if changes:
+        entry_columns = entries_table.c
+        stmt = entries_table.update(
+            entry_columns.entry_id == bindparam('target_id'),
+            values={'state': bindparam('new_state'),
+                    'death_date': date_param('new_death_date'),
+                    'feed_date': date_param('new_feed_date'),
+                    'starve_date': date_param('new_starve_date'),
+                    'kills': bindparam('new_kills'),
+                    'killer_id': bindparam('new_killer_id'),
+                    'version': entry_columns.version + 1,})
+        session.execute(stmt, changes)
+    game_ids = set(row['game_id'] for row in latest.itervalues())
+    for changed_id in game_ids:
+        mark_stale(changed_id)
+    return game_ids
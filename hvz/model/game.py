@@ -28,15 +28,18 @@ import string
 import pkg_resources
 pkg_resources.require("SQLAlchemy>=0.4.2")
 
-from sqlalchemy import (Table, Column, ForeignKey, UniqueConstraint,
-                        String, Unicode, Integer, Boolean, DateTime)
+from sqlalchemy import (Table, Column, ForeignKey, UniqueConstraint, Index,
+                        String, Unicode, Integer, Boolean)
 from sqlalchemy.orm import backref, relation, synonym
 from turbogears.database import mapper, metadata, session
 
-from hvz.model import identity
-from hvz.model.dates import (now, date_prop, make_aware,
-                             calc_timedelta, calc_addtimedelta)
-from hvz.model.errors import ModelError, WrongStateError, InvalidTimeError
+from hvz.model import events, identity, locking, transactions
+from hvz.model.dates import (now, date_prop, as_utc, make_aware,
+                             to_naive_utc, date_param, numpy_available,
+                             GameCalendar, UTCDateTime)
+from hvz.model.errors import (ModelError, WrongStateError, InvalidTimeError,
+                              ConcurrentUpdateError)
+from hvz.model.summary import GameSummary, SummaryExtension, mark_stale
 
 __author__ = 'Ross Light'
 __date__ = 'April 18, 2008'
@@ -53,25 +56,38 @@ entries_table = Table('entries', metadata,
            ondelete='CASCADE', onupdate='CASCADE'), index=True),
     Column('player_gid', String(128)),
     Column('state', Integer),
-    Column('death_date', DateTime),
-    Column('feed_date', DateTime),
-    Column('starve_date', DateTime),
+    Column('death_date', UTCDateTime),
+    Column('feed_date', UTCDateTime),
+    Column('starve_date', UTCDateTime),
     Column('kills', Integer),
     Column('killer_id', Integer, ForeignKey('tg_user.user_id',
            ondelete='RESTRICT', onupdate='CASCADE')),
     Column('original_pool', Boolean),
     Column('notify_sms', Boolean),
+    Column('starve_at', UTCDateTime),
+    Column('turn_at', UTCDateTime),
+    Column('version', Integer, nullable=False, default=1),
     # Constraints
     UniqueConstraint('game_id', 'player_gid'),
     UniqueConstraint('game_id', 'player_id'),
 )
+Index('ix_entries_starve_at', entries_table.c.game_id,
+      entries_table.c.state, entries_table.c.starve_at)
+Index('ix_entries_turn_at', entries_table.c.game_id,
+      entries_table.c.state, entries_table.c.turn_at)
+Index('ix_entries_death_date', entries_table.c.game_id,
+      entries_table.c.death_date, entries_table.c.entry_id)
+Index('ix_entries_feed_date', entries_table.c.game_id,
+      entries_table.c.feed_date, entries_table.c.entry_id)
+Index('ix_entries_kills', entries_table.c.game_id,
+      entries_table.c.kills, entries_table.c.entry_id)
 
 games_table = Table('game', metadata,
     Column('game_id', Integer, primary_key=True),
     Column('display_name', Unicode(255)),
-    Column('created', DateTime),
-    Column('started', DateTime),
-    Column('ended', DateTime),
+    Column('created', UTCDateTime),
+    Column('started', UTCDateTime),
+    Column('ended', UTCDateTime),
     Column('state', Integer),
     Column('ignore_dates', String(2048)),
     Column('ignore_weekdays', String(16)),
@@ -81,7 +97,8 @@ games_table = Table('game', metadata,
     Column('gid_length', Integer),
     Column('safe_zones', Unicode(2048)),
     Column('rules_notes', Unicode(4096)),
-    Column('reveal_oz_date', DateTime),
+    Column('reveal_oz_date', UTCDateTime),
+    Column('next_transition', UTCDateTime),
 )
 
 ## CLASSES ##
@@ -131,9 +148,19 @@ class PlayerEntry(object):
             zombie
         starve_date : datetime.datetime
             When the player starved
+        starve_at : datetime.datetime
+            When the zombie is projected to starve (see
+            `calculate_starve_time`), or ``None`` if the player isn't undead.
+            Kept up to date by `refresh_deadlines`.
+        turn_at : datetime.datetime
+            When the infected player will become a zombie, or ``None`` if the
+            player isn't infected.  Kept up to date by `refresh_deadlines`.
         notify_sms : bool
             Whether the user wants to be notified by text message when the game
             is updated
+        version : int
+            Incremented on every write, so that concurrent writers notice each
+            other (see `report_kill`)
         affiliation : unicode
             A human-readable name for the player's state
         is_undead : bool
@@ -170,6 +197,12 @@ class PlayerEntry(object):
                             STATE_DEAD_OZ: _("Dead (Original Zombie)"),
                             STATE_HUMAN: _("Human"),
                             STATE_INFECTED: _("Infected"),}
+    FACTION_STATES = {'human': (STATE_HUMAN,),
+                      'zombie': (STATE_ORIGINAL_ZOMBIE, STATE_ZOMBIE),
+                      'infected': (STATE_INFECTED,),
+                      'starved': (STATE_DEAD, STATE_DEAD_OZ),}
+    ROSTER_ORDERS = ('name', 'affiliation', 'death_date', 'feed_date',
+                     'kills', 'player_gid',)
     
     ## INITIALIZATION/RETRIEVING ##
     
@@ -184,13 +217,91 @@ class PlayerEntry(object):
     @classmethod
     def by_player(cls, game, user):
         """Fetches an entry by game and player."""
+        session.flush()
         return cls.query.filter_by(game=game, player=user).first()
     
     @classmethod
     def by_player_gid(cls, game, gid):
         """Fetches an entry by game and player_gid."""
+        session.flush()
         return cls.query.filter_by(game=game, player_gid=gid).first()
     
+    @classmethod
+    def roster_query(cls, game, order='name', reverse=False, faction=None,
+                     show_oz=True):
+        """
+        Builds a query for a page of a game's roster.
+        
+        The sorting and filtering are done by the database, so the query can
+        be sliced into pages without loading the whole game.  Ties are broken
+        by entry ID, in the same direction, so that the entry indices can
+        serve the sort.  If *show_oz* is false, the original zombie is sorted
+        and filtered as the human the roster shows him/her as; sorting on the
+        raw columns would give him/her away, so the indices don't help then.
+        
+        The players and killers are loaded in the same query, so listing them
+        doesn't go back to the database for each entry.
+        
+        :Parameters:
+            game : `Game`
+                The game to list
+            order : str
+                The column to sort by (one of `ROSTER_ORDERS`)
+            reverse : bool
+                Whether to sort in descending order
+            faction : str
+                If given, only list players in this faction (a key of
+                `FACTION_STATES`)
+            show_oz : bool
+                Whether the original zombie has been revealed to the viewer
+        :Raises ValueError: If the order or faction is unknown
+        :ReturnType: ``sqlalchemy.orm.Query``
+        """
+        from sqlalchemy import case, desc, null
+        from sqlalchemy.orm import contains_eager, eagerload
+        columns = entries_table.c
+        users = identity.users_table
+        oz_states = (cls.STATE_ORIGINAL_ZOMBIE, cls.STATE_DEAD_OZ)
+        def mask(column, oz_value):
+            # What the roster shows for the original zombie
+            if show_oz:
+                return column
+            else:
+                return case([(columns.state.in_(oz_states), oz_value)],
+                            else_=column)
+        query = cls.query.filter(columns.game_id == game.game_id)
+        query = query.join('player')
+        query = query.options(contains_eager('player'), eagerload('killed_by'))
+        # Filter
+        if faction is not None:
+            try:
+                states = set(cls.FACTION_STATES[faction])
+            except KeyError:
+                raise ValueError("Unknown faction: %r" % (faction))
+            if not show_oz:
+                if faction == 'human':
+                    states.update(oz_states)
+                else:
+                    states.difference_update(oz_states)
+            query = query.filter(columns.state.in_(list(states)))
+        # Sort
+        if order == 'name':
+            sort_column = users.c.display_name
+        elif order == 'affiliation':
+            sort_column = mask(columns.state, cls.STATE_HUMAN)
+        elif order in ('death_date', 'feed_date'):
+            sort_column = mask(columns[order], null())
+        elif order == 'kills':
+            sort_column = mask(columns.kills, 0)
+        elif order == 'player_gid':
+            sort_column = columns.player_gid
+        else:
+            raise ValueError("Unknown roster order: %r" % (order))
+        sort_columns = [sort_column, columns.entry_id]
+        if reverse:
+            sort_columns = [desc(column) for column in sort_columns]
+        return query.order_by(sort_columns)
+    
     def __init__(self, game, player):
         assert game is not None
         assert player is not None
@@ -218,12 +329,30 @@ class PlayerEntry(object):
     
     def reset(self):
         """Reset volatile in-game statistics"""
+        self.game.invalidate_next_transition()
         self.state = self.STATE_HUMAN
         self.death_date = None
         self.feed_date = None
         self.kills = 0
         self.killed_by = None
         self.starve_date = None
+        self.refresh_deadlines()
+    
+    def refresh_deadlines(self):
+        """
+        Recalculates `starve_at` and `turn_at` from the player's state.
+        
+        The actions below call this for you; only call it yourself if you
+        change the state or dates by hand.
+        """
+        if self.is_undead:
+            self.starve_at = self.calculate_starve_time()
+        else:
+            self.starve_at = None
+        if self.is_infected:
+            self.turn_at = self.death_date
+        else:
+            self.turn_at = None
     
     def make_original_zombie(self, date=None):
         """
@@ -240,6 +369,7 @@ class PlayerEntry(object):
             date = now()
         else:
             date = make_aware(date)
+        self.game.invalidate_next_transition()
         if self.is_human:
             # This is the first time that the player became an OZ, give 'em the
             # full attribute setup
@@ -251,6 +381,8 @@ class PlayerEntry(object):
             raise WrongStateError(self, self.state, self.STATE_HUMAN,
                                   _("Player cannot become the original "
                                     "zombie because player is non-human."))
+        self.refresh_deadlines()
+        events.record(events.KIND_ORIGINAL_ZOMBIE, self, date)
     
     def kill(self, other, date=None, report_time=None):
         """
@@ -305,6 +437,7 @@ class PlayerEntry(object):
             raise WrongStateError(other, other.state, other.STATE_HUMAN,
                                   _("Victim must be human"))
         # Now we're ready to kill
+        self.game.invalidate_next_transition()
         self.kills += 1
         self.feed_date = date
         other.death_date = date + self.game.human_undead_timedelta
@@ -316,6 +449,52 @@ class PlayerEntry(object):
                 self.state = self.STATE_ORIGINAL_ZOMBIE
             else:
                 self.state = self.STATE_ZOMBIE
+        self.refresh_deadlines()
+        other.refresh_deadlines()
+        events.record(events.KIND_KILL, self, date)
+        events.record(events.KIND_INFECT, other, date)
+    
+    def report_kill(self, other, date=None, report_time=None, attempts=3):
+        """
+        Kill someone else, safely.
+        
+        This does the same thing as `kill`, but inside a savepoint.  If
+        another request changes the killer or victim first, only the kill is
+        rolled back (not the rest of the request's transaction), the entries
+        are reloaded, and the kill is tried again, so the usual checks (e.g.
+        that the victim is still human) run against the fresh data.
+        
+        :Parameters:
+            other : `PlayerEntry`
+                The victim
+            date : datetime.datetime
+                The date and time of the demise
+            report_time : datetime.datetime
+                The date and time that the kill was reported
+            attempts : int
+                How many times to try before giving up
+        :Raises errors.ConcurrentUpdateError: If every attempt lost a race
+        """
+        from sqlalchemy.exceptions import ConcurrentModificationError
+        # Write out earlier changes first, so a retry only throws away the kill
+        session.flush()
+        for attempt in xrange(attempts):
+            transaction = session.begin_nested()
+            try:
+                self.kill(other, date, report_time)
+                transaction.commit()
+            except ConcurrentModificationError:
+                transaction.rollback()
+                for obj in (self, other, self.game):
+                    session.expire(obj)
+            except:
+                transaction.rollback()
+                raise
+            else:
+                return
+        raise ConcurrentUpdateError(self, _("Somebody else updated these "
+                                            "players at the same time.  "
+                                            "Please try again."))
     
     def starve(self, date=None):
         """
@@ -340,11 +519,14 @@ class PlayerEntry(object):
         if not self.is_undead:
             raise WrongStateError(self, self.state, self.STATE_ZOMBIE,
                                   _("Non-zombies can't starve"))
+        self.game.invalidate_next_transition()
         self.starve_date = date
         if self.is_original_zombie:
             self.state = self.STATE_DEAD_OZ
         else:
             self.state = self.STATE_DEAD
+        self.refresh_deadlines()
+        events.record(events.KIND_STARVE, self, date)
     
     def calculate_time_since_last_feeding(self, time=None):
         """
@@ -461,6 +643,8 @@ class PlayerEntry(object):
         Use this method instead of ``session.delete``, as this will properly
         remove all references from the database.
         """
+        self.game.invalidate_next_transition()
+        mark_stale(self.game_id)
         self.game.entries.remove(self)
         self.player.entries.remove(self)
         session.delete(self)
@@ -478,6 +662,7 @@ class PlayerEntry(object):
         else:
             time = make_aware(time)
         self.reset()
+        events.record(events.KIND_FORCE, self, time)
     
     def force_to_infected(self, time=None):
         """
@@ -493,11 +678,14 @@ class PlayerEntry(object):
             time = make_aware(time)
         if self.is_infected:
             return
+        self.game.invalidate_next_transition()
         # Infection is inherently a human condition, so we can lose any kill
         # information.
         self.reset()
         self.death_date = time + self.game.human_undead_timedelta
         self.state = self.STATE_INFECTED
+        self.refresh_deadlines()
+        events.record(events.KIND_FORCE, self, time)
     
     def force_to_zombie(self, time=None):
         """
@@ -511,6 +699,7 @@ class PlayerEntry(object):
             time = now()
         else:
             time = make_aware(time)
+        self.game.invalidate_next_transition()
         if self.is_undead:
             pass
         elif self.is_human or self.is_infected:
@@ -527,6 +716,8 @@ class PlayerEntry(object):
                 self.state = self.STATE_ZOMBIE
         else:
             raise AssertionError("Unknown state when forced to zombie")
+        self.refresh_deadlines()
+        events.record(events.KIND_FORCE, self, time)
     
     def force_to_dead(self, time=None):
         """
@@ -541,6 +732,7 @@ class PlayerEntry(object):
         else:
             time = make_aware(time)
         if not self.is_dead:
+            self.game.invalidate_next_transition()
             if self.death_date is None or self.death_date > time:
                 self.death_date = time
             self.starve_date = time
@@ -548,6 +740,8 @@ class PlayerEntry(object):
                 self.state = self.STATE_DEAD_OZ
             else:
                 self.state = self.STATE_DEAD
+            self.refresh_deadlines()
+            events.record(events.KIND_FORCE, self, time)
     
     ## PROPERTIES ##
     
@@ -575,33 +769,90 @@ class PlayerEntry(object):
     def is_infected(self):
         return self.state == self.STATE_INFECTED
     
-    @property
-    def survival_time(self):
+    def _get_survival_span(self):
         if self.is_human or self.is_original_zombie:
             return None
         else:
-            return self.game.calculate_timedelta(self.game.started,
-                                                 self.death_date)
+            return (self.game.started, self.death_date)
     
-    @property
-    def undead_time(self):
+    def _get_undead_span(self):
         if self.is_human:
             return None
         elif self.is_undead or self.is_infected:
             if self.game.in_progress or (self.death_date > self.game.ended):
                 return None
             else:
-                return self.game.calculate_timedelta(self.death_date,
-                                                     self.game.ended)
+                return (self.death_date, self.game.ended)
         elif self.is_dead:
-            return self.game.calculate_timedelta(self.death_date,
-                                                 self.starve_date)
+            return (self.death_date, self.starve_date)
         else:
             raise AssertionError("I don't know how to calculate undead time")
     
+    @staticmethod
+    def _calculate_spans(entries, get_span):
+        # Group the spans by game so each game's calendar does its entries in
+        # one batch
+        spans, by_game = [], {}
+        for entry in entries:
+            span = get_span(entry)
+            spans.append(span)
+            if span is not None:
+                by_game.setdefault(entry.game, []).append(len(spans) - 1)
+        result = [None] * len(spans)
+        for game, indices in by_game.iteritems():
+            deltas = game.calculate_timedeltas([spans[i][0] for i in indices],
+                                               [spans[i][1] for i in indices])
+            for i, delta in zip(indices, deltas):
+                result[i] = delta
+        return result
+    
+    @classmethod
+    def calculate_survival_times(cls, entries):
+        """
+        Finds `survival_time` for several entries at once.
+        
+        :Parameters:
+            entries : list of `PlayerEntry`
+                The entries, from any number of games
+        :Returns: Each entry's survival time (or ``None``)
+        :ReturnType: list of datetime.timedelta
+        """
+        return cls._calculate_spans(entries, cls._get_survival_span)
+    
+    @classmethod
+    def calculate_undead_times(cls, entries):
+        """
+        Finds `undead_time` for several entries at once.
+        
+        :Parameters:
+            entries : list of `PlayerEntry`
+                The entries, from any number of games
+        :Returns: Each entry's undead time (or ``None``)
+        :ReturnType: list of datetime.timedelta
+        """
+        return cls._calculate_spans(entries, cls._get_undead_span)
+    
+    @property
+    def survival_time(self):
+        span = self._get_survival_span()
+        if span is None:
+            return None
+        else:
+            return self.game.calculate_timedelta(*span)
+    
+    @property
+    def undead_time(self):
+        span = self._get_undead_span()
+        if span is None:
+            return None
+        else:
+            return self.game.calculate_timedelta(*span)
+    
     death_date = date_prop('_death_date')
     feed_date = date_prop('_feed_date')
     starve_date = date_prop('_starve_date')
+    starve_at = date_prop('_starve_at')
+    turn_at = date_prop('_turn_at')
 
 class Game(object):
     """
@@ -635,6 +886,8 @@ class Game(object):
             The default length of a player GID (see `PlayerEntry.player_gid`)
         DEFAULT_SAFE_ZONES : list of unicode
             The default safe zones
+        FORCE_ACTIONS : tuple of str
+            The actions understood by `force_entries`
     :IVariables:
         game_id : int
             The database identifier for the game
@@ -674,6 +927,10 @@ class Game(object):
             Which dates to ignore for this game
         ignore_weekdays : frozenset of int
             Which weekdays (ISO weekday number) to ignore for this game
+        calendar : `GameCalendar`
+            [Read-only] The game's ignored dates and weekdays, compiled for
+            `calculate_timedelta` and `calculate_addtimedelta`.  It's built
+            once and kept until the ignored dates or weekdays change.
         zombie_starve_time : int
             The number of hours before a zombie starves.  If possible, rely on
             `zombie_starve_timedelta` (data abstraction and all).
@@ -696,10 +953,17 @@ class Game(object):
             Extra notes for the rules
         reveal_oz_date : datetime.datetime
             The date and time at which the original zombie was revealed
+        next_transition : datetime.datetime
+            The earliest time at which `update` could change anything, or
+            ``None`` if it needs to be worked out again.  Anything that
+            changes the entries or the game's timing should call
+            `invalidate_next_transition`.
         winner : str
             [Read-only] Who won the game.  ``None`` if the game is not
             finished, ``'human'`` if humans outlived the zombies, and
             ``'zombie'`` if the zombies won.
+        summary : `GameSummary`
+            [Read-only] The game's faction counts, original zombie and winner
     """
     STATE_CREATED = 0
     STATE_OPEN = 1
@@ -726,6 +990,7 @@ class Game(object):
                           _("SRC"),
                           _("Health center"),
                           _("Dining halls"),]
+    FORCE_ACTIONS = ('human', 'infected', 'zombie', 'dead', 'reset')
     
     ## INITIALIZATION/RETRIEVAL ##
     
@@ -744,6 +1009,7 @@ class Game(object):
         self.safe_zones = self.DEFAULT_SAFE_ZONES
         self.rules_notes = None
         self.reveal_oz_date = None
+        self.next_transition = None
     
     ## STRING REPRESENTATION ##
     
@@ -762,6 +1028,17 @@ class Game(object):
         """
         Update the game state.
         
+        Infections and starvations are applied with a handful of set-based
+        statements rather than by walking every entry, so this stays cheap
+        for large games.  Once that's done, the game remembers when the next
+        infection or starvation is due (see `next_transition`), and until then
+        this returns without going to the database at all.
+        
+        Only one update runs on a game at a time.  Threads in this process
+        that ask for an update while one is running wait for it to finish and
+        then reload the game, and other processes skip the update while this
+        process holds the game's lease (see `hvz.model.locking`).
+        
         :Parameters:
             update_time : datetime.datetime
                 The time at which the update commenced.  Defaults to now.
@@ -770,16 +1047,377 @@ class Game(object):
             update_time = now()
         else:
             update_time = make_aware(update_time)
+        # Nothing can happen before the next transition
+        next_transition = self.next_transition
+        if self.in_progress and next_transition is not None and \
+           update_time < next_transition:
+            return
         session.flush()
         # Hey, we're not playing.  Don't update!
         if not self.in_progress:
             return
-        # Update
-        self._update_check_zombie_win(update_time)
+        # Update, unless somebody else is already on it
+        updated, leader = locking.updates.do(self.game_id,
+                                             self._update_exclusive,
+                                             update_time)
+        if not (updated and leader):
+            self._reload()
+    
+    def _update_exclusive(self, update_time):
+        """
+        Runs the update while holding the game's update lease.
+        
+        :Parameters:
+            update_time : datetime.datetime
+                The time at which the update commenced
+        :Returns: Whether the update ran
+        :ReturnType: bool
+        """
+        holder = locking.acquire_update_lease(self.game_id)
+        if holder is None:
+            return False
+        try:
+            self._update(update_time)
+            session.flush()
+        finally:
+            # Nobody else should update the game until our changes are in
+            transactions.after_commit(locking.release_update_lease,
+                                      self.game_id, holder)
+        return True
+    
+    def _update(self, update_time):
+        """
+        Does the actual work for `update`.
+        
+        :Parameters:
+            update_time : datetime.datetime
+                The time at which the update commenced
+        """
+        counts = self._count_states()
+        self._update_check_zombie_win(update_time, counts)
         if self.in_progress:
             self._update_infected(update_time)
-            self._update_starved(update_time)
-            self._update_check_human_win(update_time)
+            starved = self._update_starved(update_time)
+            # Starving moves entries out of the undead and into the dead, so
+            # keep the counts honest without asking the database again.
+            counts[PlayerEntry.STATE_ZOMBIE] -= starved.get(
+                PlayerEntry.STATE_ZOMBIE, 0)
+            counts[PlayerEntry.STATE_ORIGINAL_ZOMBIE] -= starved.get(
+                PlayerEntry.STATE_ORIGINAL_ZOMBIE, 0)
+            self._update_check_human_win(update_time, counts)
+        if self.in_progress:
+            self.next_transition = self._find_next_transition()
+        # The bulk statements above bypass the mapper
+        mark_stale(self.game_id)
+    
+    def _reload(self):
+        """Reloads the game and its entries after someone else updated it."""
+        session.refresh(self)
+        self._expire_entries(lambda e: True)
+    
+    def refresh_deadlines(self):
+        """
+        Recalculates `PlayerEntry.starve_at` and `PlayerEntry.turn_at` for
+        every entry in the game.
+        
+        Call this after changing the game's starve time or ignored days, since
+        those move every zombie's projected starve time.
+        
+        :Returns: The number of entries refreshed
+        :ReturnType: int
+        """
+        from sqlalchemy import bindparam, select
+        session.flush()
+        columns = entries_table.c
+        query = select([columns.entry_id, columns.state,
+                        columns.death_date, columns.feed_date],
+                       columns.game_id == self.game_id)
+        starve_delta = self.zombie_starve_timedelta
+        undead = (PlayerEntry.STATE_ZOMBIE, PlayerEntry.STATE_ORIGINAL_ZOMBIE)
+        rows = session.execute(query).fetchall()
+        undead_rows = [row for row in rows if row['state'] in undead]
+        starve_ats = self.calculate_addtimedeltas(
+            [row['feed_date'] or row['death_date'] for row in undead_rows],
+            starve_delta)
+        starve_ats = dict((row['entry_id'], to_naive_utc(starve_at))
+                          for row, starve_at in zip(undead_rows, starve_ats))
+        changes = []
+        for entry_id, state, death_date, feed_date in rows:
+            starve_at, turn_at = starve_ats.get(entry_id), None
+            if state == PlayerEntry.STATE_INFECTED:
+                turn_at = death_date
+            changes.append(dict(target_id=entry_id,
+                                new_starve_at=starve_at,
+                                new_turn_at=turn_at,))
+        if changes:
+            stmt = entries_table.update(
+                columns.entry_id == bindparam('target_id'),
+                values={'starve_at': date_param('new_starve_at'),
+                        'turn_at': date_param('new_turn_at'),
+                        'version': columns.version + 1,})
+            session.execute(stmt, changes)
+            self._expire_entries(lambda e: True)
+        self.invalidate_next_transition()
+        return len(changes)
+    
+    def force_entries(self, action, entry_ids=None, time=None):
+        """
+        Forces several entries into a new state at once.
+        
+        This does the same thing as calling the corresponding
+        `PlayerEntry.force_to_human` (etc.) method on each entry, but with a
+        single statement inside one savepoint, and without loading the
+        entries.
+        
+        :Parameters:
+            action : str
+                One of `FORCE_ACTIONS`.  ``'reset'`` is the same as
+                ``'human'``, but is logged as a reset instead of a force.
+            entry_ids : list of int
+                The entries to change.  Defaults to every entry in the game.
+            time : datetime.datetime
+                The time at which they are being forced.  Defaults to now.
+        :Returns: The number of entries changed
+        :ReturnType: int
+        :Raises ValueError: If the action is unknown
+        """
+        from sqlalchemy import and_, bindparam, select
+        if action not in self.FORCE_ACTIONS:
+            raise ValueError("Unknown force action %r" % (action,))
+        if time is None:
+            time = now()
+        else:
+            time = make_aware(time)
+        if action == 'reset':
+            kind = events.KIND_RESET
+        else:
+            kind = events.KIND_FORCE
+        session.flush()
+        columns = entries_table.c
+        criterion = (columns.game_id == self.game_id)
+        if entry_ids is not None:
+            entry_ids = list(entry_ids)
+            if not entry_ids:
+                return 0
+            criterion = and_(criterion, columns.entry_id.in_(entry_ids))
+        query = select([columns.entry_id, columns.state,
+                        columns.death_date, columns.feed_date,
+                        columns.starve_date, columns.kills,
+                        columns.killer_id], criterion)
+        changes, event_rows = [], []
+        for row in session.execute(query).fetchall():
+            values = self._force_values(action, row, time)
+            if values is None:
+                continue
+            change = dict(('new_' + key, value)
+                          for key, value in values.iteritems())
+            change['target_id'] = row['entry_id']
+            changes.append(change)
+            event_rows.append(dict(game_id=self.game_id,
+                                   entry_id=row['entry_id'],
+                                   kind=kind,
+                                   occurred=to_naive_utc(time),
+                                   state=values['state'],
+                                   death_date=values['death_date'],
+                                   feed_date=values['feed_date'],
+                                   starve_date=values['starve_date'],
+                                   kills=values['kills'],
+                                   killer_id=values['killer_id'],))
+        if not changes:
+            return 0
+        stmt = entries_table.update(
+            columns.entry_id == bindparam('target_id'),
+            values={'state': bindparam('new_state'),
+                    'death_date': date_param('new_death_date'),
+                    'feed_date': date_param('new_feed_date'),
+                    'starve_date': date_param('new_starve_date'),
+                    'kills': bindparam('new_kills'),
+                    'killer_id': bindparam('new_killer_id'),
+                    'starve_at': date_param('new_starve_at'),
+                    'turn_at': date_param('new_turn_at'),
+                    'version': columns.version + 1,})
+        transaction = session.begin_nested()
+        try:
+            session.execute(stmt, changes)
+            events.record_many(event_rows)
+            mark_stale(self.game_id)
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        changed_ids = frozenset(change['target_id'] for change in changes)
+        self._expire_entries(lambda e: e.entry_id in changed_ids)
+        self.invalidate_next_transition()
+        return len(changes)
+    
+    def _force_values(self, action, row, time):
+        """
+        Works out an entry's new columns for `force_entries`.
+        
+        :Parameters:
+            action : str
+                One of `FORCE_ACTIONS`
+            row
+                The entry's row
+            time : datetime.datetime
+                The time at which the entry is being forced
+        :Returns: The new column values, or ``None`` if nothing changes
+        :ReturnType: dict
+        """
+        state = row['state']
+        undead = (PlayerEntry.STATE_ZOMBIE, PlayerEntry.STATE_ORIGINAL_ZOMBIE)
+        dead = (PlayerEntry.STATE_DEAD, PlayerEntry.STATE_DEAD_OZ)
+        original = (PlayerEntry.STATE_ORIGINAL_ZOMBIE,
+                    PlayerEntry.STATE_DEAD_OZ)
+        naive_time = to_naive_utc(time)
+        values = dict(state=state,
+                      death_date=row['death_date'],
+                      feed_date=row['feed_date'],
+                      starve_date=row['starve_date'],
+                      kills=row['kills'],
+                      killer_id=row['killer_id'],)
+        reset_values = dict(state=PlayerEntry.STATE_HUMAN,
+                            death_date=None,
+                            feed_date=None,
+                            starve_date=None,
+                            kills=0,
+                            killer_id=None,)
+        if action in ('human', 'reset'):
+            values.update(reset_values)
+        elif action == 'infected':
+            if state == PlayerEntry.STATE_INFECTED:
+                return None
+            values.update(reset_values)
+            values['death_date'] = to_naive_utc(time +
+                                                self.human_undead_timedelta)
+            values['state'] = PlayerEntry.STATE_INFECTED
+        elif action == 'zombie':
+            if state in undead:
+                return None
+            elif state in dead:
+                last_fed = make_aware(values['feed_date'] or
+                                      values['death_date'])
+                starve_time = self.calculate_addtimedelta(
+                    last_fed, self.zombie_starve_timedelta)
+                if starve_time <= time:
+                    # Renew the zombie's "life"
+                    values['feed_date'] = naive_time
+                values['starve_date'] = None
+                if state in original:
+                    values['state'] = PlayerEntry.STATE_ORIGINAL_ZOMBIE
+                else:
+                    values['state'] = PlayerEntry.STATE_ZOMBIE
+            else:
+                values['death_date'] = naive_time
+                values['state'] = PlayerEntry.STATE_ZOMBIE
+        elif action == 'dead':
+            if state in dead:
+                return None
+            if values['death_date'] is None or \
+               make_aware(values['death_date']) > time:
+                values['death_date'] = naive_time
+            values['starve_date'] = naive_time
+            if state in original:
+                values['state'] = PlayerEntry.STATE_DEAD_OZ
+            else:
+                values['state'] = PlayerEntry.STATE_DEAD
+        # Deadlines, as in PlayerEntry.refresh_deadlines
+        values['starve_at'], values['turn_at'] = None, None
+        if values['state'] in undead:
+            last_fed = make_aware(values['feed_date'] or values['death_date'])
+            values['starve_at'] = to_naive_utc(self.calculate_addtimedelta(
+                last_fed, self.zombie_starve_timedelta))
+        elif values['state'] == PlayerEntry.STATE_INFECTED:
+            values['turn_at'] = values['death_date']
+        return values
+    
+    def invalidate_next_transition(self):
+        """
+        Forgets when the next transition is due, so the next `update` does a
+        full pass.
+        
+        Call this whenever an entry's state or dates change, or when the
+        game's timing rules change.
+        """
+        if self._next_transition is not None:
+            self.next_transition = None
+    
+    def _find_next_transition(self):
+        """
+        Works out the earliest time at which `update` could change anything.
+        
+        Starve times are projected with `calculate_addtimedelta`, which never
+        lands later than the real deadline, so an update is never skipped when
+        it would have done something.
+        
+        :Returns: The time of the next transition, or ``None`` if there is
+                  nothing pending
+        :ReturnType: datetime.datetime
+        """
+        from sqlalchemy import and_, func, or_, select
+        columns = entries_table.c
+        last_fed = func.coalesce(columns.feed_date, columns.death_date,
+                                 type_=UTCDateTime)
+        undead = or_(columns.state == PlayerEntry.STATE_ZOMBIE,
+                     columns.state == PlayerEntry.STATE_ORIGINAL_ZOMBIE)
+        candidates = []
+        # Infected turning
+        query = select([func.min(func.coalesce(columns.turn_at,
+                                               columns.death_date),
+                                 type_=UTCDateTime)],
+            and_(columns.game_id == self.game_id,
+                 columns.state == PlayerEntry.STATE_INFECTED))
+        first_turn = session.execute(query).scalar()
+        if first_turn is not None:
+            candidates.append(make_aware(first_turn))
+        # Zombies starving
+        query = select([func.min(columns.starve_at, type_=UTCDateTime)],
+            and_(columns.game_id == self.game_id, undead))
+        first_starve = session.execute(query).scalar()
+        if first_starve is not None:
+            candidates.append(make_aware(first_starve))
+        # Entries that haven't been given a projection yet
+        starve_delta = self.zombie_starve_timedelta
+        query = select([last_fed],
+            and_(columns.game_id == self.game_id, undead,
+                 columns.starve_at == None),
+            distinct=True)
+        candidates.extend(self.calculate_addtimedeltas(
+            [fed for (fed,) in session.execute(query)], starve_delta))
+        if candidates:
+            return min(candidates)
+        # With no undead left, the humans win once the last corpse can no
+        # longer report a kill.
+        max_duration = (self.zombie_starve_timedelta +
+                        self.zombie_report_timedelta)
+        query = select([last_fed],
+            and_(columns.game_id == self.game_id,
+                 or_(columns.state == PlayerEntry.STATE_DEAD,
+                     columns.state == PlayerEntry.STATE_DEAD_OZ)),
+            distinct=True)
+        deadlines = self.calculate_addtimedeltas(
+            [fed for (fed,) in session.execute(query)], max_duration)
+        if deadlines:
+            return max(deadlines)
+        else:
+            return None
+    
+    def _count_states(self):
+        """
+        Counts the game's entries in each state with a single grouped query.
+        
+        :Returns: The number of entries in each state
+        :ReturnType: dict of {int: int}
+        """
+        from sqlalchemy import func, select
+        columns = entries_table.c
+        query = select([columns.state, func.count(columns.entry_id)],
+                       columns.game_id == self.game_id,
+                       group_by=[columns.state])
+        counts = dict.fromkeys(PlayerEntry.STATE_NAMES, 0)
+        for state, count in session.execute(query):
+            counts[state] = count
+        return counts
     
     def _update_starved(self, update_time):
         """
@@ -790,13 +1428,68 @@ class Game(object):
         :Parameters:
             update_time : datetime.datetime
                 The time at which the update commenced
+        :Returns: The number of zombies starved, keyed by their former state
+        :ReturnType: dict of {int: int}
         """
-        zombies = (entry for entry in self.entries if entry.is_undead)
-        for zombie in zombies:
-            delta = zombie.calculate_time_since_last_feeding(update_time)
-            if delta >= self.zombie_starve_timedelta:
-                zombie.starve(zombie.calculate_starve_time())
-        session.flush()
+        from sqlalchemy import and_, bindparam, or_, select
+        columns = entries_table.c
+        starve_delta = self.zombie_starve_timedelta
+        # The projected starve time never lands after the real one, so anyone
+        # projected to starve later than now can't possibly have starved yet.
+        # Entries that haven't been given a projection are checked anyway.
+        criterion = and_(columns.game_id == self.game_id,
+                         or_(columns.state == PlayerEntry.STATE_ZOMBIE,
+                             columns.state ==
+                                PlayerEntry.STATE_ORIGINAL_ZOMBIE),
+                         or_(columns.starve_at <= to_naive_utc(update_time),
+                             columns.starve_at == None))
+        query = select([columns.entry_id, columns.state,
+                        columns.death_date, columns.feed_date,
+                        columns.kills, columns.killer_id], criterion)
+        # Run the exact check on the (few) candidates that are left
+        rows = session.execute(query).fetchall()
+        last_feds = [make_aware(row['feed_date'] or row['death_date'])
+                     for row in rows]
+        rows = [(row, last_fed) for row, last_fed, starved in
+                zip(rows, last_feds,
+                    self.calculate_starved(last_feds, update_time))
+                if starved]
+        starve_dates = self.calculate_addtimedeltas(
+            [last_fed for row, last_fed in rows], starve_delta)
+        starved, changes, event_rows = {}, [], []
+        for (row, last_fed), starve_date in zip(rows, starve_dates):
+            entry_id, state, death_date, feed_date, kills, killer_id = row
+            if state == PlayerEntry.STATE_ORIGINAL_ZOMBIE:
+                new_state = PlayerEntry.STATE_DEAD_OZ
+            else:
+                new_state = PlayerEntry.STATE_DEAD
+            starve_date = to_naive_utc(starve_date)
+            changes.append(dict(target_id=entry_id,
+                                new_state=new_state,
+                                new_starve_date=starve_date,))
+            event_rows.append(dict(game_id=self.game_id,
+                                   entry_id=entry_id,
+                                   kind=events.KIND_STARVE,
+                                   occurred=starve_date,
+                                   state=new_state,
+                                   death_date=death_date,
+                                   feed_date=feed_date,
+                                   starve_date=starve_date,
+                                   kills=kills,
+                                   killer_id=killer_id,))
+            starved[state] = starved.get(state, 0) + 1
+        if changes:
+            stmt = entries_table.update(
+                columns.entry_id == bindparam('target_id'),
+                values={'state': bindparam('new_state'),
+                        'starve_date': date_param('new_starve_date'),
+                        'starve_at': None,
+                        'version': columns.version + 1,})
+            session.execute(stmt, changes)
+            events.record_many(event_rows)
+            starved_ids = frozenset(change['target_id'] for change in changes)
+            self._expire_entries(lambda e: e.entry_id in starved_ids)
+        return starved
     
     def _update_infected(self, update_time):
         """
@@ -806,16 +1499,48 @@ class Game(object):
             update_time : datetime.datetime
                 The time at which the update commenced
         """
-        from sqlalchemy import and_
-        infected = PlayerEntry.query.filter(
-            and_(PlayerEntry.game == self,
-                 PlayerEntry.state == PlayerEntry.STATE_INFECTED))
-        for player in infected:
-            if update_time >= player.death_date:
-                player.state = PlayerEntry.STATE_ZOMBIE
-        session.flush()
-    
-    def _update_check_zombie_win(self, update_time):
+        from sqlalchemy import and_, bindparam, func, select
+        columns = entries_table.c
+        turn_at = func.coalesce(columns.turn_at, columns.death_date,
+                                type_=UTCDateTime)
+        query = select([columns.entry_id, columns.death_date,
+                        columns.feed_date, columns.starve_date,
+                        columns.kills, columns.killer_id],
+            and_(columns.game_id == self.game_id,
+                 columns.state == PlayerEntry.STATE_INFECTED,
+                 turn_at <= to_naive_utc(update_time)))
+        starve_delta = self.zombie_starve_timedelta
+        rows = session.execute(query).fetchall()
+        starve_ats = self.calculate_addtimedeltas(
+            [row['death_date'] for row in rows], starve_delta)
+        changes, event_rows = [], []
+        for (entry_id, death_date, feed_date, starve_date,
+             kills, killer_id), starve_at in zip(rows, starve_ats):
+            changes.append(dict(target_id=entry_id,
+                                new_starve_at=to_naive_utc(starve_at),))
+            event_rows.append(dict(game_id=self.game_id,
+                                   entry_id=entry_id,
+                                   kind=events.KIND_TURN,
+                                   occurred=death_date,
+                                   state=PlayerEntry.STATE_ZOMBIE,
+                                   death_date=death_date,
+                                   feed_date=feed_date,
+                                   starve_date=starve_date,
+                                   kills=kills,
+                                   killer_id=killer_id,))
+        if changes:
+            stmt = entries_table.update(
+                columns.entry_id == bindparam('target_id'),
+                values={'state': PlayerEntry.STATE_ZOMBIE,
+                        'starve_at': date_param('new_starve_at'),
+                        'turn_at': None,
+                        'version': columns.version + 1,})
+            session.execute(stmt, changes)
+            events.record_many(event_rows)
+            turned_ids = frozenset(change['target_id'] for change in changes)
+            self._expire_entries(lambda e: e.entry_id in turned_ids)
+    
+    def _update_check_zombie_win(self, update_time, counts):
         """
         Checks if the humans have expired, and if necessary, forcibly end the
         game.
@@ -823,19 +1548,22 @@ class Game(object):
         :Parameters:
             update_time : datetime.datetime
                 The time at which the update commenced
+            counts : dict of {int: int}
+                The number of entries in each state
         """
-        from sqlalchemy import or_
-        players = PlayerEntry.query.filter_by(game=self)
-        humans = players.filter_by(state=PlayerEntry.STATE_HUMAN)
-        if humans.count() == 0:
-            zombies = players.filter(
-                or_(PlayerEntry.state == PlayerEntry.STATE_ZOMBIE,
-                    PlayerEntry.state == PlayerEntry.STATE_ORIGINAL_ZOMBIE,
-                    PlayerEntry.state == PlayerEntry.STATE_INFECTED))
-            ultimate_end = max(zombie.death_date for zombie in zombies)
-            self.end(ultimate_end)
-    
-    def _update_check_human_win(self, update_time):
+        from sqlalchemy import and_, func, or_, select
+        if counts[PlayerEntry.STATE_HUMAN] == 0:
+            columns = entries_table.c
+            query = select([func.max(columns.death_date, type_=UTCDateTime)],
+                and_(columns.game_id == self.game_id,
+                     or_(columns.state == PlayerEntry.STATE_ZOMBIE,
+                         columns.state == PlayerEntry.STATE_ORIGINAL_ZOMBIE,
+                         columns.state == PlayerEntry.STATE_INFECTED)))
+            ultimate_end = session.execute(query).scalar()
+            if ultimate_end is not None:
+                self.end(make_aware(ultimate_end))
+    
+    def _update_check_human_win(self, update_time, counts):
         """
         Checks if the zombies have died, and if necessary, forcibly end the
         game.
@@ -843,31 +1571,60 @@ class Game(object):
         :Parameters:
             update_time : datetime.datetime
                 The time at which the update commenced
+            counts : dict of {int: int}
+                The number of entries in each state
         """
-        from sqlalchemy import or_
-        # Fetch the different groups
-        players = PlayerEntry.query.filter(PlayerEntry.game == self)
-        zombies = players.filter(
-            or_(PlayerEntry.state == PlayerEntry.STATE_ZOMBIE,
-                PlayerEntry.state == PlayerEntry.STATE_ORIGINAL_ZOMBIE,
-                PlayerEntry.state == PlayerEntry.STATE_INFECTED,))
-        dead = players.filter(
-            or_(PlayerEntry.state == PlayerEntry.STATE_DEAD,
-                PlayerEntry.state == PlayerEntry.STATE_DEAD_OZ))
+        from sqlalchemy import and_, or_, select
         # Now determine whether we should end the game
         # The two closing scenarios:
         #   1. Humans have all died.
         #   2. Zombies have all starved and there are humans left.
-        if zombies.count() == 0:
-            # Zombies appear to have died off...
-            # But there may still be dead ones who can report a kill.
-            for corpse in dead:
-                if corpse.can_report_kill(update_time):
-                    # Someone could still report a kill!
-                    break
+        zombie_count = (counts[PlayerEntry.STATE_ZOMBIE] +
+                        counts[PlayerEntry.STATE_ORIGINAL_ZOMBIE] +
+                        counts[PlayerEntry.STATE_INFECTED])
+        if zombie_count != 0:
+            return
+        # Zombies appear to have died off...
+        # But there may still be dead ones who can report a kill.
+        columns = entries_table.c
+        query = select([columns.death_date, columns.feed_date,
+                        columns.starve_date],
+            and_(columns.game_id == self.game_id,
+                 or_(columns.state == PlayerEntry.STATE_DEAD,
+                     columns.state == PlayerEntry.STATE_DEAD_OZ)))
+        corpses = session.execute(query).fetchall()
+        if not corpses:
+            return
+        max_duration = (self.zombie_starve_timedelta +
+                        self.zombie_report_timedelta)
+        for death_date, feed_date, starve_date in corpses:
+            if feed_date is None:
+                last_fed = make_aware(death_date)
             else:
-                ultimate_end = max(corpse.starve_date for corpse in dead)
-                self.end(ultimate_end)
+                last_fed = make_aware(feed_date)
+            if update_time <= last_fed or \
+               self.calculate_timedelta(last_fed,
+                                        update_time) <= max_duration:
+                # Someone could still report a kill!
+                return
+        ultimate_end = max(make_aware(row[2]) for row in corpses)
+        self.end(ultimate_end)
+    
+    def _expire_entries(self, predicate):
+        """
+        Expires loaded entries that a bulk statement has changed underneath
+        the session.
+        
+        :Parameters:
+            predicate : function
+                Called with each of the game's loaded entries; entries for
+                which it returns true are expired.
+        """
+        stale = [obj for obj in session.identity_map.values()
+                 if isinstance(obj, PlayerEntry) and
+                    obj.game_id == self.game_id and predicate(obj)]
+        for obj in stale:
+            session.expire(obj)
     
     def calculate_timedelta(self, datetime1, datetime2):
         """
@@ -884,9 +1641,7 @@ class Game(object):
         :Returns: The difference between the two dates
         :ReturnType: datetime.timedelta
         """
-        return calc_timedelta(datetime1, datetime2,
-                              ignore_dates=self.ignore_dates,
-                              ignore_weekdays=self.ignore_weekdays,)
+        return self.calendar.calc_timedelta(datetime1, datetime2)
     
     def calculate_addtimedelta(self, dt, delta):
         """
@@ -903,9 +1658,73 @@ class Game(object):
         :Returns: The date with the delta added
         :ReturnType: datetime.datetime
         """
-        return calc_addtimedelta(dt, delta,
-                                 ignore_dates=self.ignore_dates,
-                                 ignore_weekdays=self.ignore_weekdays,)
+        return self.calendar.calc_addtimedelta(dt, delta)
+    
+    def calculate_timedeltas(self, starts, ends):
+        """
+        Calculates the deltas between several pairs of datetimes.
+        
+        This is `calculate_timedelta` for many pairs at once, except that a
+        pair that ends before it starts gives zero.  The work is done with
+        NumPy if it's installed.
+        
+        :Parameters:
+            starts : list of datetime.datetime
+                The first dates and times
+            ends : list of datetime.datetime
+                The second dates and times
+        :Returns: The differences between the dates
+        :ReturnType: list of datetime.timedelta
+        """
+        if numpy_available:
+            return self.calendar.batch_timedelta(starts, ends).tolist()
+        result = []
+        for start, end in zip(starts, ends):
+            start, end = make_aware(start), make_aware(end)
+            if end <= start:
+                result.append(timedelta())
+            else:
+                result.append(self.calculate_timedelta(start, end))
+        return result
+    
+    def calculate_addtimedeltas(self, datetimes, delta):
+        """
+        Calculates the dates after adding a delta to several datetimes.
+        
+        This is `calculate_addtimedelta` for many dates at once.  The work is
+        done with NumPy if it's installed.
+        
+        :Parameters:
+            datetimes : list of datetime.datetime
+                The dates and times
+            delta : datetime.timedelta
+                The delta
+        :Returns: The dates with the delta added
+        :ReturnType: list of datetime.datetime
+        """
+        if numpy_available:
+            result = self.calendar.batch_addtimedelta(datetimes, delta)
+            return [as_utc(dt) for dt in result.tolist()]
+        return [self.calculate_addtimedelta(make_aware(dt), delta)
+                for dt in datetimes]
+    
+    def calculate_starved(self, last_fed, time=None):
+        """
+        Works out whether zombies have starved.
+        
+        :Parameters:
+            last_fed : list of datetime.datetime
+                When each zombie last fed (or died, if it hasn't fed yet)
+            time : datetime.datetime
+                The time to check at.  Defaults to now.
+        :Returns: Whether each zombie has starved
+        :ReturnType: list of bool
+        """
+        if time is None:
+            time = now()
+        starve_delta = self.zombie_starve_timedelta
+        elapsed = self.calculate_timedeltas(last_fed, [time] * len(last_fed))
+        return [delta >= starve_delta for delta in elapsed]
     
     def previous_state(self, time=None):
         """
@@ -925,6 +1744,7 @@ class Game(object):
             raise WrongStateError(self, self.state, self.STATE_CREATED + 1,
                                   _("Game is already at the first state"))
         # Go previous state
+        self.invalidate_next_transition()
         self.state -= 1
         # Do state hooks
         prev_state = self.state + 1
@@ -933,10 +1753,10 @@ class Game(object):
         elif prev_state == self.STATE_ENDED:
             self.ended = None
         elif prev_state == self.STATE_CHOOSE_ZOMBIE:
-            for entry in self.entries:
-                entry.reset()
+            self.force_entries('reset', time=time)
         elif prev_state == self.STATE_REVEAL_ZOMBIE:
             self.reveal_oz_date = None
+        events.record_stage(self, time)
     
     def next_state(self, time=None):
         """
@@ -957,6 +1777,7 @@ class Game(object):
             raise WrongStateError(self, self.state, self.STATE_ENDED - 1,
                                   _("The game is already over"))
         # Go next state
+        self.invalidate_next_transition()
         self.state += 1
         # Do state hooks
         if self.state == self.STATE_STARTED:
@@ -974,6 +1795,7 @@ class Game(object):
                     corpse.force_to_zombie(self.ended)
         elif self.state == self.STATE_REVEAL_ZOMBIE:
             self.reveal_oz_date = now()
+        events.record_stage(self, time)
     
     def end(self, end_time=None):
         """
@@ -1008,10 +1830,37 @@ class Game(object):
         
         Use this method instead of ``session.delete``, as this will properly
         remove all entries from the database.
+        
+        Everything is deleted with one statement per table, inside a single
+        savepoint, instead of loading and deleting each entry.  The game and
+        its entries are removed from the session afterward.
         """
-        for entry in list(self.entries):
-            entry.delete()
-        session.delete(self)
+        from hvz.model.events import events_table
+        from hvz.model.locking import update_leases_table
+        from hvz.model.summary import game_summaries_table
+        session.flush()
+        game_id = self.game_id
+        # Find the loaded entries while they can still be refreshed
+        entries = [obj for obj in session.identity_map.values()
+                   if isinstance(obj, PlayerEntry) and obj.game_id == game_id]
+        transaction = session.begin_nested()
+        try:
+            for table in (events_table, game_summaries_table,
+                          update_leases_table, entries_table):
+                session.execute(table.delete(table.c.game_id == game_id))
+            session.execute(games_table.delete(
+                games_table.c.game_id == game_id))
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        # Forget the deleted objects, and the players' stale entry lists
+        for entry in entries:
+            session.expunge(entry)
+        for obj in session.identity_map.values():
+            if isinstance(obj, identity.User):
+                session.expire(obj)
+        session.expunge(self)
     
     ## PROPERTIES ##
     
@@ -1057,39 +1906,47 @@ class Game(object):
     
     @property
     def winner(self):
-        from sqlalchemy import or_
-        players = PlayerEntry.query.filter(PlayerEntry.game == self)
-        humans = players.filter(PlayerEntry.state == PlayerEntry.STATE_HUMAN)
-        zombies = players.filter(
-            or_(PlayerEntry.state == PlayerEntry.STATE_ZOMBIE,
-                PlayerEntry.state == PlayerEntry.STATE_ORIGINAL_ZOMBIE))
         if self.state != self.STATE_ENDED:
             return None
-        elif humans.count() == 0:
-            return 'zombie'
-        elif zombies.count() == 0:
-            return 'human'
-        else:
+        winner = self.summary.winner
+        if winner is None:
             raise ModelError(self, "Game should not have ended")
+        return winner
+    
+    @property
+    def summary(self):
+        return GameSummary.for_game(self)
     
     def _get_oz(self):
-        results = [entry for entry in self.entries if entry.is_original_zombie]
-        if len(results) == 0:
+        oz_entry_id = self.summary.oz_entry_id
+        if oz_entry_id is None:
             return None
-        elif len(results) == 1:
-            return results[0]
         else:
-            raise AssertionError("We have multiple OZs")
+            return PlayerEntry.query.get(oz_entry_id)
     
     def _set_oz(self, new_oz):
         prev_oz = self._get_oz()
         if prev_oz is not None:
             prev_oz.reset()
+            events.record(events.KIND_RESET, prev_oz)
         new_oz.make_original_zombie()
     
-    def _get_ignore_dates(self):
+    def _get_calendar(self):
+        # The columns are the cache key, so a reload from the database can't
+        # leave us with an old calendar.
+        key = (self._ignore_dates, self._ignore_weekdays)
+        calendar = getattr(self, '_calendar', None)
+        if calendar is None or self._calendar_key != key:
+            calendar = GameCalendar(
+                ignore_dates=self._parse_ignore_dates(self._ignore_dates),
+                ignore_weekdays=self._parse_ignore_weekdays(
+                    self._ignore_weekdays),)
+            self._calendar, self._calendar_key = calendar, key
+        return calendar
+    
+    @staticmethod
+    def _parse_ignore_dates(value):
         from datetime import date
-        value = self._ignore_dates
         if value:
             components = value.split(';')
             result = []
@@ -1102,6 +1959,18 @@ class Game(object):
         else:
             return frozenset()
     
+    @staticmethod
+    def _parse_ignore_weekdays(value):
+        if value:
+            components = value.split(';')
+            result = [int(component, 10) for component in components]
+            return frozenset(result)
+        else:
+            return frozenset()
+    
+    def _get_ignore_dates(self):
+        return self.calendar.ignore_dates
+    
     def _set_ignore_dates(self, value):
         if value is None:
             self._ignore_dates = None
@@ -1109,15 +1978,11 @@ class Game(object):
             date2str = (lambda d: u'%.4i-%.2i-%.2i' % (d.year, d.month, d.day))
             components = frozenset(date2str(date) for date in value)
             self._ignore_dates = ';'.join(components)
+        self._calendar = None
+        self.invalidate_next_transition()
     
     def _get_ignore_weekdays(self):
-        value = self._ignore_weekdays
-        if value:
-            components = value.split(';')
-            result = [int(component, 10) for component in components]
-            return frozenset(result)
-        else:
-            return frozenset()
+        return self.calendar.ignore_weekdays
     
     def _set_ignore_weekdays(self, value):
         if value is None:
@@ -1127,6 +1992,8 @@ class Game(object):
             if not frozenset(xrange(1, 8)).issuperset(value):
                 raise ValueError("ignore_weekdays only accepts [1,7] ints")
             self._ignore_weekdays = ';'.join(str(i) for i in value)
+        self._calendar = None
+        self.invalidate_next_transition()
     
     def _get_safe_zones(self):
         value = self._safe_zones
@@ -1147,10 +2014,12 @@ class Game(object):
     started = date_prop('_started')
     ended = date_prop('_ended')
     original_zombie = property(_get_oz, _set_oz)
+    calendar = property(_get_calendar)
     ignore_dates = property(_get_ignore_dates, _set_ignore_dates)
     ignore_weekdays = property(_get_ignore_weekdays, _set_ignore_weekdays)
     safe_zones = property(_get_safe_zones, _set_safe_zones)
     reveal_oz_date = date_prop('_reveal_oz_date')
+    next_transition = date_prop('_next_transition')
 
 ### MAPPERS ###
 
@@ -1172,7 +2041,9 @@ mapper(PlayerEntry, entries_table, properties={
     'death_date': synonym('_death_date', map_column=True),
     'feed_date': synonym('_feed_date', map_column=True),
     'starve_date': synonym('_starve_date', map_column=True),
-})
+    'starve_at': synonym('_starve_at', map_column=True),
+    'turn_at': synonym('_turn_at', map_column=True),
+}, version_id_col=entries_table.c.version, extension=SummaryExtension())
 
 mapper(Game, games_table, properties={
     'created': synonym('_created', map_column=True),
@@ -1184,4 +2055,5 @@ mapper(Game, games_table, properties={
     'ignore_weekdays': synonym('_ignore_weekdays', map_column=True),
     'safe_zones': synonym('_safe_zones', map_column=True),
     'reveal_oz_date': synonym('_reveal_oz_date', map_column=True),
-})
+    'next_transition': synonym('_next_transition', map_column=True),
+}, extension=SummaryExtension(create=True))
@@ -29,12 +29,13 @@ pkg_resources.require("SQLAlchemy>=0.4.2")
 
 from sqlalchemy import (Table, Column, ForeignKey, UniqueConstraint,
                         String, Unicode, Integer, Boolean, DateTime)
-from sqlalchemy.orm import relation, synonym
+from sqlalchemy.orm import relation, synonym, MapperExtension, EXT_CONTINUE
 from turbogears import identity
 from turbogears.database import mapper, metadata, session
 
 import hvz
-from hvz.model.dates import now, date_prop
+from hvz.model.dates import now, date_prop, UTCDateTime
+from hvz.model.summary import mark_player_changed
 
 __author__ = 'Ross Light'
 __date__ = 'April 18, 2008'
@@ -43,6 +44,7 @@ __all__ = ['Visit',
            'VisitIdentity',
            'Group',
            'User',
+           'UserExtension',
            'Permission',]
 
 ### TABLES ###
@@ -62,20 +64,22 @@ groups_table = Table('tg_group', metadata,
     Column('group_id', Integer, primary_key=True),
     Column('group_name', Unicode(16), unique=True),
     Column('display_name', Unicode(255)),
-    Column('created', DateTime),
+    Column('created', UTCDateTime),
 )
 
 users_table = Table('tg_user', metadata,
     Column('user_id', Integer, primary_key=True),
     Column('user_name', Unicode(16), unique=True),
-    Column('display_name', Unicode(255)),
+    Column('display_name', Unicode(255), index=True),
     Column('email_address', Unicode(255)),
     Column('tg_password', Unicode(40)),
-    Column('created', DateTime),
+    Column('created', UTCDateTime),
     Column('profile', Unicode(4096)),
     Column('image_uuid', String(32)),
     Column('cell_number', String(10)),
     Column('cell_provider', String(16)),
+    Column('version', Integer, nullable=False, default=1),
+    Column('modified', UTCDateTime),
 )
 
 permissions_table = Table('permission', metadata,
@@ -159,6 +163,8 @@ class Group(object):
         :Returns: The requested group, or ``None`` if not found
         :ReturnType: `Group`
         """
+        # The session doesn't autoflush, so make new groups visible first
+        session.flush()
         return cls.query.filter_by(group_name=name).first()
     
     def __init__(self, name, display_name=None):
@@ -287,6 +293,10 @@ class User(object):
             encrypt the password.
         created : datetime.datetime
             The time at which the user joined/was created
+        version : int
+            Bumped every time the user is written
+        modified : datetime.datetime
+            The time at which the user was last written
         profile : unicode
             A user-provided text profile
         entries : list of `game.PlayerEntry`
@@ -322,6 +332,8 @@ class User(object):
         :Returns: The requested user, or ``None`` if not found
         :ReturnType: `User`
         """
+        # The session doesn't autoflush, so make new users visible first
+        session.flush()
         return cls.query.filter_by(user_name=name).first()
     
     def __init__(self, name, display_name=None, email=None, password=''):
@@ -398,6 +410,7 @@ class User(object):
     @property
     def is_legendary(self):
         from hvz.model.game import Game, PlayerEntry
+        session.flush()
         game = Game.query.order_by('created').first()
         if game is None:
             return False
@@ -405,6 +418,7 @@ class User(object):
             return bool(PlayerEntry.by_player(game, self) is not None)
     
     created = date_prop('_created')
+    modified = date_prop('_modified')
     password = property(_get_password, _set_password)
     image_uuid = property(_get_image_uuid, _set_image_uuid)
     image = property(_get_image, _set_image)
@@ -450,6 +464,26 @@ class Permission(object):
     def __unicode__(self):
         return self.description
 
+class UserExtension(MapperExtension):
+    """
+    Records when a user is written, and bumps its version.
+    
+    The version is only a counter for caches; it isn't checked on update, so
+    concurrent writes to a user don't fail.  Writing a user also changes the
+    summary version of the user's games, since their pages show the user's
+    name.
+    """
+    def before_insert(self, mapper, connection, instance):
+        instance.version = 1
+        instance.modified = now()
+        return EXT_CONTINUE
+    
+    def before_update(self, mapper, connection, instance):
+        instance.version = (instance.version or 0) + 1
+        instance.modified = now()
+        mark_player_changed(instance.user_id, connection)
+        return EXT_CONTINUE
+
 ## MAPPERS ##
 
 mapper(Visit, visits_table)
@@ -458,7 +492,9 @@ mapper(VisitIdentity, visit_identity_table,
 mapper(User, users_table,
         properties=dict(password=synonym('tg_password'),
                         created=synonym('_created', map_column=True),
-                        image_uuid=synonym('_image_uuid', map_column=True),))
+                        modified=synonym('_modified', map_column=True),
+                        image_uuid=synonym('_image_uuid', map_column=True),),
+        extension=UserExtension())
 mapper(Group, groups_table,
         properties=dict(users=relation(User, backref='groups',
                                        secondary=user_group_table),
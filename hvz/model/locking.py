@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+#
+#   model/locking.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Update coordination
+
+Only one thread of one process should be updating a game at a time.  Threads
+in the same process share a `SingleFlight`; processes take a lease on the
+game's row in the ``update_leases`` table.  Leases are taken on a connection
+of their own, so they never commit the request's work.  SQLite only supports
+one process, so there's no lease there.
+
+Neither lets anyone else in until the updating request's transaction is over
+(see `hvz.model.transactions.after_commit`), so nobody reads or redoes an
+uncommitted update.
+
+:Variables:
+    updates : `SingleFlight`
+        The process-wide coordinator for game updates
+"""
+
+from datetime import timedelta
+import os
+import socket
+import threading
+
+import turbogears
+from sqlalchemy import Table, Column, ForeignKey, String, Integer
+from turbogears.database import metadata
+
+from hvz.model.dates import now, to_naive_utc, UTCDateTime
+from hvz.model.transactions import after_commit
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['SingleFlight',
+           'updates',
+           'acquire_update_lease',
+           'release_update_lease',]
+
+## TABLES ##
+update_leases_table = Table('update_leases', metadata,
+    Column('game_id', Integer, ForeignKey('game.game_id',
+           ondelete='CASCADE', onupdate='CASCADE'), primary_key=True),
+    Column('holder', String(128)),
+    Column('expires', UTCDateTime),
+)
+
+## IN-PROCESS ##
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls with the same key into a single call.
+    
+    The first thread to ask for a key runs the function; any thread that asks
+    for the same key while it's running waits for it and gets the same result
+    (or exception).  Inside a request, the waiting threads are only let go
+    once the first thread's transaction is over, so they can see its changes.
+    
+    :IVariables:
+        timeout : float
+            The most seconds to wait for another thread, or ``None`` to wait
+            for as long as it takes
+    """
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def do(self, key, func, *args, **kw):
+        """
+        Calls a function, unless a call for the same key is already running.
+        
+        :Parameters:
+            key
+                A hashable key identifying the work
+            func
+                The function to call
+        :Returns: The function's result and whether this thread ran it.  If
+                  the wait times out, the result is ``None``.
+        :ReturnType: tuple
+        """
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key)
+            leader = (call is None)
+            if leader:
+                call = self._calls[key] = _Call()
+        finally:
+            self._lock.release()
+        if not leader:
+            call.done.wait(self.timeout)
+            if not call.done.isSet():
+                return None, False
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+        try:
+            try:
+                call.result = func(*args, **kw)
+            except Exception, e:
+                call.error = e
+                raise
+        finally:
+            after_commit(self._finish, key, call)
+        return call.result, True
+    
+    def _finish(self, key, call):
+        self._lock.acquire()
+        try:
+            del self._calls[key]
+        finally:
+            self._lock.release()
+        call.done.set()
+
+# Don't let a stuck request hold up every other update of the game
+updates = SingleFlight(timeout=30)
+
+## CROSS-PROCESS ##
+
+def _lease_now():
+    # Whole seconds only: SQLite stores microseconds without zero padding,
+    # which breaks the string comparison in `acquire_update_lease`.
+    return to_naive_utc(now()).replace(microsecond=0)
+
+def _make_holder():
+    return "%s:%i:%i" % (socket.gethostname(), os.getpid(),
+                         id(threading.currentThread()))
+
+def _uses_leases():
+    # SQLite pools hand the thread its own connection back, so a lease would
+    # commit the request along with it.  One process is all SQLite supports,
+    # and the SingleFlight already covers that.
+    return metadata.bind.name != 'sqlite'
+
+def _execute_alone(func):
+    """Calls *func* with a connection of its own, in its own transaction."""
+    connection = metadata.bind.connect()
+    try:
+        transaction = connection.begin()
+        try:
+            result = func(connection)
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        return result
+    finally:
+        connection.close()
+
+def acquire_update_lease(game_id):
+    """
+    Tries to take the update lease for a game.
+    
+    The lease lasts ``hvz.update_lease_time`` seconds, so a process that dies
+    mid-update doesn't keep the game locked forever.  On SQLite, the lease
+    is always granted without touching the database.
+    
+    :Parameters:
+        game_id : int
+            The game to lock
+    :Returns: The lease holder's name, or ``None`` if someone else holds it
+    :ReturnType: str
+    """
+    from sqlalchemy import and_
+    from sqlalchemy.exceptions import IntegrityError
+    columns = update_leases_table.c
+    holder = _make_holder()
+    if not _uses_leases():
+        return holder
+    lease_time = turbogears.config.get('hvz.update_lease_time', 60)
+    current_time = _lease_now()
+    expires = current_time + timedelta(seconds=lease_time)
+    def take(connection):
+        # Take over an expired lease...
+        stmt = update_leases_table.update(
+            and_(columns.game_id == game_id, columns.expires <= current_time),
+            values={'holder': holder, 'expires': expires})
+        if not connection.execute(stmt).rowcount:
+            # ...or create one
+            connection.execute(update_leases_table.insert(),
+                               game_id=game_id, holder=holder,
+                               expires=expires)
+    try:
+        _execute_alone(take)
+    except IntegrityError:
+        return None
+    else:
+        return holder
+
+def release_update_lease(game_id, holder):
+    """
+    Gives up the update lease for a game.
+    
+    Other processes won't take the lease for another ``hvz.update_interval``
+    seconds, so a game is updated at most once per interval.
+    
+    :Parameters:
+        game_id : int
+            The game to unlock
+        holder : str
+            The name returned by `acquire_update_lease`
+    """
+    from sqlalchemy import and_
+    if not _uses_leases():
+        return
+    columns = update_leases_table.c
+    interval = turbogears.config.get('hvz.update_interval', 0)
+    expires = _lease_now() + timedelta(seconds=interval)
+    stmt = update_leases_table.update(
+        and_(columns.game_id == game_id, columns.holder == holder),
+        values={'expires': expires})
+    _execute_alone(lambda connection: connection.execute(stmt))
@@ -25,12 +25,12 @@ import pkg_resources
 pkg_resources.require("SQLAlchemy>=0.4.2")
 
 from sqlalchemy import (Table, Column, ForeignKey, UniqueConstraint,
-                        String, Unicode, Integer, Boolean, DateTime)
+                        String, Unicode, Integer, Boolean)
 from sqlalchemy.orm import backref, relation, synonym
 from turbogears.database import mapper, metadata, session
 
 from hvz.model import identity
-from hvz.model.dates import (now, date_prop, make_aware,
+from hvz.model.dates import (now, date_prop, make_aware, UTCDateTime,
                              calc_timedelta, calc_addtimedelta)
 from hvz.model.errors import WrongStateError, InvalidTimeError
 
@@ -45,7 +45,7 @@ alliances_table = Table('alliances', metadata,
     Column('alliance_id', Integer, primary_key=True),
     Column('display_name', Unicode(255)),
     Column('description', Unicode(4096)),
-    Column('created', DateTime),
+    Column('created', UTCDateTime),
     Column('owner_id', Integer, ForeignKey('tg_user.user_id',
            ondelete='RESTRICT', onupdate='CASCADE')),
 )
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+#
+#   model/summary.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Per-game summaries
+
+Each game has a row in ``game_summaries`` holding its faction counts, original
+zombie and winner, created along with the game.  Whenever a game or one of its
+entries is written, the row is marked stale, its version is bumped, and its
+modification time is set.  Once the writing request's transaction is over,
+the row is recalculated on a connection of its own, so readers never write;
+a reader that finds the row stale works the numbers out for itself.
+"""
+
+from sqlalchemy import (Table, Column, ForeignKey,
+                        String, Integer, Boolean)
+from sqlalchemy.orm import MapperExtension, EXT_CONTINUE
+from turbogears.database import metadata, session
+
+from hvz.model import transactions
+from hvz.model.dates import make_aware, now, UTCDateTime
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['GameSummary',
+           'SummaryExtension',
+           'mark_stale',
+           'mark_player_changed',]
+
+## TABLES ##
+game_summaries_table = Table('game_summaries', metadata,
+    Column('game_id', Integer, ForeignKey('game.game_id',
+           ondelete='CASCADE', onupdate='CASCADE'), primary_key=True),
+    Column('version', Integer, nullable=False, default=0),
+    Column('stale', Boolean, nullable=False, default=True),
+    Column('modified', UTCDateTime),
+    Column('human_count', Integer),
+    Column('zombie_count', Integer),
+    Column('infected_count', Integer),
+    Column('dead_count', Integer),
+    Column('oz_entry_id', Integer),
+    Column('last_event', UTCDateTime),
+    Column('winner', String(16)),
+)
+
+## FUNCTIONS ##
+
+def mark_stale(game_id, connection=None):
+    """
+    Marks a game's summary as out of date.
+    
+    Inside a request, the summary is recalculated once the request's
+    transaction is over.
+    
+    :Parameters:
+        game_id : int
+            The game that changed
+        connection
+            The connection to execute on.  Defaults to the session.
+    """
+    columns = game_summaries_table.c
+    stmt = game_summaries_table.update(columns.game_id == game_id,
+        values={'stale': True,
+                'version': columns.version + 1,
+                'modified': now(),})
+    if connection is None:
+        session.execute(stmt)
+    else:
+        connection.execute(stmt)
+    if transactions.in_request():
+        transactions.after_commit(GameSummary.refresh, game_id)
+
+def mark_player_changed(user_id, connection=None):
+    """
+    Bumps the summary version of every game a user plays in.
+    
+    The counts don't change, so the summaries aren't marked stale, but pages
+    keyed on the version (such as the player list) show the user's details.
+    
+    :Parameters:
+        user_id : int
+            The user that changed
+        connection
+            The connection to execute on.  Defaults to the session.
+    """
+    from sqlalchemy import select
+    from hvz.model.game import entries_table
+    columns = game_summaries_table.c
+    games = select([entries_table.c.game_id],
+                   entries_table.c.player_id == user_id)
+    stmt = game_summaries_table.update(columns.game_id.in_(games),
+        values={'version': columns.version + 1,
+                'modified': now(),})
+    if connection is None:
+        session.execute(stmt)
+    else:
+        connection.execute(stmt)
+
+## CLASSES ##
+
+class SummaryExtension(MapperExtension):
+    """
+    Marks the game's summary stale whenever a game or entry is written.
+    
+    :IVariables:
+        create : bool
+            Whether inserting an instance creates its game's summary row.
+            This is only set for games.
+    """
+    def __init__(self, create=False):
+        MapperExtension.__init__(self)
+        self.create = create
+    
+    def _mark(self, connection, instance):
+        game_id = getattr(instance, 'game_id', None)
+        if game_id is not None:
+            mark_stale(game_id, connection)
+        return EXT_CONTINUE
+    
+    def after_insert(self, mapper, connection, instance):
+        if self.create:
+            connection.execute(game_summaries_table.insert(),
+                               game_id=instance.game_id, version=0,
+                               stale=True, modified=now())
+            return EXT_CONTINUE
+        return self._mark(connection, instance)
+    
+    def after_update(self, mapper, connection, instance):
+        return self._mark(connection, instance)
+    
+    def after_delete(self, mapper, connection, instance):
+        return self._mark(connection, instance)
+
+class GameSummary(object):
+    """
+    A snapshot of a game's standing.
+    
+    :IVariables:
+        game_id : int
+            The game summarized
+        version : int
+            Bumped every time the game changes
+        modified : datetime.datetime
+            When the game last changed, or ``None`` if unknown
+        human_count : int
+            The number of humans
+        zombie_count : int
+            The number of zombies (including the original zombie)
+        infected_count : int
+            The number of infected players
+        dead_count : int
+            The number of starved zombies
+        player_count : int
+            The number of players in the game
+        oz_entry_id : int
+            The `PlayerEntry.entry_id` of the original zombie, or ``None``
+        last_event : datetime.datetime
+            The time of the game's most recent death, feeding, or starvation
+        winner : str
+            The game's winner, as in `Game.winner`
+    """
+    def __init__(self, game_id, version=0, human_count=0, zombie_count=0,
+                 infected_count=0, dead_count=0, oz_entry_id=None,
+                 last_event=None, winner=None, modified=None):
+        self.game_id = game_id
+        self.version = version
+        if modified is None:
+            self.modified = None
+        else:
+            self.modified = make_aware(modified)
+        self.human_count = human_count
+        self.zombie_count = zombie_count
+        self.infected_count = infected_count
+        self.dead_count = dead_count
+        self.oz_entry_id = oz_entry_id
+        if last_event is None:
+            self.last_event = None
+        else:
+            self.last_event = make_aware(last_event)
+        self.winner = winner
+    
+    def __repr__(self):
+        return "<GameSummary %i v%i>" % (self.game_id, self.version)
+    
+    @classmethod
+    def for_game(cls, game):
+        """
+        Fetches a game's summary.
+        
+        If the stored summary is out of date, the summary is worked out for
+        this caller alone; the stored copy is left for `refresh`.
+        
+        :Parameters:
+            game : `hvz.model.game.Game`
+                The game to summarize
+        :ReturnType: `GameSummary`
+        """
+        from sqlalchemy import select
+        session.flush()
+        columns = game_summaries_table.c
+        query = select([game_summaries_table], columns.game_id == game.game_id)
+        row = session.execute(query).fetchone()
+        if row is not None and not row['stale']:
+            return cls._from_row(row)
+        if row is None:
+            version, modified = 0, None
+        else:
+            version, modified = row['version'], row['modified']
+        values = cls._calculate(session, game.game_id)
+        return cls(game.game_id, version, modified=modified, **values)
+    
+    @classmethod
+    def refresh(cls, game_id):
+        """
+        Recalculates a game's stored summary, if it's out of date.
+        
+        This runs in a transaction of its own, so call it once the changes
+        it should see have been committed.  If the game changes again in the
+        meantime, the summary is left stale for the next refresh.
+        
+        :Parameters:
+            game_id : int
+                The game to summarize
+        """
+        from sqlalchemy import and_, select
+        columns = game_summaries_table.c
+        connection = metadata.bind.connect()
+        try:
+            transaction = connection.begin()
+            try:
+                query = select([columns.version, columns.stale],
+                               columns.game_id == game_id)
+                row = connection.execute(query).fetchone()
+                if row is not None and row['stale']:
+                    values = cls._calculate(connection, game_id)
+                    stmt = game_summaries_table.update(
+                        and_(columns.game_id == game_id,
+                             columns.version == row['version']),
+                        values=dict(values, stale=False))
+                    connection.execute(stmt)
+                transaction.commit()
+            except:
+                transaction.rollback()
+                raise
+        finally:
+            connection.close()
+    
+    @classmethod
+    def _from_row(cls, row):
+        return cls(row['game_id'], row['version'],
+                   human_count=row['human_count'],
+                   zombie_count=row['zombie_count'],
+                   infected_count=row['infected_count'],
+                   dead_count=row['dead_count'],
+                   oz_entry_id=row['oz_entry_id'],
+                   last_event=row['last_event'],
+                   winner=row['winner'],
+                   modified=row['modified'],)
+    
+    @staticmethod
+    def _calculate(executor, game_id):
+        from sqlalchemy import and_, func, or_, select
+        from hvz.model.game import Game, PlayerEntry, entries_table, \
+                                   games_table
+        columns = entries_table.c
+        # Faction counts
+        query = select([columns.state, func.count(columns.entry_id)],
+                       columns.game_id == game_id,
+                       group_by=[columns.state])
+        counts = dict.fromkeys(PlayerEntry.STATE_NAMES, 0)
+        for state, count in executor.execute(query):
+            counts[state] = count
+        human_count = counts[PlayerEntry.STATE_HUMAN]
+        zombie_count = (counts[PlayerEntry.STATE_ZOMBIE] +
+                        counts[PlayerEntry.STATE_ORIGINAL_ZOMBIE])
+        infected_count = counts[PlayerEntry.STATE_INFECTED]
+        dead_count = (counts[PlayerEntry.STATE_DEAD] +
+                      counts[PlayerEntry.STATE_DEAD_OZ])
+        # Original zombie
+        query = select([columns.entry_id],
+            and_(columns.game_id == game_id,
+                 or_(columns.state == PlayerEntry.STATE_ORIGINAL_ZOMBIE,
+                     columns.state == PlayerEntry.STATE_DEAD_OZ)))
+        oz_ids = [row[0] for row in executor.execute(query)]
+        if len(oz_ids) > 1:
+            raise AssertionError("We have multiple OZs")
+        elif oz_ids:
+            oz_entry_id = oz_ids[0]
+        else:
+            oz_entry_id = None
+        # Last event
+        query = select([func.max(columns.death_date, type_=UTCDateTime),
+                        func.max(columns.feed_date, type_=UTCDateTime),
+                        func.max(columns.starve_date, type_=UTCDateTime)],
+                       columns.game_id == game_id)
+        dates = [d for d in executor.execute(query).fetchone()
+                 if d is not None]
+        if dates:
+            last_event = max(dates)
+        else:
+            last_event = None
+        # Winner
+        query = select([games_table.c.state],
+                       games_table.c.game_id == game_id)
+        state = executor.execute(query).scalar()
+        if state != Game.STATE_ENDED:
+            winner = None
+        elif human_count == 0:
+            winner = 'zombie'
+        elif zombie_count == 0:
+            winner = 'human'
+        else:
+            winner = None
+        return dict(human_count=human_count,
+                    zombie_count=zombie_count,
+                    infected_count=infected_count,
+                    dead_count=dead_count,
+                    oz_entry_id=oz_entry_id,
+                    last_event=last_event,
+                    winner=winner,)
+    
+    @property
+    def player_count(self):
+        return (self.human_count + self.zombie_count +
+                self.infected_count + self.dead_count)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+#   model/tokens.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+One-time form tokens
+
+A form that shouldn't be processed twice carries a token from `new_token`.
+The handler calls `claim` before doing anything; if the claim fails, the form
+has been submitted before, and the handler can send back the original response
+from `get_result` instead.
+
+Tokens are written in the session's transaction, so a claim only sticks if
+the request that made it commits.  A second submission of the same form
+waits for the first to finish before its claim fails.
+
+Tokens are forgotten after ``hvz.token_ttl`` seconds.
+"""
+
+from datetime import timedelta
+from uuid import uuid4
+
+import turbogears
+from sqlalchemy import Table, Column, String, Unicode
+from turbogears.database import metadata, session
+
+from hvz.model.dates import now, to_naive_utc, UTCDateTime
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['new_token',
+           'claim',
+           'record',
+           'release',
+           'get_result',]
+
+## TABLES ##
+tokens_table = Table('form_tokens', metadata,
+    Column('token', String(32), primary_key=True),
+    Column('expires', UTCDateTime, index=True),
+    Column('result', Unicode(1024)),
+)
+
+## FUNCTIONS ##
+
+def new_token():
+    """
+    Creates a new, unclaimed token.
+    
+    :ReturnType: str
+    """
+    return uuid4().hex
+
+def claim(token):
+    """
+    Claims a token for the current request.
+    
+    :Parameters:
+        token : str
+            The token submitted with the form
+    :Returns: Whether the token was claimed; ``False`` means that the form has
+              already been submitted
+    :ReturnType: bool
+    """
+    from sqlalchemy.exceptions import IntegrityError
+    ttl = turbogears.config.get('hvz.token_ttl', 24 * 60 * 60)
+    current_time = to_naive_utc(now())
+    # Forget old tokens
+    session.execute(tokens_table.delete(tokens_table.c.expires < current_time))
+    # Claim the new one.  A failed insert must not spoil the transaction.
+    transaction = session.begin_nested()
+    try:
+        session.execute(tokens_table.insert(),
+                        dict(token=token,
+                             expires=current_time + timedelta(seconds=ttl),
+                             result=None,))
+        transaction.commit()
+    except IntegrityError:
+        transaction.rollback()
+        return False
+    except:
+        transaction.rollback()
+        raise
+    else:
+        return True
+
+def record(token, result):
+    """
+    Stores the response for a claimed token.
+    
+    :Parameters:
+        token : str
+            The claimed token
+        result : unicode
+            The response to replay (usually a URL to redirect to)
+    """
+    stmt = tokens_table.update(tokens_table.c.token == token,
+                               values={'result': result})
+    session.execute(stmt)
+
+def release(token):
+    """
+    Gives up a claimed token, so that the form can be submitted again.
+    
+    Use this when the request fails.
+    
+    :Parameters:
+        token : str
+            The claimed token
+    """
+    session.execute(tokens_table.delete(tokens_table.c.token == token))
+
+def get_result(token):
+    """
+    Retrieves the response recorded for a token.
+    
+    :Parameters:
+        token : str
+            The token
+    :Returns: The recorded response, or ``None`` if the request that claimed
+              the token hasn't finished
+    :ReturnType: unicode
+    """
+    from sqlalchemy import select
+    query = select([tokens_table.c.result], tokens_table.c.token == token)
+    return session.execute(query).scalar()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+#   model/transactions.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Transaction support
+
+Parts of a request's transaction (e.g. a kill report that lost a race) are
+retried inside savepoints.  `enable_savepoints` makes that work on SQLite; it's
+called for the configured engine when TurboGears starts.
+
+Some work has to wait until the request's transaction is over, such as
+letting other processes update a game that this request just updated.
+`after_commit` holds such work until `end_request`.
+
+:Variables:
+    log : logging.Logger
+        The log for deferred work that failed
+"""
+
+import logging
+import threading
+
+import turbogears
+from sqlalchemy.interfaces import PoolListener
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['log',
+           'enable_savepoints',
+           'begin_request',
+           'end_request',
+           'in_request',
+           'after_commit',]
+
+log = logging.getLogger("hvz.model.transactions")
+
+_context = threading.local()
+
+class _ExplicitTransactions(PoolListener):
+    def connect(self, dbapi_con, con_record):
+        dbapi_con.isolation_level = None
+
+def enable_savepoints(engine):
+    """
+    Makes an engine's transactions able to hold savepoints.
+    
+    pysqlite begins transactions on its own, and commits them before any
+    ``SAVEPOINT``.  For SQLite engines, this turns that off and begins
+    transactions explicitly instead, as the other databases do.  Other engines
+    are left alone.
+    
+    Call this before the engine is first used.
+    
+    :Parameters:
+        engine : sqlalchemy.engine.Engine
+            The engine to fix
+    """
+    dialect = engine.dialect
+    if engine.name != 'sqlite' or 'do_begin' in dialect.__dict__:
+        return
+    # Connections made before now would still commit on their own
+    engine.pool.dispose()
+    engine.pool.add_listener(_ExplicitTransactions())
+    dialect.do_begin = (lambda connection: connection.execute("BEGIN"))
+
+def begin_request():
+    """
+    Starts holding `after_commit` work for the current thread.
+    
+    Call this before the request's transaction begins.
+    """
+    _context.pending = []
+
+def end_request():
+    """
+    Runs the work held by `after_commit` for the current thread.
+    
+    Call this once the request's transaction has been committed or rolled
+    back.  Failures are logged, so that they don't stop the rest of the work
+    from running.
+    """
+    pending = getattr(_context, 'pending', None)
+    _context.pending = None
+    if not pending:
+        return
+    for func, args in pending:
+        try:
+            func(*args)
+        except Exception:
+            log.exception("Deferred call to %r failed", func)
+
+def in_request():
+    """
+    Checks whether `after_commit` work is being held for the current thread.
+    
+    :ReturnType: bool
+    """
+    return getattr(_context, 'pending', None) is not None
+
+def after_commit(func, *args):
+    """
+    Calls a function once the current request's transaction is over.
+    
+    Outside of a request (see `begin_request`), the function is called right
+    away.  The same call is only held once per request.
+    
+    :Parameters:
+        func
+            The function to call
+    """
+    pending = getattr(_context, 'pending', None)
+    if pending is None:
+        func(*args)
+    elif (func, args) not in pending:
+        pending.append((func, args))
+
+def _enable_configured_savepoints():
+    from turbogears import database
+    enable_savepoints(database.get_engine())
+
+turbogears.startup.call_on_startup.append(_enable_configured_savepoints)
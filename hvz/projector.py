@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+#
+#   projector.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Monte Carlo game projections
+
+A `Snapshot` of a game in progress is played forward many times with random
+kills, and the results are gathered into a `Projection`.  Kills arrive as a
+Poisson process whose rate comes from a `KillRateModel`; starving and turning
+happen on schedule.  Everything is simulated in game hours, so ignored days
+don't count, and only converted back to dates at the end.
+
+Runs are spread over a ``multiprocessing`` pool when one is available.  Web
+requests don't fork, though; they run a few hundred runs in-process, and
+bigger projections are left to ``turbohvz-project-game``.
+
+:Variables:
+    MODELS : dict of {str: class}
+        Kill rate models by name
+"""
+
+from __future__ import division
+from collections import deque
+from datetime import timedelta
+import heapq
+from math import log
+import random
+
+multiprocessing_available = True
+try: import multiprocessing
+except ImportError:
+    # Projections run in this process instead
+    multiprocessing_available = False
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__docformat__ = 'reStructuredText'
+__all__ = ['multiprocessing_available',
+           'KillRateModel',
+           'PerZombieRate',
+           'MassActionRate',
+           'ConstantRate',
+           'MODELS',
+           'Snapshot',
+           'Projection',
+           'simulate',
+           'project',]
+
+DEFAULT_RATE = 1.0
+DEFAULT_RUNS = 1000
+DEFAULT_PAGE_RUNS = 100
+DEFAULT_MAX_PAGE_RUNS = 300
+DEFAULT_HORIZON = 60
+
+def _hours(delta):
+    return (delta.days * 24 + delta.seconds / (60 * 60) +
+            delta.microseconds / (60 * 60 * 1000000))
+
+## KILL RATE MODELS ##
+
+class KillRateModel(object):
+    """
+    Abstract base class for kill rate models.
+    
+    :CVariables:
+        name : str
+            The name used in `MODELS`
+    :IVariables:
+        rate : float
+            Kills per zombie per game day
+    """
+    name = None
+    
+    def __init__(self, rate=DEFAULT_RATE):
+        if type(self) is KillRateModel:
+            raise TypeError("KillRateModel is an abstract base class")
+        self.rate = float(rate)
+    
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.rate)
+    
+    @classmethod
+    def estimate(cls, snapshot):
+        """
+        Fits the model to the kills so far.
+        
+        :Parameters:
+            snapshot : `Snapshot`
+                The game to fit
+        :Returns: The fitted model, or one with `DEFAULT_RATE` if the game
+                  hasn't run long enough to tell
+        :ReturnType: `KillRateModel`
+        """
+        exposure = cls._get_exposure(snapshot)
+        if snapshot.kills and exposure > 0:
+            return cls(snapshot.kills / exposure * 24)
+        else:
+            return cls()
+    
+    @staticmethod
+    def _get_exposure(snapshot):
+        return snapshot.undead_hours
+    
+    def kill_rate(self, zombies, humans, players):
+        """
+        Works out how fast kills happen.
+        
+        :Parameters:
+            zombies : int
+                The number of zombies
+            humans : int
+                The number of humans
+            players : int
+                The number of entries in the game
+        :Returns: The expected number of kills per game hour
+        :ReturnType: float
+        """
+        raise NotImplementedError("%s does not implement kill_rate" %
+                                  type(self).__name__)
+
+class PerZombieRate(KillRateModel):
+    """Each zombie kills at the same rate, however few humans are left."""
+    name = 'zombie'
+    
+    def kill_rate(self, zombies, humans, players):
+        if humans:
+            return self.rate / 24 * zombies
+        else:
+            return 0.0
+
+class MassActionRate(KillRateModel):
+    """
+    Kills depend on zombies meeting humans.
+    
+    `KillRateModel.rate` is how fast a zombie kills when everyone else is
+    human; a zombie kills more slowly as the humans thin out.
+    """
+    name = 'mass-action'
+    
+    @staticmethod
+    def _get_exposure(snapshot):
+        # The humans have thinned out roughly linearly so far
+        if not snapshot.players:
+            return 0.0
+        human_fraction = (1 + snapshot.humans / snapshot.players) / 2
+        return snapshot.undead_hours * human_fraction
+    
+    def kill_rate(self, zombies, humans, players):
+        return self.rate / 24 * zombies * humans / players
+
+class ConstantRate(KillRateModel):
+    """
+    The horde kills at a steady rate, however big it is.
+    
+    `KillRateModel.rate` is the number of kills per game day.
+    """
+    name = 'constant'
+    
+    @staticmethod
+    def _get_exposure(snapshot):
+        return snapshot.elapsed_hours
+    
+    def kill_rate(self, zombies, humans, players):
+        if zombies and humans:
+            return self.rate / 24
+        else:
+            return 0.0
+
+MODELS = dict((model.name, model)
+              for model in (PerZombieRate, MassActionRate, ConstantRate))
+
+## SNAPSHOTS ##
+
+class Snapshot(object):
+    """
+    The state of a game, reduced to what the simulation needs.
+    
+    Times are in game hours from `time`.
+    
+    :IVariables:
+        time : datetime.datetime
+            When the snapshot was taken
+        humans : int
+            The number of humans
+        zombies : list of float
+            When each zombie will starve if it doesn't feed
+        infected : list of float
+            When each infected player will turn
+        players : int
+            The number of entries in the game
+        starve_hours : float
+            How long a zombie lasts without feeding
+        turn_hours : float
+            How long the infected take to turn
+        kills : int
+            The number of kills so far
+        undead_hours : float
+            The total game time that players have spent undead so far
+        elapsed_hours : float
+            The game time since the game started
+    """
+    def __init__(self, time, humans, zombies, infected, players,
+                 starve_hours, turn_hours,
+                 kills=0, undead_hours=0.0, elapsed_hours=0.0):
+        self.time = time
+        self.humans = humans
+        self.zombies = zombies
+        self.infected = infected
+        self.players = players
+        self.starve_hours = starve_hours
+        self.turn_hours = turn_hours
+        self.kills = kills
+        self.undead_hours = undead_hours
+        self.elapsed_hours = elapsed_hours
+    
+    def __repr__(self):
+        return "<Snapshot %i humans, %i zombies, %i infected>" % \
+            (self.humans, len(self.zombies), len(self.infected))
+    
+    @classmethod
+    def from_game(cls, game, time=None):
+        """
+        Takes a snapshot of a game in progress.
+        
+        The entries are read with a single query and their deadlines are
+        worked out in batches.
+        
+        :Parameters:
+            game : `hvz.model.game.Game`
+                The game to take a snapshot of
+            time : datetime.datetime
+                The time to take the snapshot at.  Defaults to now.
+        :Raises hvz.model.errors.WrongStateError: If the game isn't in
+                                                  progress
+        :ReturnType: `Snapshot`
+        """
+        from sqlalchemy import select
+        from turbogears.database import session
+        from hvz.model.dates import now, make_aware
+        from hvz.model.errors import WrongStateError
+        from hvz.model.game import PlayerEntry, entries_table
+        if not game.in_progress:
+            raise WrongStateError(game, game.state, game.STATE_STARTED,
+                                  _("Game is not in progress"))
+        if time is None:
+            time = now()
+        else:
+            time = make_aware(time)
+        session.flush()
+        columns = entries_table.c
+        query = select([columns.state, columns.death_date, columns.feed_date,
+                        columns.starve_date, columns.kills],
+                       columns.game_id == game.game_id)
+        rows = session.execute(query).fetchall()
+        undead_states = (PlayerEntry.STATE_ZOMBIE,
+                         PlayerEntry.STATE_ORIGINAL_ZOMBIE)
+        dead_states = (PlayerEntry.STATE_DEAD, PlayerEntry.STATE_DEAD_OZ)
+        humans, last_feds, turns = 0, [], []
+        spans = []
+        for state, death_date, feed_date, starve_date, kills in rows:
+            if state == PlayerEntry.STATE_HUMAN:
+                humans += 1
+            elif state == PlayerEntry.STATE_INFECTED:
+                turns.append(death_date)
+            elif state in undead_states:
+                last_feds.append(feed_date or death_date)
+                spans.append((death_date, time))
+            elif state in dead_states:
+                spans.append((death_date, starve_date))
+        starve_hours = _hours(game.zombie_starve_timedelta)
+        # How long each zombie has left
+        elapsed = game.calculate_timedeltas(last_feds, [time] * len(last_feds))
+        zombies = [max(starve_hours - _hours(delta), 0.0)
+                   for delta in elapsed]
+        # When each infected player turns
+        turn_deltas = game.calculate_timedeltas([time] * len(turns), turns)
+        infected = [_hours(delta) for delta in turn_deltas]
+        # Exposure, for fitting the kill rate
+        spans = [(start, end) for start, end in spans if start and end]
+        undead = game.calculate_timedeltas([start for start, end in spans],
+                                           [end for start, end in spans])
+        if game.started is None:
+            elapsed_hours = 0.0
+        else:
+            elapsed_hours = _hours(game.calculate_timedelta(game.started,
+                                                            time))
+        return cls(time, humans, zombies, infected, len(rows),
+                   starve_hours, _hours(game.human_undead_timedelta),
+                   kills=sum(row['kills'] or 0 for row in rows),
+                   undead_hours=sum(_hours(delta) for delta in undead),
+                   elapsed_hours=elapsed_hours,)
+
+## SIMULATION ##
+
+def simulate(snapshot, model, rng, horizon):
+    """
+    Plays a game forward once.
+    
+    Kills are made by a zombie picked at random, which then feeds.  The
+    zombies win when the last human turns, and the humans win when the last
+    zombie starves.
+    
+    :Parameters:
+        snapshot : `Snapshot`
+            The game to start from
+        model : `KillRateModel`
+            How fast the zombies kill
+        rng : random.Random
+            The random number generator to use
+        horizon : float
+            How many game hours to simulate before giving up
+    :Returns: The winner (``'human'``, ``'zombie'``, or ``None`` if the game
+              was still going at the horizon) and the game hours until the
+              game ended
+    :ReturnType: tuple
+    """
+    heappush, heappop = heapq.heappush, heapq.heappop
+    kill_rate, uniform = model.kill_rate, rng.random
+    infinity = float('inf')
+    humans, players = snapshot.humans, snapshot.players
+    starve_hours, turn_hours = snapshot.starve_hours, snapshot.turn_hours
+    # Zombies are numbered; deadlines[n] is None once zombie n has starved.
+    # alive lists the zombies that haven't starved, and position[n] is
+    # zombie n's index in alive.  Stale heap items are skipped.
+    deadlines = list(snapshot.zombies)
+    alive = range(len(deadlines))
+    position = range(len(deadlines))
+    starving = [(deadline, n) for n, deadline in enumerate(deadlines)]
+    heapq.heapify(starving)
+    # Everyone takes the same time to turn, so players turn in the order
+    # that they were killed.
+    turning = deque(sorted(snapshot.infected))
+    if turning:
+        last_turn = turning[-1]
+    else:
+        last_turn = 0.0
+    time = 0.0
+    while True:
+        while starving and deadlines[starving[0][1]] != starving[0][0]:
+            heappop(starving)
+        if not humans:
+            return ('zombie', last_turn)
+        if starving:
+            next_event = starving[0][0]
+        elif turning:
+            next_event = infinity
+        else:
+            return ('human', time)
+        if turning and turning[0] <= next_event:
+            next_event = turning[0]
+        rate = kill_rate(len(alive), humans, players)
+        if rate > 0:
+            next_kill = time - log(1.0 - uniform()) / rate
+        else:
+            next_kill = infinity
+        if next_kill < next_event:
+            if next_kill > horizon:
+                return (None, horizon)
+            time = next_kill
+            killer = alive[int(uniform() * len(alive))]
+            deadline = deadlines[killer] = time + starve_hours
+            heappush(starving, (deadline, killer))
+            humans -= 1
+            last_turn = time + turn_hours
+            turning.append(last_turn)
+        elif next_event > horizon:
+            return (None, horizon)
+        elif turning and turning[0] == next_event:
+            time = turning.popleft()
+            zombie = len(deadlines)
+            deadlines.append(time + starve_hours)
+            position.append(len(alive))
+            alive.append(zombie)
+            heappush(starving, (deadlines[zombie], zombie))
+        else:
+            time, zombie = heappop(starving)
+            moved = alive.pop()
+            if moved != zombie:
+                alive[position[zombie]] = moved
+                position[moved] = position[zombie]
+            deadlines[zombie] = None
+
+def _run_batch(args):
+    snapshot, model, runs, seed, horizon = args
+    rng = random.Random(seed)
+    return [simulate(snapshot, model, rng, horizon) for i in xrange(runs)]
+
+def project(game, model=None, runs=None, processes=None, seed=None,
+            time=None):
+    """
+    Projects how a game in progress will end.
+    
+    Configuration:
+    
+    ``hvz.projector.runs``
+        The default number of runs
+    ``hvz.projector.horizon``
+        Game days to simulate before calling a run undecided
+    ``hvz.projector.processes``
+        The size of the process pool.  Defaults to one process per CPU; zero
+        runs everything in this process.
+    
+    :Parameters:
+        game : `hvz.model.game.Game`
+            The game to project
+        model : `KillRateModel` or class
+            How fast the zombies kill.  A model class is fitted to the game so
+            far.  Defaults to `PerZombieRate`.
+        runs : int
+            The number of runs
+        processes : int
+            The size of the process pool
+        seed : int
+            The random seed, for repeatable projections
+        time : datetime.datetime
+            The time to project from.  Defaults to now.
+    :ReturnType: `Projection`
+    """
+    import turbogears
+    config = turbogears.config
+    snapshot = Snapshot.from_game(game, time)
+    if model is None:
+        model = PerZombieRate
+    if isinstance(model, type):
+        model = model.estimate(snapshot)
+    if runs is None:
+        runs = config.get('hvz.projector.runs', DEFAULT_RUNS)
+    horizon = config.get('hvz.projector.horizon', DEFAULT_HORIZON) * 24
+    if processes is None:
+        processes = config.get('hvz.projector.processes', None)
+    if not multiprocessing_available:
+        processes = 0
+    elif processes is None:
+        processes = multiprocessing.cpu_count()
+    # Split the runs into a few batches per process, each with its own seed
+    rng = random.Random(seed)
+    batch_count = max(min(processes * 4, runs), 1)
+    batches = [(snapshot, model, runs // batch_count +
+                int(i < runs % batch_count), rng.getrandbits(64), horizon)
+               for i in xrange(batch_count)]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_run_batch, batches)
+        finally:
+            pool.terminate()
+    else:
+        results = [_run_batch(batch) for batch in batches]
+    outcomes = [outcome for batch in results for outcome in batch]
+    return Projection(game.calendar, snapshot, model, outcomes)
+
+## RESULTS ##
+
+class Projection(object):
+    """
+    The results of `project`.
+    
+    :IVariables:
+        snapshot : `Snapshot`
+            The game the runs started from
+        model : `KillRateModel`
+            The kill rate model used
+        runs : int
+            The number of runs
+        end_hours : dict of {str: list of float}
+            The game hours until each run ended, sorted and keyed by winner
+            (``None`` for undecided runs)
+    """
+    def __init__(self, calendar, snapshot, model, outcomes):
+        self.calendar = calendar
+        self.snapshot = snapshot
+        self.model = model
+        self.runs = len(outcomes)
+        self.end_hours = {'human': [], 'zombie': [], None: []}
+        for winner, hours in outcomes:
+            self.end_hours[winner].append(hours)
+        for hours in self.end_hours.itervalues():
+            hours.sort()
+    
+    def __repr__(self):
+        return "<Projection %i runs>" % (self.runs)
+    
+    def _to_date(self, hours):
+        return self.calendar.calc_addtimedelta(self.snapshot.time,
+                                               timedelta(hours=hours))
+    
+    def probability(self, winner):
+        """
+        Finds the chance of a given outcome.
+        
+        :Parameters:
+            winner : str
+                ``'human'``, ``'zombie'``, or ``None`` for undecided
+        :ReturnType: float
+        """
+        if not self.runs:
+            return 0.0
+        return len(self.end_hours[winner]) / self.runs
+    
+    def percentile(self, fraction, winner=None):
+        """
+        Finds when the game will have ended in a fraction of the runs.
+        
+        Undecided runs count as ending last.
+        
+        :Parameters:
+            fraction : float
+                The fraction of runs, between 0 and 1
+            winner : str
+                Only consider runs won by ``'human'`` or ``'zombie'``
+        :Returns: The end date, or ``None`` if there are no such runs
+        :ReturnType: datetime.datetime
+        """
+        if winner is None:
+            hours = sorted(self.end_hours['human'] + self.end_hours['zombie'] +
+                           self.end_hours[None])
+        else:
+            hours = self.end_hours[winner]
+        if not hours:
+            return None
+        index = min(int(fraction * len(hours)), len(hours) - 1)
+        return self._to_date(hours[index])
+    
+    def daily_distribution(self):
+        """
+        Counts the runs that ended on each day.
+        
+        :Returns: The local date and the number of runs won by the humans and
+                  by the zombies on that day, in order
+        :ReturnType: list of tuple
+        """
+        days = {}
+        for index, winner in enumerate(('human', 'zombie')):
+            for hours in self.end_hours[winner]:
+                day = self._to_date(hours).date()
+                counts = days.setdefault(day, [0, 0])
+                counts[index] += 1
+        return [(day, human, zombie)
+                for day, (human, zombie) in sorted(days.iteritems())]
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#
+#   test_benchmarks.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Test the benchmark game generator"""
+
+from turbogears.database import metadata, session
+
+from hvz.benchmarks.generate import generate_game
+from hvz.tests.test_model import SADBTest
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__all__ = ['TestGenerate',]
+
+class TestGenerate(SADBTest):
+    def test_generate(self):
+        """Generated games should be in progress, with kills and survivors"""
+        generated = generate_game(50)
+        game = generated.game
+        assert len(generated.user_ids) == 50, "Wrong number of players"
+        assert game.in_progress, "Game is not in progress"
+        assert generated.kills > 0, "Nobody was killed"
+        summary = game.summary
+        assert summary.human_count >= 5, "Too few survivors"
+        assert summary.human_count < 50, "Too many survivors"
+    
+    def test_repeatable(self):
+        """The same seed should generate the same game"""
+        first = generate_game(20, seed=42)
+        states = [entry.state for entry in first.game.entries]
+        session.flush()
+        session.clear()
+        metadata.drop_all()
+        metadata.create_all()
+        second = generate_game(20, seed=42)
+        assert [entry.state for entry in second.game.entries] == states, \
+            "Different games from the same seed"
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+#   test_cache.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Test in-process caches"""
+
+import unittest
+
+from hvz.cache import LRUCache, links
+from hvz.util import game_link, user_link
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__all__ = ['TestLRUCache',
+           'TestLinks',]
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        """The least recently used item should be evicted first"""
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1, "Wrong value"
+        cache.put('c', 3)
+        assert len(cache) == 2, "Cache grew past its size"
+        assert 'b' not in cache, "Wrong item evicted"
+        assert cache.get('a') == 1 and cache.get('c') == 3, \
+            "Recent items evicted"
+    
+    def test_replace(self):
+        """Putting an existing key should replace it without evicting"""
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('a', 10)
+        assert len(cache) == 2, "Duplicate item"
+        assert cache.get('a') == 10, "Value not replaced"
+        assert cache.get('b') == 2, "Other item evicted"
+    
+    def test_disabled(self):
+        """A cache with no room should hold nothing"""
+        cache = LRUCache(0)
+        cache.put('a', 1)
+        assert cache.get('a', 'missing') == 'missing', "Item cached"
+
+class TestLinks(unittest.TestCase):
+    def setUp(self):
+        links.clear()
+    
+    def test_cached(self):
+        """Links should be built once, then come from the cache"""
+        link = user_link(42)
+        assert link == '/user/view/42', "Wrong link"
+        assert len(links) == 1, "Link not cached"
+        assert user_link(42) == link, "Cached link differs"
+        assert user_link(42, 'edit') == '/user/edit/42', "Action ignored"
+    
+    def test_params(self):
+        """Parameters should be added to cached links"""
+        game_link(7)
+        assert game_link(7, redirect=True, page=2) == '/game/view/7?page=2', \
+            "Wrong link with parameters"
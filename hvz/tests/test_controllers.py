@@ -21,17 +21,24 @@
 
 """Test controller objects"""
 
+from cStringIO import StringIO
+import gzip
 import unittest
 
 import cherrypy
 import turbogears
 from turbogears import testutil
+from turbogears.database import metadata, session
 
+from hvz import model
 from hvz.controllers.base import Root
+from hvz.controllers.game import VIEW_QUERY_BUDGET
+from hvz.tests.test_model import QueryCounter
 
 __author__ = 'Ross Light'
 __date__ = 'March 30, 2008'
-__all__ = ['TestPages']
+__all__ = ['TestPages',
+           'TestGameView',]
 
 cherrypy.root = Root()
 
@@ -57,3 +64,94 @@ class TestPages(unittest.TestCase):
         testutil.create_request("/login")
         response = cherrypy.response.body[0].lower()
         assert "<title>login</title>" in response
+
+class TestGameView(unittest.TestCase):
+    def setUp(self):
+        turbogears.startup.startTurboGears()
+        metadata.create_all(checkfirst=True)
+        self.game = model.game.Game(u"Ender's game")
+        session.flush()
+    
+    def tearDown(self):
+        session.flush()
+        metadata.drop_all(checkfirst=True)
+        turbogears.startup.stopTurboGears()
+    
+    def _add_players(self, count):
+        for i in xrange(count):
+            user = model.identity.User(u"player%i" % (len(self.game.entries)))
+            model.game.PlayerEntry(self.game, user)
+        session.flush()
+    
+    def _count_queries(self):
+        session.clear()
+        counter = QueryCounter()
+        counter.start()
+        try:
+            testutil.create_request("/game/view/%i" % (self.game.game_id))
+        finally:
+            counter.stop()
+        self.game = model.game.Game.query.get(self.game.game_id)
+        assert "player0" in cherrypy.response.body[0], "Players not listed"
+        return len(counter)
+    
+    def test_query_budget(self):
+        """The game page should stay within its query budget"""
+        self._add_players(3)
+        small_count = self._count_queries()
+        self._add_players(30)
+        large_count = self._count_queries()
+        assert small_count == large_count, \
+            "Queries grow with players (%i, then %i)" % \
+            (small_count, large_count)
+        assert large_count <= VIEW_QUERY_BUDGET, \
+            "Game page took %i queries" % (large_count)
+    
+    def test_list_cache(self):
+        """Cached player lists should follow changes to the game"""
+        self._add_players(3)
+        self._count_queries()
+        user = model.identity.User(u"latecomer")
+        model.game.PlayerEntry(self.game, user)
+        session.flush()
+        self._count_queries()
+        assert "latecomer" in cherrypy.response.body[0], \
+            "Stale player list"
+    
+    def test_faction_filter(self):
+        """The roster should only list the requested faction"""
+        self._add_players(3)
+        url = "/game/view/%i" % (self.game.game_id)
+        testutil.create_request(url + "?faction=human")
+        assert "player0" in cherrypy.response.body[0], "Human not listed"
+        testutil.create_request(url + "?faction=zombie")
+        assert "player0" not in cherrypy.response.body[0], "Human listed"
+    
+    def test_not_modified(self):
+        """Repeated requests should get a 304 until the game changes"""
+        url = "/game/rules/%i" % (self.game.game_id)
+        testutil.create_request(url)
+        etag = cherrypy.response.headers['ETag']
+        testutil.create_request(url, headers={'If-None-Match': etag})
+        assert cherrypy.response.status.startswith('304'), \
+            "Current copy sent again"
+        self.game.display_name = u"Bean's game"
+        session.flush()
+        testutil.create_request(url, headers={'If-None-Match': etag})
+        assert cherrypy.response.status.startswith('200'), \
+            "Stale copy not replaced"
+    
+    def test_compressed(self):
+        """Pages should be gzipped for clients that accept it"""
+        url = "/game/rules/%i" % (self.game.game_id)
+        testutil.create_request(url)
+        plain = cherrypy.response.body[0]
+        testutil.create_request(url, headers={'Accept-Encoding': 'gzip'})
+        assert cherrypy.response.headers.get('Content-Encoding') == 'gzip', \
+            "Page not compressed"
+        f = gzip.GzipFile(fileobj=StringIO(cherrypy.response.body[0]))
+        assert f.read() == plain, "Wrong page compressed"
+        etag = cherrypy.response.headers['ETag']
+        testutil.create_request(url, headers={'If-None-Match': etag})
+        assert cherrypy.response.status.startswith('304'), \
+            "Weak ETag not matched"
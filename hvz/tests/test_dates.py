@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+#
+#   test_dates.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Test date arithmetic
+
+The ignored-day calculations are checked against the original day-by-day
+loops, which are kept here as the reference.
+"""
+
+from datetime import date, datetime, timedelta
+import random
+import unittest
+
+import nose
+import pytz
+
+from hvz.model import dates
+from hvz.model.dates import IgnoredDays, to_local
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__all__ = ['TestIgnoredDays',
+           'TestDifferential',
+           'TestBatch',
+           'TestRequestClock',]
+
+TZ = pytz.timezone('US/Eastern')
+
+## REFERENCE IMPLEMENTATIONS ##
+
+def loop_timedelta(datetime1, datetime2, tz, ignore_dates, ignore_weekdays):
+    datetime1, datetime2 = to_local(datetime1, tz), to_local(datetime2, tz)
+    difference = datetime2 - datetime1
+    date1, date2 = (datetime1.date(), datetime2.date())
+    accum_date = date1
+    while accum_date <= date2:
+        if accum_date in ignore_dates or \
+           accum_date.isoweekday() in ignore_weekdays:
+            if accum_date == date1:
+                this_day = datetime1.replace(hour=0, minute=0, second=0,
+                                             microsecond=0)
+                next_day = this_day + timedelta(1)
+                difference -= next_day - datetime1
+            elif accum_date == date2:
+                this_day = datetime2.replace(hour=0, minute=0, second=0,
+                                             microsecond=0)
+                difference -= datetime2 - this_day
+            else:
+                difference -= timedelta(1)
+        accum_date += timedelta(1)
+    return max(timedelta(), difference)
+
+def loop_addtimedelta(dt, delta, tz, ignore_dates, ignore_weekdays):
+    datetime1 = to_local(dt, tz)
+    datetime2 = datetime1 + delta
+    date1, date2 = (datetime1.date(), datetime2.date())
+    accum_date = date1
+    while accum_date <= date2:
+        if accum_date in ignore_dates or \
+           accum_date.isoweekday() in ignore_weekdays:
+            if accum_date == date1:
+                this_day = datetime1.replace(hour=0, minute=0, second=0,
+                                             microsecond=0)
+                next_day = this_day + timedelta(1)
+                datetime2 += next_day - datetime1
+            elif accum_date == date2:
+                this_day = datetime2.replace(hour=0, minute=0, second=0,
+                                             microsecond=0)
+                datetime2 += datetime2 - this_day
+            else:
+                datetime2 += timedelta(1)
+            date2 = datetime2.date()
+        accum_date += timedelta(1)
+    return datetime2
+
+## TESTS ##
+
+class TestIgnoredDays(unittest.TestCase):
+    def test_count(self):
+        """Counting ignored days should match checking each day"""
+        ignored = IgnoredDays([date(2008, 4, 22), date(2008, 4, 26)], [6, 7])
+        start = date(2008, 4, 1)
+        for length in xrange(60):
+            end = start + timedelta(length)
+            expected = len([i for i in xrange(length)
+                            if ignored.is_ignored(start + timedelta(i))])
+            assert ignored.count(start, end) == expected, \
+                "Wrong count for %i days" % length
+    
+    def test_nth_counted(self):
+        """Finding the nth counted day should skip ignored days"""
+        ignored = IgnoredDays([date(2008, 4, 22), date(2008, 4, 23)], [6, 7])
+        start = date(2008, 4, 21)
+        assert ignored.nth_counted(start, 1) == date(2008, 4, 21), \
+            "First day is counted"
+        assert ignored.nth_counted(start, 2) == date(2008, 4, 24), \
+            "Ignored dates not skipped"
+        assert ignored.nth_counted(start, 4) == date(2008, 4, 28), \
+            "Ignored weekend not skipped"
+    
+    def test_every_day_ignored(self):
+        """Finding a counted day should fail when every day is ignored"""
+        ignored = IgnoredDays([], range(1, 8))
+        self.assertRaises(ValueError, ignored.nth_counted,
+                          date(2008, 4, 21), 1)
+
+class TestDifferential(unittest.TestCase):
+    # Spring forward and fall back in US/Eastern
+    transitions = [datetime(2008, 3, 9, 7, 0), datetime(2008, 11, 2, 6, 0)]
+    
+    def _check(self, dt, delta, ignore_dates, ignore_weekdays):
+        args = (TZ, ignore_dates, ignore_weekdays)
+        expected = loop_timedelta(dt, dt + delta, *args)
+        result = dates.calc_timedelta(dt, dt + delta, *args)
+        assert result == expected, \
+            "calc_timedelta(%s, %s, %r, %r) = %s, not %s" % \
+            (dt, dt + delta, ignore_dates, ignore_weekdays, result, expected)
+        if len(frozenset(ignore_weekdays)) == 7:
+            # The loop never finishes
+            return
+        expected = loop_addtimedelta(dt, delta, *args)
+        result = dates.calc_addtimedelta(dt, delta, *args)
+        assert result == expected, \
+            "calc_addtimedelta(%s, %s, %r, %r) = %s, not %s" % \
+            (dt, delta, ignore_dates, ignore_weekdays, result, expected)
+        assert result.utcoffset() == expected.utcoffset(), \
+            "calc_addtimedelta gives the wrong offset for %s" % (dt,)
+    
+    def test_edges(self):
+        """Spans starting or ending on ignored days and midnights match"""
+        ignore_dates = [date(2008, 4, 22), date(2008, 4, 23),
+                        date(2008, 4, 28)]
+        ignore_weekdays = [6, 7]
+        midnight = TZ.localize(datetime(2008, 4, 21))
+        for hours in xrange(0, 24 * 10, 3):
+            dt = midnight + timedelta(hours=hours)
+            for delta_hours in (0, 1, 11, 12, 13, 23, 24, 25, 48, 100):
+                self._check(dt, timedelta(hours=delta_hours),
+                            ignore_dates, ignore_weekdays)
+    
+    def test_spill(self):
+        """Late ends on consecutive ignored days match"""
+        ignore_dates = [date(2008, 4, 23) + timedelta(i) for i in xrange(4)]
+        dt = TZ.localize(datetime(2008, 4, 21, 8, 0))
+        for minutes in xrange(0, 24 * 60, 37):
+            self._check(dt, timedelta(days=1, minutes=minutes),
+                        ignore_dates, [])
+    
+    def test_daylight_saving(self):
+        """Spans across daylight saving changes match"""
+        for transition in self.transitions:
+            transition = pytz.utc.localize(transition)
+            ignore_dates = [to_local(transition, TZ).date() + timedelta(i)
+                            for i in (-1, 0, 2)]
+            for minutes in xrange(-36 * 60, 12 * 60, 45):
+                dt = transition + timedelta(minutes=minutes)
+                for delta_hours in (1, 5, 24, 49, 150):
+                    for ignore_weekdays in ([], [7], [6, 7]):
+                        self._check(dt, timedelta(hours=delta_hours),
+                                    ignore_dates, ignore_weekdays)
+    
+    def test_random(self):
+        """Random spans match"""
+        rng = random.Random(20081102)
+        start = pytz.utc.localize(datetime(2008, 1, 1))
+        for i in xrange(5000):
+            dt = start + timedelta(minutes=rng.randrange(400 * 24 * 60))
+            ignore_weekdays = rng.sample(range(1, 8), rng.randrange(4))
+            ignore_dates = [dt.date() + timedelta(rng.randrange(-3, 40))
+                            for j in xrange(rng.randrange(12))]
+            delta = timedelta(minutes=rng.randrange(20 * 24 * 60))
+            self._check(dt, delta, ignore_dates, ignore_weekdays)
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        if not dates.numpy_available:
+            raise nose.SkipTest("NumPy is not installed")
+        self.calendar = dates.GameCalendar(TZ, [date(2008, 3, 10),
+                                                date(2008, 11, 3)], [6, 7])
+        rng = random.Random(20080309)
+        start = pytz.utc.localize(datetime(2008, 1, 1))
+        self.starts = [start + timedelta(minutes=rng.randrange(400 * 24 * 60))
+                       for i in xrange(500)]
+        self.ends = [dt + timedelta(minutes=rng.randrange(-60, 20 * 24 * 60))
+                     for dt in self.starts]
+    
+    def test_timedelta(self):
+        """Batch deltas should match calc_timedelta"""
+        result = self.calendar.batch_timedelta(self.starts, self.ends)
+        for start, end, delta in zip(self.starts, self.ends, result.tolist()):
+            if end < start:
+                expected = timedelta()
+            else:
+                expected = self.calendar.calc_timedelta(start, end)
+            assert delta == expected, \
+                "Wrong batch delta from %s to %s" % (start, end)
+    
+    def test_addtimedelta(self):
+        """Batch sums should match calc_addtimedelta"""
+        delta = timedelta(hours=48)
+        result = self.calendar.batch_addtimedelta(self.starts, delta)
+        for start, dt in zip(self.starts, result.tolist()):
+            expected = self.calendar.calc_addtimedelta(start, delta)
+            assert pytz.utc.localize(dt) == expected, \
+                "Wrong batch sum from %s" % (start,)
+
+class TestRequestClock(unittest.TestCase):
+    def tearDown(self):
+        dates.end_request()
+    
+    def test_now(self):
+        """now should stay put for the whole request"""
+        start = pytz.utc.localize(datetime(2008, 4, 21, 14, 15))
+        dates.begin_request(start)
+        assert dates.now() == start, "now isn't the request time"
+        dates.end_request()
+        assert dates.now() != start, "now still frozen after the request"
+    
+    def test_local_cache(self):
+        """Local conversions should be remembered during a request"""
+        dt = pytz.utc.localize(datetime(2008, 4, 21, 14, 15))
+        dates.begin_request()
+        first = to_local(dt, TZ)
+        assert to_local(dt, TZ) is first, "Conversion not remembered"
+        assert first == dt, "Conversion changed the time"
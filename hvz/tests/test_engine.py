@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+#   test_engine.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Test the array-backed engine against the mapped objects"""
+
+from datetime import datetime, timedelta
+
+from turbogears.database import session
+
+from hvz import model
+from hvz.model.dates import as_local
+from hvz.model.engine import EntryState, GameState
+from hvz.model.errors import InvalidTimeError, WrongStateError
+from hvz.tests.test_model import SADBTest
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__all__ = ['TestEngine',]
+
+class TestEngine(SADBTest):
+    def setUp(self):
+        super(TestEngine, self).setUp()
+        self.game = model.game.Game(u"Ender's game")
+        self.user1 = model.identity.User(u"Ender")
+        self.user2 = model.identity.User(u"Bean")
+        self.user3 = model.identity.User(u"Chuck Norris")
+        self.entry1 = model.game.PlayerEntry(self.game, self.user1)
+        self.entry2 = model.game.PlayerEntry(self.game, self.user2)
+        self.entry3 = model.game.PlayerEntry(self.game, self.user3)
+        session.flush()
+    
+    def _start_game(self):
+        while self.game.state < model.game.Game.STATE_CHOOSE_ZOMBIE:
+            self.game.next_state()
+        self.entry1.make_original_zombie()
+        while self.game.state < model.game.Game.STATE_STARTED:
+            self.game.next_state(as_local(datetime(2008, 4, 21, 14, 15)))
+        return GameState.load(self.game)
+    
+    def _compare(self, state):
+        session.flush()
+        assert state.state == self.game.state, "Game states differ"
+        assert state.ended == self.game.ended, "End dates differ"
+        for entry in (self.entry1, self.entry2, self.entry3):
+            assert state.entry(entry.entry_id) == \
+                EntryState.from_entry(entry), \
+                "Entry %i differs" % (entry.entry_id)
+    
+    def test_load(self):
+        """Loading a game should copy every entry"""
+        state = self._start_game()
+        assert len(state) == 3, "Wrong number of entries"
+        self._compare(state)
+        counts = state.count_states()
+        assert counts[model.game.PlayerEntry.STATE_HUMAN] == 2, \
+            "Wrong number of humans"
+        assert counts[model.game.PlayerEntry.STATE_ORIGINAL_ZOMBIE] == 1, \
+            "Wrong number of original zombies"
+    
+    def test_killing(self):
+        """Kills and turning should match the mapped entries"""
+        state = self._start_game()
+        kill_time = as_local(datetime(2008, 4, 22, 14, 15))
+        zombie_time = kill_time + self.game.human_undead_timedelta
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        state.kill(self.entry1.entry_id, self.entry2.entry_id,
+                   kill_time, kill_time)
+        self._compare(state)
+        self.game.update(zombie_time)
+        state.update(zombie_time)
+        self._compare(state)
+        assert state.entry(self.entry2.entry_id).state == \
+            model.game.PlayerEntry.STATE_ZOMBIE, "Victim is not a zombie"
+    
+    def test_check_human_end(self):
+        """Starvation should end the game in the humans' favor"""
+        state = self._start_game()
+        end_time = self.entry1.death_date + self.game.zombie_starve_timedelta
+        update_time = (end_time + self.game.zombie_report_timedelta +
+                       timedelta(minutes=1))
+        self.game.update(update_time)
+        state.update(update_time)
+        self._compare(state)
+        assert state.winner == 'human', "Wrong winner"
+    
+    def test_check_zombie_end(self):
+        """Infecting everyone should end the game in the zombies' favor"""
+        state = self._start_game()
+        for victim, minute in ((self.entry2, 15), (self.entry3, 30)):
+            kill_time = as_local(datetime(2008, 4, 22, 14, minute))
+            self.entry1.kill(victim, kill_time, kill_time)
+            state.kill(self.entry1.entry_id, victim.entry_id,
+                       kill_time, kill_time)
+        self.game.update(kill_time)
+        state.update(kill_time)
+        self._compare(state)
+        assert state.winner == 'zombie', "Wrong winner"
+    
+    def test_errors(self):
+        """The engine should refuse out-of-order kills and human killers"""
+        state = self._start_game()
+        kill_time = as_local(datetime(2008, 4, 22, 14, 15))
+        state.kill(self.entry1.entry_id, self.entry2.entry_id,
+                   kill_time, kill_time)
+        try:
+            state.kill(self.entry1.entry_id, self.entry3.entry_id,
+                       kill_time, kill_time)
+        except InvalidTimeError:
+            pass
+        else:
+            self.fail("Out-of-order kill accepted")
+        later = kill_time + timedelta(minutes=5)
+        try:
+            state.kill(self.entry3.entry_id, self.entry1.entry_id,
+                       later, later)
+        except WrongStateError:
+            pass
+        else:
+            self.fail("Human allowed to kill")
+    
+    def test_replay(self):
+        """Replaying the event log should give the current state"""
+        self._start_game()
+        kill_time = as_local(datetime(2008, 4, 22, 14, 15))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        self.game.update(kill_time + self.game.human_undead_timedelta)
+        self._compare(GameState.replay(self.game))
+        before = GameState.replay(self.game, kill_time - timedelta(minutes=1))
+        assert before.entry(self.entry2.entry_id).state == \
+            model.game.PlayerEntry.STATE_HUMAN, "Replayed past the limit"
+    
+    def test_copy(self):
+        """Copies should be independent of the original"""
+        state = self._start_game()
+        what_if = state.copy()
+        kill_time = as_local(datetime(2008, 4, 22, 14, 15))
+        what_if.kill(self.entry1.entry_id, self.entry2.entry_id,
+                     kill_time, kill_time)
+        assert state.entry(self.entry2.entry_id).state == \
+            model.game.PlayerEntry.STATE_HUMAN, "Original changed"
+        self._compare(state)
@@ -28,6 +28,8 @@
 # which is very fast.
 
 from datetime import date, datetime, timedelta
+import threading
+import time
 import unittest
 
 from turbogears import testutil, database
@@ -49,6 +51,7 @@ class SADBTest(unittest.TestCase):
     def setUp(self):
         # Make sure engine is active
         database.bind_meta_data()
+        model.transactions.enable_savepoints(metadata.bind)
         # Import model
         if not self.model:
             self.model = get_model()
@@ -64,6 +67,26 @@ class SADBTest(unittest.TestCase):
         # Drop all model tables
         database.metadata.drop_all(checkfirst=True)
 
+class QueryCounter(object):
+    """Counts the statements sent to the database while it's running."""
+    def __init__(self):
+        self.statements = []
+        self.dialect = None
+    
+    def __len__(self):
+        return len(self.statements)
+    
+    def start(self):
+        self.dialect = metadata.bind.dialect
+        do_execute = self.dialect.do_execute
+        def counting_execute(cursor, statement, parameters, context=None):
+            self.statements.append(statement)
+            return do_execute(cursor, statement, parameters, context)
+        self.dialect.do_execute = counting_execute
+    
+    def stop(self):
+        del self.dialect.do_execute
+
 class TestDateCalculation(unittest.TestCase):
     def test_difference(self):
         """Subtracting two datetimes should ignore dates"""
@@ -89,6 +112,99 @@ class TestDateCalculation(unittest.TestCase):
         assert result == as_local(datetime(2008, 5, 9, 11, 0)), \
             "Adding yields wrong date"
 
+class TestSingleFlight(unittest.TestCase):
+    def test_collapse(self):
+        """Concurrent calls with the same key should only run once"""
+        flight = model.locking.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+        def work():
+            calls.append(None)
+            started.set()
+            release.wait()
+            return 42
+        def follow():
+            results.append(flight.do('game', work))
+        leader = threading.Thread(target=follow)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=follow)
+        follower.start()
+        # Give the follower a chance to start waiting
+        time.sleep(0.1)
+        release.set()
+        leader.join()
+        follower.join()
+        assert len(calls) == 1, "Function ran more than once"
+        assert sorted(results) == [(42, False), (42, True)], \
+            "Callers got wrong results"
+    
+    def test_wait_for_commit(self):
+        """Followers should wait until the leader's request is over"""
+        flight = model.locking.SingleFlight()
+        transactions = model.transactions
+        started, finished = threading.Event(), threading.Event()
+        follower_done = threading.Event()
+        def lead():
+            transactions.begin_request()
+            try:
+                flight.do('game', lambda: 42)
+                started.set()
+                finished.wait()
+            finally:
+                transactions.end_request()
+        def follow():
+            flight.do('game', lambda: 0)
+            follower_done.set()
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=follow)
+        follower.start()
+        follower_done.wait(0.2)
+        assert not follower_done.isSet(), \
+            "Follower let go before the leader's request ended"
+        finished.set()
+        leader.join()
+        follower.join()
+        assert follower_done.isSet(), "Follower never let go"
+    
+    def test_timeout(self):
+        """Followers should give up after the timeout"""
+        flight = model.locking.SingleFlight(timeout=0.1)
+        started, release = threading.Event(), threading.Event()
+        def work():
+            started.set()
+            release.wait()
+            return 42
+        leader = threading.Thread(target=flight.do, args=('game', work))
+        leader.start()
+        started.wait()
+        try:
+            result = flight.do('game', work)
+        finally:
+            release.set()
+            leader.join()
+        assert result == (None, False), "Follower didn't time out"
+
+class TestUpdateLease(SADBTest):
+    def test_request_rollback(self):
+        """Taking a lease shouldn't commit the request's work"""
+        transaction = session.begin()
+        try:
+            game = model.game.Game(u"Leased game")
+            session.flush()
+            holder = model.locking.acquire_update_lease(game.game_id)
+            assert holder is not None, "Lease not granted"
+            model.locking.release_update_lease(game.game_id, holder)
+            model.game.Game(u"Later game")
+            session.flush()
+        finally:
+            transaction.rollback()
+        session.clear()
+        assert model.game.Game.query.count() == 0, \
+            "Rollback didn't remove the games"
+
 class TestUser(SADBTest):
     def test_creation(self):
         """User creation should set all necessary attributes"""
@@ -104,6 +220,32 @@ class TestUser(SADBTest):
         assert obj.created.tzinfo is not None, "No timezone information"
         assert obj.created.utcoffset() == timedelta(), "Non-UTC timezone"
     
+    def test_date_assignment(self):
+        """Setting a date should wait for the normal flush"""
+        obj = model.identity.User(u"lancelot", u"Sir Lancelot")
+        obj.created = datetime(2008, 4, 21, 14, 15)
+        assert obj in session.new, "Date assignment flushed the session"
+        session.flush()
+        session.clear()
+        obj = model.identity.User.by_user_name(u"lancelot")
+        assert obj.created.tzinfo is not None, "Loaded date is naive"
+        obj.created = as_utc(datetime(2008, 4, 22))
+        assert obj in session.dirty, "Date assignment flushed the session"
+        session.flush()
+    
+    def test_version(self):
+        """Writing a user should bump its version and modification time"""
+        obj = model.identity.User(u"robin", u"Sir Robin")
+        session.flush()
+        version = obj.version
+        assert obj.modified is not None, "No modification time"
+        obj.display_name = u"Brave Sir Robin"
+        session.flush()
+        assert obj.version > version, "User version not bumped"
+        session.clear()
+        obj = model.identity.User.by_user_name(u"robin")
+        assert obj.version == version + 1, "User version not stored"
+    
     def test_permission_set(self):
         """Permissions should be calculated from all groups"""
         permission1 = model.identity.Permission(u"p1", u"Permission 1")
@@ -211,6 +353,34 @@ class TestGame(SADBTest):
         assert result == timedelta(hours=7, minutes=27), \
             "Holidays aren't ignored"
     
+    def test_calendar(self):
+        """The calendar should be kept until the ignored days change"""
+        game = model.game.Game(u"Calendar Game")
+        game.ignore_weekdays = [6, 7]
+        calendar = game.calendar
+        assert game.calendar is calendar, "Calendar rebuilt"
+        assert calendar.ignore_weekdays == frozenset([6, 7]), \
+            "Wrong ignored weekdays"
+        game.ignore_dates = [date(2008, 4, 22)]
+        assert game.calendar is not calendar, "Calendar not rebuilt"
+        assert game.calendar.ignore_dates == frozenset([date(2008, 4, 22)]), \
+            "Wrong ignored dates"
+    
+    def test_batch_calculations(self):
+        """Batch calculations should match the single calculations"""
+        game = model.game.Game(u"Batch Game")
+        game.ignore_weekdays = [6, 7]
+        fed = [as_local(datetime(2008, 4, 24, 9, 0)),
+               as_local(datetime(2008, 4, 25, 18, 0)),]
+        time = as_local(datetime(2008, 4, 28, 12, 0))
+        starve_times = game.calculate_addtimedeltas(
+            fed, game.zombie_starve_timedelta)
+        for dt, starve_time in zip(fed, starve_times):
+            assert starve_time == game.calculate_addtimedelta(
+                dt, game.zombie_starve_timedelta), "Wrong starve time"
+        assert game.calculate_starved(fed, time) == [True, False], \
+            "Wrong zombies starved"
+    
     def test_registration(self):
         """Games should only be open on STATE_OPEN"""
         game = model.game.Game(u"Registration game")
@@ -249,6 +419,46 @@ class TestGame(SADBTest):
         session.flush()
         assert not user.entries, "User still has entries"
 
+class TestTokens(SADBTest):
+    def test_claim(self):
+        """Tokens should only be claimed once"""
+        token = model.tokens.new_token()
+        assert model.tokens.claim(token), "Fresh token not claimed"
+        assert not model.tokens.claim(token), "Token claimed twice"
+        model.tokens.record(token, u"/game/view/1")
+        assert model.tokens.get_result(token) == u"/game/view/1", \
+            "Wrong recorded result"
+    
+    def test_release(self):
+        """Released tokens should be claimable again"""
+        token = model.tokens.new_token()
+        model.tokens.claim(token)
+        model.tokens.release(token)
+        assert model.tokens.claim(token), "Released token not claimed"
+    
+    def test_claim_in_transaction(self):
+        """A failed claim shouldn't spoil the request's transaction"""
+        token = model.tokens.new_token()
+        model.tokens.claim(token)
+        transaction = session.begin()
+        try:
+            assert not model.tokens.claim(token), "Token claimed twice"
+            model.tokens.record(token, u"/game/view/1")
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        assert model.tokens.get_result(token) == u"/game/view/1", \
+            "Result not recorded"
+    
+    def test_rollback(self):
+        """Claims made by a request that fails should be forgotten"""
+        token = model.tokens.new_token()
+        transaction = session.begin()
+        assert model.tokens.claim(token), "Fresh token not claimed"
+        transaction.rollback()
+        assert model.tokens.claim(token), "Rolled back claim stuck"
+
 class TestGameplay(SADBTest):
     def setUp(self):
         super(TestGameplay, self).setUp()
@@ -448,3 +658,256 @@ class TestGameplay(SADBTest):
         self.game.update(report_time)
         assert not self.entry1.is_dead, "OZ should not be dead!"
         assert not self.entry2.is_dead, "Z2 should not be dead!"
+    
+    def test_update_starves_only_hungry(self):
+        """Updates should only starve zombies that have run out of time"""
+        self._choose_oz()
+        self._start_game()
+        kill_time = as_local(datetime(2008, 4, 22, 14, 15))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        update_time = as_local(datetime(2008, 4, 24, 14, 30))
+        self.game.update(update_time)
+        assert self.entry2.is_undead, "Recently infected zombie starved"
+        assert self.entry1.is_dead, "Hungry original zombie did not starve"
+        assert self.entry1.state == model.game.PlayerEntry.STATE_DEAD_OZ, \
+            "Wrong death state"
+        assert self.entry1.starve_date == \
+            kill_time + self.game.zombie_starve_timedelta, \
+            "Wrong starve date"
+        assert self.game.in_progress, "Game ended prematurely"
+    
+    def test_next_transition(self):
+        """Updates should remember when the next transition is due"""
+        self._choose_oz()
+        self._start_game()
+        start_time = as_local(datetime(2008, 4, 21, 14, 15))
+        self.game.update(as_local(datetime(2008, 4, 21, 15, 0)))
+        assert self.game.next_transition == \
+            start_time + self.game.zombie_starve_timedelta, \
+            "Wrong next transition"
+        kill_time = as_local(datetime(2008, 4, 21, 16, 0))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        assert self.game.next_transition is None, \
+            "Kill does not invalidate next transition"
+        self.game.update(kill_time)
+        assert self.game.next_transition == \
+            kill_time + self.game.human_undead_timedelta, \
+            "Next transition ignores infection"
+    
+    def test_deadlines(self):
+        """Entries should keep their projected starve and turn times"""
+        self._choose_oz()
+        self._start_game()
+        start_time = as_local(datetime(2008, 4, 21, 14, 15))
+        assert self.entry1.starve_at == \
+            start_time + self.game.zombie_starve_timedelta, \
+            "Original zombie has wrong starve time"
+        kill_time = as_local(datetime(2008, 4, 21, 16, 0))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        turn_time = kill_time + self.game.human_undead_timedelta
+        assert self.entry1.starve_at == \
+            kill_time + self.game.zombie_starve_timedelta, \
+            "Kill does not extend starve time"
+        assert self.entry2.turn_at == turn_time, "Victim has wrong turn time"
+        assert self.entry2.starve_at is None, "Infected can starve"
+        self.game.update(turn_time)
+        assert self.entry2.is_undead, "Victim does not turn"
+        assert self.entry2.turn_at is None, "Zombie can turn"
+        assert self.entry2.starve_at == \
+            turn_time + self.game.zombie_starve_timedelta, \
+            "New zombie has wrong starve time"
+    
+    def test_summary(self):
+        """Game summaries should follow changes to entries"""
+        summary = self.game.summary
+        assert summary.human_count == 3, "Wrong human count"
+        assert summary.oz_entry_id is None, "Phantom original zombie"
+        self._choose_oz()
+        self._start_game()
+        kill_time = as_local(datetime(2008, 4, 21, 16, 0))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        summary = self.game.summary
+        assert summary.version > 0, "Summary version not bumped"
+        assert summary.modified is not None, "No modification time"
+        assert summary.human_count == 1, "Wrong human count"
+        assert summary.zombie_count == 1, "Wrong zombie count"
+        assert summary.infected_count == 1, "Wrong infected count"
+        assert summary.oz_entry_id == self.entry1.entry_id, \
+            "Wrong original zombie"
+        assert summary.last_event == kill_time + \
+            self.game.human_undead_timedelta, "Wrong last event"
+    
+    def test_summary_refresh(self):
+        """Summaries should only be stored once the writer's request is over"""
+        from sqlalchemy import select
+        from hvz.model.summary import game_summaries_table
+        columns = game_summaries_table.c
+        query = select([columns.stale, columns.human_count],
+                       columns.game_id == self.game.game_id)
+        row = session.execute(query).fetchone()
+        assert row is not None, "Game created without a summary"
+        assert row['stale'], "New summary not stale"
+        self.game.summary
+        row = session.execute(query).fetchone()
+        assert row['stale'], "Reading the summary wrote it"
+        model.transactions.begin_request()
+        try:
+            self._choose_oz()
+            session.flush()
+        finally:
+            model.transactions.end_request()
+        row = session.execute(query).fetchone()
+        assert not row['stale'], "Summary not refreshed after the request"
+        assert row['human_count'] == 2, "Refreshed summary has wrong count"
+    
+    def test_summary_rename(self):
+        """Renaming a player should change the summary version"""
+        version = self.game.summary.version
+        self.entry1.player.display_name = u"Renamed"
+        session.flush()
+        assert self.game.summary.version > version, \
+            "Summary version not bumped"
+    
+    def test_report_kill_retries(self):
+        """Kill reports should retry when the victim changes underneath"""
+        self._choose_oz()
+        self._start_game()
+        # Requests run inside a transaction, which a retry must not spoil
+        transaction = session.begin()
+        try:
+            # Change the victim behind the session's back
+            entries_table = model.game.entries_table
+            session.execute(entries_table.update(
+                entries_table.c.entry_id == self.entry2.entry_id,
+                values={'version': entries_table.c.version + 1}))
+            kill_time = as_local(datetime(2008, 4, 21, 16, 0))
+            self.entry1.report_kill(self.entry2, kill_time, kill_time)
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        assert self.entry2.is_infected, "Victim not infected"
+        assert self.entry1.kills == 1, "Kill counted more than once"
+    
+    def test_roster(self):
+        """The roster should load players and killers in one query"""
+        self._choose_oz()
+        self._start_game()
+        kill_time = as_local(datetime(2008, 4, 22, 14, 15))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        session.flush()
+        session.clear()
+        game = model.game.Game.query.get(self.game.game_id)
+        counter = QueryCounter()
+        counter.start()
+        try:
+            roster = model.game.PlayerEntry.roster_query(game).all()
+            names = [entry.player.display_name for entry in roster]
+            killers = [entry.killed_by for entry in roster]
+        finally:
+            counter.stop()
+        assert len(counter) == 1, \
+            "Roster took %i queries" % (len(counter))
+        assert names == sorted(names), "Roster not sorted by name"
+        assert killers[names.index(u"Bean")].display_name == u"Ender", \
+            "Wrong killer"
+    
+    def test_roster_query(self):
+        """Roster pages should be sorted and filtered by the database"""
+        self._choose_oz()
+        self._start_game()
+        kill_time = as_local(datetime(2008, 4, 22, 14, 15))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        session.flush()
+        roster_query = model.game.PlayerEntry.roster_query
+        query = roster_query(self.game, order='kills', reverse=True)
+        assert list(query)[0] is self.entry1, "Not sorted by kills"
+        assert list(query[1:]) == [self.entry3, self.entry2], \
+            "Ties not broken by entry"
+        humans = list(roster_query(self.game, faction='human'))
+        assert humans == [self.entry3], "Wrong humans"
+        # The hidden original zombie should pass for a human
+        humans = list(roster_query(self.game, faction='human', show_oz=False))
+        assert humans == [self.entry3, self.entry1], "Original zombie shown"
+        query = roster_query(self.game, order='kills', reverse=True,
+                             show_oz=False)
+        assert list(query) == [self.entry3, self.entry2, self.entry1], \
+            "Original zombie's kills shown"
+        try:
+            roster_query(self.game, order='password')
+        except ValueError:
+            pass
+        else:
+            self.fail("Unknown order accepted")
+    
+    def test_event_rebuild(self):
+        """Replaying the event log should restore entries"""
+        self._choose_oz()
+        self._start_game()
+        kill_time = as_local(datetime(2008, 4, 21, 16, 0))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        session.flush()
+        kinds = [row['kind'] for row in
+                 model.events.history(self.game.game_id)]
+        assert kinds[-2:] == [model.events.KIND_KILL,
+                              model.events.KIND_INFECT], \
+            "Kill not logged"
+        # Clobber the victim
+        entries_table = model.game.entries_table
+        session.execute(entries_table.update(
+            entries_table.c.entry_id == self.entry2.entry_id,
+            values={'state': model.game.PlayerEntry.STATE_HUMAN,
+                    'death_date': None}))
+        game_ids = model.events.rebuild_entries(self.game.game_id)
+        assert game_ids == set([self.game.game_id]), "Wrong games rebuilt"
+        session.expire(self.entry2)
+        assert self.entry2.is_infected, "Victim not restored"
+        assert self.entry2.death_date == \
+            kill_time + self.game.human_undead_timedelta, \
+            "Victim's death date not restored"
+    
+    def test_force_entries(self):
+        """Bulk forcing should match forcing each entry"""
+        self._choose_oz()
+        self._start_game()
+        time = as_local(datetime(2008, 4, 22, 14, 15))
+        entry_ids = [self.entry2.entry_id, self.entry3.entry_id]
+        count = self.game.force_entries('infected', entry_ids, time)
+        assert count == 2, "Wrong number of entries forced"
+        assert self.entry2.is_infected and self.entry3.is_infected, \
+            "Entries not infected"
+        assert self.entry2.turn_at == \
+            time + self.game.human_undead_timedelta, "Wrong turn time"
+        assert self.entry1.is_original_zombie, "Unselected entry changed"
+        # Forcing again shouldn't touch anyone
+        count = self.game.force_entries('infected', entry_ids, time)
+        assert count == 0, "Infected entries forced again"
+        # Original zombies stay original when they die
+        self.game.force_entries('dead', time=time)
+        assert self.entry1.state == model.game.PlayerEntry.STATE_DEAD_OZ, \
+            "Original zombie lost"
+        assert self.entry2.state == model.game.PlayerEntry.STATE_DEAD, \
+            "Infected entry not dead"
+        assert self.entry2.starve_at is None, "Lingering starve projection"
+        self.game.force_entries('reset')
+        assert self.entry1.is_human and self.entry1.kills == 0, \
+            "Entry not reset"
+    
+    def test_set_deletion(self):
+        """Deleting a game should remove its rows from every table"""
+        self._choose_oz()
+        self._start_game()
+        game_id = self.game.game_id
+        self.game.summary
+        # Requests run inside a transaction, which the delete must not end
+        transaction = session.begin()
+        try:
+            self.game.force_entries('infected', [self.entry2.entry_id])
+            self.game.delete()
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        assert model.game.Game.query.get(game_id) is None, "Game not deleted"
+        assert not model.events.history(game_id), "Events not deleted"
+        assert not self.user1.entries, "User still has entries"
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+#   test_projector.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Test game projections"""
+
+from datetime import datetime
+import random
+import unittest
+
+from turbogears.database import session
+
+from hvz import model, projector
+from hvz.model.dates import as_local
+from hvz.projector import Snapshot, simulate
+from hvz.tests.test_model import SADBTest
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__all__ = ['TestSimulation',
+           'TestModels',
+           'TestGameProjection',]
+
+class TestSimulation(unittest.TestCase):
+    def test_no_kills(self):
+        """Zombies that never kill should starve on schedule"""
+        snapshot = Snapshot(None, 10, [5.0, 20.0], [2.0], 13, 48.0, 1.0)
+        model = projector.PerZombieRate(0)
+        winner, hours = simulate(snapshot, model, random.Random(1), 1000)
+        assert winner == 'human', "Humans should win"
+        assert hours == 50.0, "Wrong end time: %r" % (hours)
+    
+    def test_horizon(self):
+        """Runs past the horizon should be undecided"""
+        snapshot = Snapshot(None, 10, [5.0, 20.0], [], 12, 48.0, 1.0)
+        model = projector.PerZombieRate(0)
+        assert simulate(snapshot, model, random.Random(1), 10) == \
+            (None, 10), "Run wasn't cut off"
+    
+    def test_zombie_win(self):
+        """Hungry zombies should eventually kill everyone"""
+        snapshot = Snapshot(None, 200, [48.0] * 10, [], 210, 48.0, 1.0)
+        model = projector.PerZombieRate(24)
+        rng = random.Random(1)
+        for i in xrange(20):
+            winner, hours = simulate(snapshot, model, rng, 1000)
+            assert winner == 'zombie', "Zombies should win"
+            assert hours > 1.0, "Game ended before the last human turned"
+    
+    def test_repeatable(self):
+        """Runs with the same seed should match"""
+        snapshot = Snapshot(None, 100, [10.0, 30.0, 47.0], [0.5], 104,
+                            48.0, 1.0)
+        model = projector.MassActionRate(1)
+        results = [[simulate(snapshot, model, random.Random(seed), 1000)
+                    for seed in xrange(10)] for i in xrange(2)]
+        assert results[0] == results[1], "Seeded runs differ"
+
+class TestModels(unittest.TestCase):
+    def test_estimate(self):
+        """Fitting should use the kills per undead day"""
+        snapshot = Snapshot(None, 90, [], [], 100, 48.0, 1.0,
+                            kills=10, undead_hours=120.0, elapsed_hours=48.0)
+        assert projector.PerZombieRate.estimate(snapshot).rate == 2.0, \
+            "Wrong per-zombie rate"
+        assert projector.ConstantRate.estimate(snapshot).rate == 5.0, \
+            "Wrong constant rate"
+    
+    def test_estimate_default(self):
+        """Fitting a game without kills should give the default rate"""
+        snapshot = Snapshot(None, 100, [48.0], [], 101, 48.0, 1.0)
+        model = projector.PerZombieRate.estimate(snapshot)
+        assert model.rate == projector.DEFAULT_RATE, "Wrong default rate"
+
+class TestGameProjection(SADBTest):
+    def setUp(self):
+        super(TestGameProjection, self).setUp()
+        self.game = model.game.Game(u"Projected game")
+        self.entry1 = model.game.PlayerEntry(self.game,
+            model.identity.User(u"Spock"))
+        self.entry2 = model.game.PlayerEntry(self.game,
+            model.identity.User(u"Kirk"))
+        self.entry3 = model.game.PlayerEntry(self.game,
+            model.identity.User(u"McCoy"))
+        session.flush()
+        while self.game.state < model.game.Game.STATE_CHOOSE_ZOMBIE:
+            self.game.next_state()
+        self.entry1.make_original_zombie()
+        while self.game.state < model.game.Game.STATE_STARTED:
+            self.game.next_state(as_local(datetime(2008, 4, 21, 14, 0)))
+        kill_time = as_local(datetime(2008, 4, 21, 16, 0))
+        self.entry1.kill(self.entry2, kill_time, kill_time)
+        self.time = as_local(datetime(2008, 4, 21, 16, 30))
+    
+    def test_snapshot(self):
+        """Snapshots should read the game's entries"""
+        snapshot = Snapshot.from_game(self.game, self.time)
+        assert snapshot.players == 3, "Wrong number of players"
+        assert snapshot.humans == 1, "Wrong number of humans"
+        assert snapshot.zombies == [47.5], \
+            "Wrong zombie deadlines: %r" % (snapshot.zombies)
+        assert snapshot.infected == [0.5], \
+            "Wrong turn times: %r" % (snapshot.infected)
+        assert snapshot.kills == 1, "Wrong number of kills"
+        assert snapshot.undead_hours == 2.5, "Wrong undead time"
+        assert snapshot.elapsed_hours == 2.5, "Wrong elapsed time"
+    
+    def test_project(self):
+        """Projecting a game without kills should starve the zombies"""
+        result = projector.project(self.game, projector.PerZombieRate(0),
+                                   runs=10, processes=0, seed=1,
+                                   time=self.time)
+        assert result.runs == 10, "Wrong number of runs"
+        assert result.probability('human') == 1.0, "Humans should win"
+        assert result.end_hours['human'] == [48.5] * 10, \
+            "Wrong end times: %r" % (result.end_hours['human'])
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+#   test_widgets.py
+#   TurboHvZ
+#
+#   Copyright (C) 2008 Ross Light
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Test the grid renderer"""
+
+import unittest
+
+from hvz.widgets import CustomDataGrid
+
+__author__ = 'Ross Light'
+__date__ = 'October 16, 2026'
+__all__ = ['TestCustomDataGrid',]
+
+class _Row(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class TestCustomDataGrid(unittest.TestCase):
+    def setUp(self):
+        self.grid = CustomDataGrid(columns=['id', 'name'])
+    
+    def test_cells(self):
+        """Cells should be escaped and striped"""
+        html = self.grid.render([_Row(id=1, name=u"<Ender>"),
+                                 _Row(id=2, name=None)])
+        assert '<th>ID</th>' in html, "Missing column title"
+        assert '<tr class="even"><td class="id_column">1</td>' in html, \
+            "Wrong first row"
+        assert '<td class="name_column">&lt;Ender&gt;</td>' in html, \
+            "Cell not escaped"
+        assert '<tr class="odd"><td class="id_column">2</td>' \
+               '<td class="name_column"></td></tr>' in html, \
+            "Wrong second row"
+        assert 'no_data' not in html, "No data message shown"
+    
+    def test_no_data(self):
+        """Empty grids should show the no data message"""
+        html = self.grid.render([])
+        assert '<tr class="no_data"><td colspan="2">No data</td></tr>' in \
+            html, "No data message not shown"
+    
+    def test_invalid_column(self):
+        """Unknown columns should be refused when the grid is created"""
+        class StrictGrid(CustomDataGrid):
+            accessors = {'id': CustomDataGrid.default_accessor}
+        try:
+            StrictGrid(columns=['id', 'name'])
+        except ValueError:
+            pass
+        else:
+            self.fail("Unknown column accepted")
@@ -32,9 +32,11 @@ from uuid import UUID
 import cherrypy
 import genshi
 import turbogears
-from turbogears.util import DictObj
+from turbogears.util import DictObj, request_available
 from turbojson.jsonify import encode as jsencode
 
+from hvz import cache
+
 __author__ = 'Ross Light'
 __date__ = 'March 30, 2008'
 __docformat__ = 'reStructuredText'
@@ -53,6 +55,7 @@ __all__ = ['abslink',
            'insecurelink',
            'insecureurl',
            'login_link',
+           'now',
            'plain2html',
            'pluralize',
            'register_link',
@@ -63,6 +66,7 @@ __all__ = ['abslink',
            'add_template_variables',]
 
 _nl_pattern = re.compile(r'((?:\r\n)|[\r\n])')
+_app_roots = {}
 
 def _make_app_link(base, params):
     """
@@ -91,6 +95,65 @@ def _make_app_link(base, params):
     else:
         return turbogears.url(base, params)
 
+def _get_app_root():
+    """
+    Finds the prefix that ``turbogears.url`` puts in front of absolute paths.
+    
+    The prefix only depends on the configuration and where the application is
+    mounted, so it's only worked out once for each mount point.
+    
+    :Returns: The application root, without a trailing slash
+    :ReturnType: str
+    """
+    if request_available():
+        from turbogears.controllers import check_app_root
+        check_app_root()
+        request = cherrypy.request
+        try:
+            script_name = request.wsgi_environ['SCRIPT_NAME']
+        except (AttributeError, KeyError):
+            script_name = ''
+        key = (request.app_root, script_name)
+    else:
+        key = None
+    try:
+        return _app_roots[key]
+    except KeyError:
+        root = _app_roots[key] = turbogears.url('/')[:-1]
+        return root
+
+def _cached_app_link(path_format, args, params):
+    """
+    Creates an application link, caching the quoted path.
+    
+    Links with parameters are built with `_make_app_link` as usual, but from
+    the cached path.
+    
+    :Parameters:
+        path_format : str
+            The format for the path
+        args : tuple
+            The values to quote into the path
+        params : dict
+            Additional parameters to append to the query
+    :Returns: An application link
+    :ReturnType: str
+    """
+    key = (path_format, args)
+    base = cache.links.get(key)
+    if base is None:
+        base = path_format % tuple([quote(str(arg), '') for arg in args])
+        cache.links.put(key, base)
+    if params:
+        return _make_app_link(base, params)
+    else:
+        return _get_app_root() + base
+
+def _reset_links():
+    """Forgets the cached links, since the configuration may have changed."""
+    _app_roots.clear()
+    cache.links.reset()
+
 def abslink(path):
     """
     Create an absolute URL from a pre-constructed path.
@@ -126,9 +189,8 @@ def alliance_link(alliance, action='view', **params):
     :Returns: The link to the object
     :ReturnType: str
     """
-    base = '/user/alliance/%s/%s' % (quote(action, ''),
-                                     quote(str(alliance.alliance_id), ''))
-    return _make_app_link(base, params)
+    return _cached_app_link('/user/alliance/%s/%s',
+                            (action, alliance.alliance_id), params)
 
 def bbcode(code):
     """
@@ -197,7 +259,8 @@ def display(widget, *args, **kw):
     
     Since TurboGears uses Kid, any ``widget.display(...)`` calls don't do "the
     right thing" for Genshi.  So instead, we call ``tg.display(widget, ...)``
-    and that does "the right thing".
+    and that does "the right thing".  Grids build their Genshi stream
+    directly; other widgets are rendered with Kid and parsed back in.
     
     :Parameters:
         widget : ``turbogears.widgets.Widget``
@@ -205,6 +268,9 @@ def display(widget, *args, **kw):
     :Returns: Immediately usable Genshi markup
     :ReturnType: ``genshi.core.Stream``
     """
+    from hvz.widgets import CustomDataGrid
+    if isinstance(widget, CustomDataGrid):
+        return widget.generate(*args, **kw)
     data = widget.render(format='html', *args, **kw)
     return genshi.HTML(turbogears.util.to_unicode(data))
 
@@ -315,8 +381,7 @@ def game_link(game, action='view', **params):
         pass
     else:
         game = game.game_id
-    base = '/game/%s/%s' % (quote(action, ''), quote(str(game), ''))
-    return _make_app_link(base, params)
+    return _cached_app_link('/game/%s/%s', (action, game), params)
 
 def image_link(image, **params):
     """
@@ -335,8 +400,7 @@ def image_link(image, **params):
         image_uuid = image.uuid
     else:
         image_uuid = to_uuid(image)
-    base = '/image/%s' % (quote(str(image_uuid), ''))
-    return _make_app_link(base, params)
+    return _cached_app_link('/image/%s', (image_uuid,), params)
 
 def insecurelink(path):
     """
@@ -379,11 +443,11 @@ def login_link():
 def plain2html(text):
     """
     Converts plain text into basic HTML markup.
-
+    
     This takes the plain text, escapes any special characters, then
     converts newlines into ``<br/>`` sequences, all enclosed in a
     ``<p>`` element.
-
+    
     :Parameters:
         text : str
             The text to convert
@@ -498,8 +562,19 @@ def user_link(user, action='view', **params):
         user = user.player_id
     else:
         user = user.user_id
-    base = '/user/%s/%s' % (quote(action, ''), quote(str(user), ''))
-    return _make_app_link(base, params)
+    return _cached_app_link('/user/%s/%s', (action, user), params)
+
+def now():
+    """
+    Finds the current time.
+    
+    This is the same time that the model uses for the rest of the request.
+    
+    :Returns: The UTC now
+    :ReturnType: datetime.datetime
+    """
+    from model.dates import now
+    return now()
 
 def add_template_variables(template_vars):
     """
@@ -530,6 +605,7 @@ def add_template_variables(template_vars):
                   insecurelink=insecurelink,
                   insecureurl=insecureurl,
                   jsencode=jsencode,
+                  now=now,
                   plain2html=plain2html,
                   pluralize=pluralize,
                   securelink=securelink,
@@ -537,3 +613,4 @@ def add_template_variables(template_vars):
     return template_vars.update(lookup)
 
 turbogears.view.variable_providers.append(add_template_variables)
+turbogears.startup.call_on_startup.append(_reset_links)
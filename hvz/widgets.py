@@ -21,7 +21,8 @@
 
 """Various non-form widgets for TurboHvZ"""
 
-from kid import Element
+import cherrypy
+from genshi.builder import tag
 from pkg_resources import resource_filename
 import turbogears
 from turbogears import url, widgets
@@ -79,6 +80,10 @@ class CustomDataGrid(Widget):
     """
     A highly flexible data grid table.
     
+    The grid is built directly as a Genshi stream (see `generate`), without
+    going through a template.  Each column's accessor is looked up once, when
+    the grid is created, rather than for every cell.
+    
     :CVariables:
         grid_class : str
             The CSS class to give the table
@@ -94,8 +99,9 @@ class CustomDataGrid(Widget):
             Column accessors.  Each value can be a callable or a string.  If it
             is a string, then the corresponding method in the class is used.
             Each callback takes two parameters: ``row`` and ``column``.  The
-            function is expected to return the value of the column.  The
-            special key ``*`` is called when no other column matches.
+            function is expected to return the value of the column, which may
+            be a ``genshi.builder`` element.  The special key ``*`` is called
+            when no other column matches.
     :IVariables:
         sortable : bool
             Whether to enable ``tg.paginate`` sorting
@@ -104,7 +110,6 @@ class CustomDataGrid(Widget):
     """
     name = "custom_grid"
     grid_class = "custom_grid"
-    template = "hvz.templates.widgets.customgrid"
     params = ['sortable', 'columns', 'grid_class', 'no_data_msg']
     params_doc = {'sortable': "Whether to enable tg.paginate sorting",
                   'columns': "What columns to display",
@@ -129,17 +134,46 @@ class CustomDataGrid(Widget):
         self.sortable = bool(sortable)
         self.columns = list(columns)
         self.grid_class = grid_class
+        self._compiled = {}
+        self._compile(self.columns)
     
-    def update_params(self, d):
-        super(CustomDataGrid, self).update_params(d)
-        d['get_cell'] = self.get_cell
-        d['get_column_title'] = self.get_column_title
-        d['exclude_sorting'] = frozenset(self.exclude_sorting)
+    def _compile(self, columns):
+        """
+        Finds the accessors for a list of columns, reusing earlier lookups.
+        
+        :Returns: The ``(column, accessor, cell_class)`` for each column
+        :ReturnType: list of tuple
+        """
+        key = tuple(columns)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = [(column, self.get_accessor(column), column + "_column")
+                        for column in columns]
+            self._compiled[key] = compiled
+        return compiled
+    
+    def get_accessor(self, column):
+        """
+        Retrieves the accessor for a column.
+        
+        :Parameters:
+            column : str
+                The name of the column
+        :Returns: The column's accessor, which takes a row and the column
+        :ReturnType: callable
+        """
+        default_accessor = self.accessors.get('*')
+        accessor = self.accessors.get(column, default_accessor)
+        if accessor is None:
+            raise ValueError("Invalid column: %r" % (column))
+        elif isinstance(accessor, basestring):
+            accessor = getattr(self, accessor)
+        return accessor
     
     def get_cell(self, row, column):
         """
         Retrieves the value for a cell.
-
+        
         :Parameters:
             row
                 The row to get a value for
@@ -148,13 +182,7 @@ class CustomDataGrid(Widget):
         :Returns: The column's value
         :ReturnType: str
         """
-        default_accessor = self.accessors.get('*')
-        accessor = self.accessors.get(column, default_accessor)
-        if accessor is None:
-            raise ValueError("Invalid column: %r", column)
-        elif isinstance(accessor, basestring):
-            accessor = getattr(self, accessor)
-        return accessor(row, column)
+        return self.get_accessor(column)(row, column)
     
     def get_column_title(self, column):
         """
@@ -167,6 +195,80 @@ class CustomDataGrid(Widget):
         :ReturnType: unicode
         """
         return self.column_titles.get(column, column)
+    
+    def _get_header(self, column, sortable):
+        title = self.get_column_title(column)
+        paginate = getattr(cherrypy.request, 'paginate', None)
+        if not sortable or paginate is None or \
+           column in self.exclude_sorting:
+            return title
+        if paginate.order == column:
+            reverse_link = not paginate.reversed
+            if paginate.reversed:
+                sort_class = "sort_desc"
+            else:
+                sort_class = "sort_asc"
+        else:
+            reverse_link = False
+            sort_class = None
+        return tag.a(title, class_=sort_class,
+                     href=paginate.get_href(1, column, reverse_link))
+    
+    @staticmethod
+    def _is_empty(value):
+        if isinstance(value, (list, tuple)):
+            return not value
+        elif hasattr(value, 'count') and callable(value.count):
+            return value.count() == 0
+        else:
+            return not value
+    
+    def generate(self, value=None, **params):
+        """
+        Builds the grid.
+        
+        Any of the widget's `params` (and ``name``) can be overridden.
+        
+        :Parameters:
+            value
+                The rows to display
+        :Returns: The grid's markup
+        :ReturnType: ``genshi.core.Stream``
+        """
+        name = params.get('name', self.name)
+        columns = params.get('columns', self.columns)
+        sortable = params.get('sortable', self.sortable)
+        grid_class = params.get('grid_class', self.grid_class)
+        no_data_msg = params.get('no_data_msg', self.no_data_msg)
+        compiled = self._compile(columns)
+        header = tag.tr([tag.th(self._get_header(column, sortable))
+                         for column in columns])
+        body = tag.tbody()
+        if no_data_msg is not None and self._is_empty(value):
+            body(tag.tr(tag.td(no_data_msg, colspan=len(columns)),
+                        class_="no_data"))
+        for i, row in enumerate(value or ()):
+            body(tag.tr([tag.td(accessor(row, column), class_=cell_class)
+                         for column, accessor, cell_class in compiled],
+                        class_=(i % 2 and "odd" or "even")))
+        return tag.table(tag.thead(header), body,
+                         class_=grid_class, id=name).generate()
+    
+    def render(self, value=None, format='html', **params):
+        """
+        Renders the grid to a string.
+        
+        :Parameters:
+            value
+                The rows to display
+            format : str
+                The Genshi serialization method.  ``'html'`` is rendered as
+                XHTML, to match the pages the grid is embedded in.
+        :ReturnType: unicode
+        """
+        if format == 'html':
+            format = 'xhtml'
+        return self.generate(value, **params).render(format, encoding=None)
 
 class GameList(CustomDataGrid):
     """A list of games"""
@@ -182,7 +284,7 @@ class GameList(CustomDataGrid):
                      'player_count': _("Players"),}
     accessors = {'game_id': '_get_link_col',
                  'display_name': '_get_link_col',
-                 'player_count': (lambda r, c: len(r.entries)),
+                 'player_count': (lambda r, c: r.summary.player_count),
                  '_created': _get_date_col,
                  '_started': _get_date_col,
                  '_ended': _get_date_col,
@@ -191,10 +293,7 @@ class GameList(CustomDataGrid):
     
     @staticmethod
     def _get_link_col(row, column):
-        link = Element("{http://www.w3.org/1999/xhtml}a",
-                       href=util.game_link(row))
-        link.text = getattr(row, column)
-        return link
+        return tag.a(getattr(row, column), href=util.game_link(row))
 
 class EntryList(CustomDataGrid):
     """A list of entries"""
@@ -207,8 +306,10 @@ class EntryList(CustomDataGrid):
                        '_feed_date',
                        '_starve_date',
                        'kills',
+                       'select',
                        'edit',]
-    column_titles = {'player_gid': _("Game ID"),
+    column_titles = {'select': u"",
+                     'player_gid': _("Game ID"),
                      'name': _("Player Name"),
                      '_death_date': _("Death Date"),
                      '_feed_date': _("Feed Date"),
@@ -222,6 +323,7 @@ class EntryList(CustomDataGrid):
                  '_feed_date': '_get_oz_date_col',
                  '_starve_date': '_get_oz_date_col',
                  'kills': '_get_kills_col',
+                 'select': '_get_select_col',
                  'edit': '_get_edit_col',
                  '*': CustomDataGrid.default_accessor,}
     no_data_msg = _("No players have joined yet")
@@ -237,10 +339,7 @@ class EntryList(CustomDataGrid):
     @staticmethod
     def _get_name_col(row, column):
         player = row.player
-        link = Element("{http://www.w3.org/1999/xhtml}a",
-                       href=util.user_link(player))
-        link.text = player.display_name
-        return link
+        return tag.a(player.display_name, href=util.user_link(player))
     
     def _get_affiliation_col(self, row, column):
         if not self.show_oz and row.is_original_zombie:
@@ -260,11 +359,14 @@ class EntryList(CustomDataGrid):
         else:
             return self.default_accessor(row, column)
     
+    @staticmethod
+    def _get_select_col(row, column):
+        return tag.input(type="checkbox", name="entry_ids",
+                         value=str(row.entry_id))
+    
     def _get_edit_col(self, row, column):
-        link = Element("{http://www.w3.org/1999/xhtml}a",
-                       href=url('/game/editentry', entry_id=row.entry_id))
-        link.text = _("Edit")
-        return link
+        return tag.a(_("Edit"),
+                     href=url('/game/editentry', entry_id=row.entry_id))
 
 class UserList(CustomDataGrid):
     """A list of users"""
@@ -283,10 +385,7 @@ class UserList(CustomDataGrid):
     
     @staticmethod
     def _get_display_name_col(row, column):
-        link = Element("{http://www.w3.org/1999/xhtml}a",
-                       href=util.user_link(row))
-        link.text = row.display_name
-        return link
+        return tag.a(row.display_name, href=util.user_link(row))
 
 class AllianceList(CustomDataGrid):
     """A list of alliances"""
@@ -308,14 +407,8 @@ class AllianceList(CustomDataGrid):
     
     @staticmethod
     def _get_display_name_col(row, column):
-        link = Element("{http://www.w3.org/1999/xhtml}a",
-                       href=util.alliance_link(row))
-        link.text = row.display_name
-        return link
+        return tag.a(row.display_name, href=util.alliance_link(row))
     
     @staticmethod
     def _get_owner_col(row, column):
-        link = Element("{http://www.w3.org/1999/xhtml}a",
-                       href=util.user_link(row.owner))
-        link.text = row.owner.display_name
-        return link
+        return tag.a(row.owner.display_name, href=util.user_link(row.owner))
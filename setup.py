@@ -53,6 +53,10 @@ setup(
         "TurboMail >= 2.1",
         "PIL >= 1.1.6",
     ],
+    extras_require={
+        # Batch date calculations
+        'numpy': ["numpy"],
+    },
     zip_safe=False,
     packages=packages,
     package_data=package_data,
@@ -73,6 +77,10 @@ setup(
             'start-turbohvz = hvz.commands:start',
             'turbohvz-create-perms = hvz.commands:create_permissions',
             'turbohvz-create-admin = hvz.commands:create_admin',
+            'turbohvz-backfill-deadlines = hvz.commands:backfill_deadlines',
+            'turbohvz-rebuild-entries = hvz.commands:rebuild_entries',
+            'turbohvz-project-game = hvz.commands:project_game',
+            'turbohvz-benchmark = hvz.commands:benchmark',
         ],
     },
     data_files=[('config', ['default.cfg'])],
@@ -0,0 +1,88 @@
+--
+--  upgrade_postgres_0.4-0.5.sql
+--
+--  Created by Ross Light on 10/16/26.
+--
+
+-- Upgrade entry table
+ALTER TABLE entries ADD COLUMN starve_at TIMESTAMP;
+ALTER TABLE entries ADD COLUMN turn_at TIMESTAMP;
+CREATE INDEX ix_entries_starve_at ON entries (game_id, state, starve_at);
+CREATE INDEX ix_entries_turn_at ON entries (game_id, state, turn_at);
+-- Afterwards, run turbohvz-backfill-deadlines to fill in the new columns.
+
+-- Upgrade game table
+ALTER TABLE game ADD COLUMN next_transition TIMESTAMP;
+
+-- Add update lease table
+CREATE TABLE update_leases (
+    game_id INTEGER NOT NULL REFERENCES game (game_id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    holder VARCHAR(128),
+    expires TIMESTAMP,
+    PRIMARY KEY (game_id)
+);
+
+-- Add game summary table
+CREATE TABLE game_summaries (
+    game_id INTEGER NOT NULL REFERENCES game (game_id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    version INTEGER NOT NULL,
+    stale BOOLEAN NOT NULL,
+    modified TIMESTAMP,
+    human_count INTEGER,
+    zombie_count INTEGER,
+    infected_count INTEGER,
+    dead_count INTEGER,
+    oz_entry_id INTEGER,
+    last_event TIMESTAMP,
+    winner VARCHAR(16),
+    PRIMARY KEY (game_id)
+);
+INSERT INTO game_summaries (game_id, version, stale)
+    SELECT game_id, 0, TRUE FROM game;
+
+-- Add entry versions
+ALTER TABLE entries ADD COLUMN version INTEGER;
+UPDATE entries SET version = 1;
+ALTER TABLE entries ALTER COLUMN version SET NOT NULL;
+
+-- Add form token table
+CREATE TABLE form_tokens (
+    token VARCHAR(32) NOT NULL,
+    expires TIMESTAMP,
+    result VARCHAR(1024),
+    PRIMARY KEY (token)
+);
+CREATE INDEX ix_form_tokens_expires ON form_tokens (expires);
+
+-- Add game event log
+CREATE TABLE game_events (
+    event_id SERIAL NOT NULL,
+    game_id INTEGER REFERENCES game (game_id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    entry_id INTEGER,
+    kind INTEGER,
+    occurred TIMESTAMP,
+    recorded TIMESTAMP,
+    state INTEGER,
+    death_date TIMESTAMP,
+    feed_date TIMESTAMP,
+    starve_date TIMESTAMP,
+    kills INTEGER,
+    killer_id INTEGER,
+    PRIMARY KEY (event_id)
+);
+CREATE INDEX ix_game_events_game_id ON game_events (game_id);
+
+-- Add user versions
+ALTER TABLE tg_user ADD COLUMN version INTEGER;
+UPDATE tg_user SET version = 1;
+ALTER TABLE tg_user ALTER COLUMN version SET NOT NULL;
+ALTER TABLE tg_user ADD COLUMN modified TIMESTAMP;
+
+-- Add roster sorting indices
+CREATE INDEX ix_entries_death_date ON entries (game_id, death_date, entry_id);
+CREATE INDEX ix_entries_feed_date ON entries (game_id, feed_date, entry_id);
+CREATE INDEX ix_entries_kills ON entries (game_id, kills, entry_id);
+CREATE INDEX ix_tg_user_display_name ON tg_user (display_name);